@@ -21,3 +21,18 @@ application = ProtocolTypeRouter({
         URLRouter(core.routing.websocket_urlpatterns)
     ),
 })
+
+# Clear download temp files abandoned by a previous run
+from core.drive_content import content_cache  # noqa: E402
+
+content_cache.clean()
+
+# Refresh tokens ahead of expiry, off the request path, if TOKEN_REFRESH_INTERVAL is set
+from core.token_refresh import start_token_sweeper  # noqa: E402
+
+start_token_sweeper()
+
+# Send the queued uploads a previous run left on this host
+from core.upload_queue import start_upload_queue  # noqa: E402
+
+start_upload_queue()
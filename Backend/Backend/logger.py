@@ -1,11 +1,15 @@
+import atexit
 import json
 import os
+import queue
+import random
 import socket
 import logging
 import sys
-import inspect
 from datetime import datetime
-from Backend.settings import DEBUG
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
+from Backend.settings import DEBUG, LOG_FORMAT, LOG_INFO_SAMPLE_RATE
 
 
 class EnhancedDateTimeEncoder(json.JSONEncoder):
@@ -39,53 +43,122 @@ class EnhancedDateTimeEncoder(json.JSONEncoder):
                 self.seen.remove(id(obj))
 
 
+def resolve_hostname():
+    try:
+        return socket.gethostbyname(socket.gethostname())
+    except OSError:
+        return socket.gethostname()
+
+
 class CustomLogFilter(logging.Filter):
     """Custom log filter to add additional fields to log records."""
 
+    def __init__(self, name=''):
+        super().__init__(name)
+        # Resolved once per process rather than with a DNS lookup per record
+        self.hostname = resolve_hostname()
+
     def filter(self, record):
-        record.hostname = socket.gethostbyname(socket.gethostname())
+        record.hostname = self.hostname
         return True
 
 
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per line, built from the fields log() attaches to the record."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "host": getattr(record, "hostname", None),
+            "level": record.levelname,
+            "file": getattr(record, "source_file", None),
+            "line_num": getattr(record, "line_num", None),
+            "function": getattr(record, "function", None),
+            "status_code": getattr(record, "status_code", None),
+        }
+        line = json.dumps(entry)[:-1]
+        # args and message are already JSON, so splice them in rather than re-encode
+        if getattr(record, "args_json", None):
+            line += f', "args": {record.args_json}'
+        return line + f', "message": {getattr(record, "message_json", json.dumps(record.getMessage()))}}}'
+
+
 # Set up logger
 logger = logging.getLogger('Backend')
 logger.setLevel(logging.DEBUG if DEBUG else logging.INFO)
 logger.propagate = False
 
 # Formatter for log messages
-formatter = logging.Formatter("[%(asctime)s]- host:%(hostname)s level:%(levelname)s — %(message)s",
-                              datefmt="%d/%b/%Y %H:%M:%S")
+if LOG_FORMAT == "json":
+    formatter = StructuredFormatter(datefmt="%Y-%m-%dT%H:%M:%S%z")
+else:
+    formatter = logging.Formatter("[%(asctime)s]- host:%(hostname)s level:%(levelname)s — %(message)s",
+                                  datefmt="%d/%b/%Y %H:%M:%S")
 
 # Stream handler for logging to stdout
 stdout_handler = logging.StreamHandler(sys.stdout)
 stdout_handler.setFormatter(formatter)
-logger.addHandler(stdout_handler)
+
+# Request threads only enqueue records; a listener thread formats and writes them
+log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(log_queue))
+listener = QueueListener(log_queue, stdout_handler, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
 
 # Custom log filter
 custom_filter = CustomLogFilter()
 logger.addFilter(custom_filter)
 
 
+@lru_cache(maxsize=256)
+def relative_path(filename):
+    return os.path.relpath(filename)
+
+
+def caller_args(frame):
+    """The caller's named arguments, read straight from its frame."""
+    code = frame.f_code
+    names = code.co_varnames[:code.co_argcount + code.co_kwonlyargcount]
+    values = frame.f_locals
+    return {name: values[name] for name in names if name != 'self' and name in values}
+
+
 def log(level, function, status_code=None, **kwargs):
+    # Nothing is inspected or serialized for records that won't be emitted
+    if not logger.isEnabledFor(level):
+        return
+    if level == logging.INFO and LOG_INFO_SAMPLE_RATE < 1.0 and random.random() >= LOG_INFO_SAMPLE_RATE:
+        return
+
+    frame = sys._getframe(1)
+    source_file = relative_path(frame.f_code.co_filename)
+    frame_number = frame.f_lineno
+
     # Serialize additional info with the enhanced JSON encoder
     log_message = json.dumps(kwargs, cls=EnhancedDateTimeEncoder)
 
     # Initialize args_str outside the if block to use it later
     args_str = None
     if level >= logging.ERROR:
-        frame = inspect.currentframe().f_back
-        args, _, _, values = inspect.getargvalues(frame)
-        args_dict = {arg: values[arg] for arg in args if arg != 'self'}
-        args_str = json.dumps(args_dict, cls=EnhancedDateTimeEncoder)
+        args_str = json.dumps(caller_args(frame), cls=EnhancedDateTimeEncoder)
+    del frame
 
-    source_file = os.path.relpath(inspect.stack()[1].filename)
-    frame_number = inspect.stack()[1].lineno
     status_code_str = "status_code:" + str(status_code) if status_code is not None else "status_code:N/A"
 
     # Construct log_details with or without args based on level
-    if args_str:
+    if LOG_FORMAT == "json":
+        log_details = log_message
+    elif args_str:
         log_details = f"file:{source_file} - line_num:{frame_number} - function:{function} - {status_code_str} - args:{args_str} - message:{log_message}"
     else:
         log_details = f"file:{source_file} - line_num:{frame_number} - function:{function} - {status_code_str} - message:{log_message}"
 
-    logger.log(level, log_details)
\ No newline at end of file
+    logger.log(level, log_details, extra={
+        "source_file": source_file,
+        "line_num": frame_number,
+        "function": function,
+        "status_code": status_code,
+        "args_json": args_str,
+        "message_json": log_message,
+    })
@@ -4,6 +4,8 @@ Generated by 'django-admin startproject' using Django 5.1.6.
 """
 
 import os
+import socket
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 from urllib.parse import urlparse
@@ -17,12 +19,109 @@ load_dotenv(os.path.join(BASE_DIR, ".env"))
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 
+# Google endpoints; point both at benchmarks/fake_google.py for local load tests
+GOOGLE_API_BASE_URL = os.getenv("GOOGLE_API_BASE_URL", "https://www.googleapis.com").rstrip("/")
+GOOGLE_OAUTH2_BASE_URL = os.getenv("GOOGLE_OAUTH2_BASE_URL", "https://oauth2.googleapis.com").rstrip("/")
+
+# Keep-alive connection pools for all Google traffic (Drive API, token endpoint,
+# userinfo): limits apply to each of the httplib2, requests and httpx pools
+GOOGLE_HTTP_MAX_CONNECTIONS = int(os.getenv("GOOGLE_HTTP_MAX_CONNECTIONS", "200"))
+GOOGLE_HTTP_MAX_KEEPALIVE = int(os.getenv("GOOGLE_HTTP_MAX_KEEPALIVE", "50"))
+GOOGLE_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("GOOGLE_HTTP_KEEPALIVE_EXPIRY", "60"))
+GOOGLE_HTTP_TIMEOUT = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "60"))
+
+# Drive call scheduling, per process: token buckets (calls/second and burst; 0
+# disables a bucket), the longest a call may queue before 429ing back to the
+# client, and retries with jittered exponential backoff. Divide the global rate
+# by the number of worker processes sharing a Google Cloud project's quota.
+DRIVE_RATE_LIMIT_GLOBAL = float(os.getenv("DRIVE_RATE_LIMIT_GLOBAL", "200"))
+DRIVE_RATE_LIMIT_GLOBAL_BURST = float(os.getenv("DRIVE_RATE_LIMIT_GLOBAL_BURST", "400"))
+DRIVE_RATE_LIMIT_PER_USER = float(os.getenv("DRIVE_RATE_LIMIT_PER_USER", "25"))
+DRIVE_RATE_LIMIT_PER_USER_BURST = float(os.getenv("DRIVE_RATE_LIMIT_PER_USER_BURST", "50"))
+DRIVE_RATE_LIMIT_MAX_WAIT = float(os.getenv("DRIVE_RATE_LIMIT_MAX_WAIT", "10"))
+DRIVE_RETRY_MAX_ATTEMPTS = int(os.getenv("DRIVE_RETRY_MAX_ATTEMPTS", "5"))
+DRIVE_RETRY_BASE_DELAY = float(os.getenv("DRIVE_RETRY_BASE_DELAY", "0.5"))
+DRIVE_RETRY_MAX_DELAY = float(os.getenv("DRIVE_RETRY_MAX_DELAY", "16"))
+
+# Resumable Drive uploads: peak memory per upload is bounded by the chunk size,
+# which Google requires to be a multiple of 256 KiB.
+DRIVE_UPLOAD_CHUNK_SIZE = max(
+    256 * 1024,
+    int(os.getenv("DRIVE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024))) // (256 * 1024) * (256 * 1024)
+)
+
+# Queued uploads (?mode=async): files are spooled to this host's disk and sent
+# to Drive by a pool of threads per process; more pending jobs than this are refused.
+# Jobs are recorded against QUEUE_HOST (set it to a stable name where hostnames
+# change across restarts). An uploading job with no progress for STALE_AFTER
+# seconds belonged to a process that stopped, and is queued again when a
+# process on its host starts
+DRIVE_UPLOAD_QUEUE_WORKERS = int(os.getenv("DRIVE_UPLOAD_QUEUE_WORKERS", "4"))
+DRIVE_UPLOAD_QUEUE_MAX_PENDING = int(os.getenv("DRIVE_UPLOAD_QUEUE_MAX_PENDING", "1000"))
+DRIVE_UPLOAD_QUEUE_STALE_AFTER = int(os.getenv("DRIVE_UPLOAD_QUEUE_STALE_AFTER", "600"))
+DRIVE_UPLOAD_QUEUE_HOST = os.getenv("DRIVE_UPLOAD_QUEUE_HOST") or socket.gethostname()
+DRIVE_UPLOAD_SPOOL_DIR = os.getenv(
+    "DRIVE_UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "drive-upload-spool")
+)
+
+# Proactive token refresh: tokens expiring within TOKEN_REFRESH_HORIZON seconds are
+# refreshed, TOKEN_REFRESH_CONCURRENCY at a time and written back in batches, by
+# `manage.py refresh_tokens` or, when TOKEN_REFRESH_INTERVAL is set (it needs
+# REDIS_URL so processes take turns), by a thread in each ASGI process.
+# A token whose refresh failed is left alone for TOKEN_REFRESH_FAILURE_BACKOFF seconds.
+TOKEN_REFRESH_INTERVAL = float(os.getenv("TOKEN_REFRESH_INTERVAL", "0"))
+TOKEN_REFRESH_HORIZON = float(os.getenv("TOKEN_REFRESH_HORIZON", "600"))
+TOKEN_REFRESH_CONCURRENCY = int(os.getenv("TOKEN_REFRESH_CONCURRENCY", "8"))
+TOKEN_REFRESH_BATCH_SIZE = int(os.getenv("TOKEN_REFRESH_BATCH_SIZE", "500"))
+TOKEN_REFRESH_FAILURE_BACKOFF = float(os.getenv("TOKEN_REFRESH_FAILURE_BACKOFF", "900"))
+
+# Drive change push (ws/drive/changes/): each subscribed user's changes feed is
+# polled this often, backing off to the maximum while nothing changes. The maximum
+# sets an idle subscriber's cost (3600 / max changes.list calls an hour) and how
+# late changes made outside this process can show up
+DRIVE_CHANGES_POLL_INTERVAL = float(os.getenv("DRIVE_CHANGES_POLL_INTERVAL", "2"))
+DRIVE_CHANGES_MAX_POLL_INTERVAL = float(os.getenv("DRIVE_CHANGES_MAX_POLL_INTERVAL", "300"))
+
+# Batch uploads: files per request and concurrent transfers per batch
+DRIVE_BATCH_UPLOAD_MAX_FILES = int(os.getenv("DRIVE_BATCH_UPLOAD_MAX_FILES", "500"))
+DRIVE_BATCH_UPLOAD_CONCURRENCY = int(os.getenv("DRIVE_BATCH_UPLOAD_CONCURRENCY", "8"))
+DATA_UPLOAD_MAX_NUMBER_FILES = DRIVE_BATCH_UPLOAD_MAX_FILES
+
+# Bulk metadata operations: items per request and parallel batch requests; failed
+# calls are resent under the DRIVE_RETRY_* settings above
+DRIVE_BULK_MAX_ITEMS = int(os.getenv("DRIVE_BULK_MAX_ITEMS", "10000"))
+DRIVE_BULK_CONCURRENCY = int(os.getenv("DRIVE_BULK_CONCURRENCY", "4"))
+
+# Downloads: on-disk LRU cache of file contents shared by every worker, the
+# largest file it will hold, how long file metadata is trusted before Drive
+# is asked again, and the age past which a partly written entry is abandoned
+DRIVE_CONTENT_CACHE_DIR = os.getenv(
+    "DRIVE_CONTENT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "drive-content-cache")
+)
+DRIVE_CONTENT_CACHE_MAX_BYTES = int(os.getenv("DRIVE_CONTENT_CACHE_MAX_BYTES", str(1024 ** 3)))
+DRIVE_CONTENT_CACHE_MAX_FILE_BYTES = int(os.getenv("DRIVE_CONTENT_CACHE_MAX_FILE_BYTES", str(256 * 1024 ** 2)))
+DRIVE_CONTENT_METADATA_TTL = int(os.getenv("DRIVE_CONTENT_METADATA_TTL", "30"))
+DRIVE_CONTENT_CACHE_TEMP_MAX_AGE = int(os.getenv("DRIVE_CONTENT_CACHE_TEMP_MAX_AGE", "3600"))
+
+# API response compression (brotli preferred, gzip fallback)
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+
+# Per-request phase timings in a Server-Timing header; bearer token required by /api/metrics/ when set
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "True") == "True"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY", "django-insecure-0$nv*r_sgf7qz)a94kdk55y(7wax%tz5uj+q@3a)$*+hees98y")
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = os.getenv("DEBUG", "True") == "True"
 
+# Logging: "text" or "json" lines, and the fraction of INFO records to keep
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_INFO_SAMPLE_RATE = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))
+
 # ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "127.0.0.1,localhost").split(",")
 ALLOWED_HOSTS = ['*']
 
@@ -46,7 +145,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.responses.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -73,14 +174,64 @@ TEMPLATES = [
     },
 ]
 
+# Cache Configuration (Redis when REDIS_URL is set, so every worker shares it)
+REDIS_URL = os.getenv("REDIS_URL")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
 # ASGI & WebSocket Configuration
 WSGI_APPLICATION = 'Backend.wsgi.application'
 ASGI_APPLICATION = "Backend.asgi.application"
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    },
-}
+# With REDIS_URL set, groups are shared across every worker process and host
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "core.layers.BatchingRedisPubSubChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+                "publish_batch_size": int(os.getenv("CHANNEL_PUBLISH_BATCH_SIZE", "100")),
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
+
+# Chat fan-out: coalescing window for ?coalesce=1 connections, cap on message bytes
+# queued or sent to a connection since the client's last frame
+CHAT_COALESCE_INTERVAL_MS = float(os.getenv("CHAT_COALESCE_INTERVAL_MS", "10"))
+CHAT_SEND_BUFFER_BYTES = int(os.getenv("CHAT_SEND_BUFFER_BYTES", str(1024 * 1024)))
+
+# Chat history: messages are buffered and bulk inserted once CHAT_HISTORY_FLUSH_SIZE
+# are waiting or the oldest has waited CHAT_HISTORY_FLUSH_INTERVAL_MS (at most
+# CHAT_HISTORY_MAX_PENDING are buffered). The last CHAT_HISTORY_REPLAY messages of
+# each room (0 disables replay) are kept in memory and sent to members on connect,
+# for up to CHAT_HISTORY_ROOMS rooms per process and CHAT_HISTORY_IDLE_TTL seconds
+# after a room's last member here leaves.
+CHAT_HISTORY_FLUSH_SIZE = int(os.getenv("CHAT_HISTORY_FLUSH_SIZE", "200"))
+CHAT_HISTORY_FLUSH_INTERVAL_MS = float(os.getenv("CHAT_HISTORY_FLUSH_INTERVAL_MS", "1000"))
+CHAT_HISTORY_MAX_PENDING = int(os.getenv("CHAT_HISTORY_MAX_PENDING", "10000"))
+CHAT_HISTORY_REPLAY = int(os.getenv("CHAT_HISTORY_REPLAY", "50"))
+CHAT_HISTORY_ROOMS = int(os.getenv("CHAT_HISTORY_ROOMS", "1000"))
+CHAT_HISTORY_IDLE_TTL = float(os.getenv("CHAT_HISTORY_IDLE_TTL", "300"))
+
+# In-process cache of ready-to-use Google credentials, keyed by user email
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", "1024"))
+CREDENTIAL_CACHE_TTL = float(os.getenv("CREDENTIAL_CACHE_TTL", "300"))
 
 # Database Configuration (PostgreSQL)
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -104,7 +255,9 @@ else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': BASE_DIR / 'db.sqlite3',
+            'NAME': os.getenv("SQLITE_PATH", BASE_DIR / 'db.sqlite3'),
+            # Wait for concurrent writers instead of failing with "database is locked"
+            'OPTIONS': {'timeout': 20, 'transaction_mode': 'IMMEDIATE'},
         }
     }
 
@@ -0,0 +1,177 @@
+"""
+Benchmark: pushing Drive changes over ws/drive/changes/ against dashboards polling.
+
+Starts the fake Google backend and daphne as bench_load.py does, signs in
+--users users and keeps --connections dashboards open for each of them
+for --duration seconds in each mode. Meanwhile a file is added straight to
+a random user's fake Drive every --change-every seconds, as another device
+would:
+
+  poll  every dashboard GETs /api/drive/files/ every --poll-interval seconds
+  push  every dashboard holds a ws/drive/changes/ WebSocket
+
+Reports the calls that reached Google, the bytes sent to dashboards and
+how long a new file took to show up on them.
+
+    cd Backend && python benchmarks/bench_changes.py --users 20 --connections 3 --duration 30
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_load import WebSocket, percentile, sign_in, start_stack  # noqa: E402
+
+WATCHED_ROUTES = ("GET /drive/v3/files", "GET /drive/v3/changes", "GET /drive/v3/changes/startPageToken")
+
+
+class Dashboards:
+    """What the dashboards saw: bytes received and the delay before each new file showed up."""
+
+    def __init__(self):
+        self.added_at = {}
+        self.seen = set()
+        self.delays = []
+        self.bytes = 0
+
+    def saw(self, dashboard, file_ids):
+        for file_id in file_ids:
+            if file_id in self.added_at and (dashboard, file_id) not in self.seen:
+                self.seen.add((dashboard, file_id))
+                self.delays.append(time.perf_counter() - self.added_at[file_id])
+
+
+async def make_changes(fake_url, users, every, stop, dashboards):
+    async with httpx.AsyncClient(base_url=fake_url) as client:
+        while not stop.is_set():
+            user = random.choice(users)
+            added_at = time.perf_counter()
+            response = await client.post(
+                "/upload/drive/v3/files?uploadType=media", content=b"change",
+                headers={"Authorization": f"Bearer fake.0.{user}", "Content-Type": "text/plain"},
+            )
+            dashboards.added_at[response.json()["id"]] = added_at
+            await asyncio.sleep(every)
+
+
+async def poll_dashboard(client, user, dashboard, interval, stop, dashboards):
+    while not stop.is_set():
+        response = await client.get("/api/drive/files/?page_size=1000", headers={"User-Email": user})
+        dashboards.bytes += len(response.content)
+        if response.status_code == 200:
+            dashboards.saw(dashboard, [f["id"] for f in response.json()["files"]])
+        await asyncio.sleep(interval)
+
+
+async def push_dashboard(port, user, dashboard, dashboards, ready):
+    ws = await WebSocket.connect("127.0.0.1", port, f"/ws/drive/changes/?user_email={user}")
+    try:
+        while True:
+            text = await ws.recv()
+            dashboards.bytes += len(text)
+            frame = json.loads(text)
+            if frame["type"] == "ready":
+                ready.release()
+            elif frame["type"] == "drive_changes":
+                dashboards.saw(dashboard, [f["id"] for f in frame["added"] + frame["modified"]])
+    finally:
+        await ws.close()
+
+
+async def run_mode(mode, args, fake_url, users):
+    dashboards = Dashboards()
+    stop = asyncio.Event()
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as client:
+        before = httpx.get(f"{fake_url}/__stats").json()
+        tasks = []
+        ready = asyncio.Semaphore(0)
+        for n, user in enumerate(users):
+            for c in range(args.connections):
+                dashboard = (n, c)
+                if mode == "poll":
+                    tasks.append(asyncio.create_task(
+                        poll_dashboard(client, user, dashboard, args.poll_interval, stop, dashboards)
+                    ))
+                else:
+                    tasks.append(asyncio.create_task(push_dashboard(args.port, user, dashboard, dashboards, ready)))
+        # Changes start once every subscription has taken its feed position
+        if mode == "push":
+            for _ in tasks:
+                await ready.acquire()
+        await asyncio.sleep(1)
+        changer = asyncio.create_task(make_changes(fake_url, users, args.change_every, stop, dashboards))
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await changer
+        # Give the last changes one more poll to arrive
+        await asyncio.sleep(max(args.poll_interval, args.max_poll_interval) * 1.5 + 1)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        after = httpx.get(f"{fake_url}/__stats").json()
+
+    calls = {route: after.get(route, 0) - before.get(route, 0) for route in WATCHED_ROUTES}
+    delays = sorted(dashboards.delays)
+    expected = len(dashboards.added_at) * args.connections
+    return {
+        "calls": calls,
+        "bytes": dashboards.bytes,
+        "delivered": f"{len(delays)}/{expected}",
+        "p50": percentile(delays, 0.5) * 1000 if delays else 0,
+        "p95": percentile(delays, 0.95) * 1000 if delays else 0,
+    }
+
+
+async def sign_in_users(port, users):
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+        await sign_in(client, users)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--connections", type=int, default=3, help="dashboards open per user")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--poll-interval", type=float, default=3, help="dashboard polling interval (poll mode)")
+    parser.add_argument("--max-poll-interval", type=float, default=5, help="DRIVE_CHANGES_MAX_POLL_INTERVAL (push mode)")
+    parser.add_argument("--change-every", type=float, default=2, help="seconds between new files")
+    parser.add_argument("--files", type=int, default=200, help="files in each fake Drive")
+    parser.add_argument("--latency-ms", type=float, default=20, help="fake Google latency")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--fake-port", type=int, default=8765)
+    args = parser.parse_args()
+    args.jitter_ms, args.error_rate, args.error_status = 0, 0, 503
+    args.redis_url, args.database_url = None, None
+
+    os.environ["DRIVE_CHANGES_MAX_POLL_INTERVAL"] = str(args.max_poll_interval)
+    users = [f"user{n}@example.com" for n in range(args.users)]
+    with tempfile.TemporaryDirectory() as workdir:
+        fake, server, fake_url = start_stack(args, workdir)
+        try:
+            asyncio.run(sign_in_users(args.port, users))
+            results = {mode: asyncio.run(run_mode(mode, args, fake_url, users)) for mode in ("poll", "push")}
+        finally:
+            server.terminate()
+            fake.terminate()
+
+    print(f"{args.users} users x {args.connections} dashboards, {args.duration:.0f}s, a new file every "
+          f"{args.change_every}s, {args.files} files per Drive\n")
+    print(f"{'mode':<6} {'files.list':>10} {'changes.list':>13} {'startToken':>11} {'bytes out':>11} "
+          f"{'delivered':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, result in results.items():
+        calls = [result["calls"][route] for route in WATCHED_ROUTES]
+        print(f"{mode:<6} {calls[0]:>10} {calls[1]:>13} {calls[2]:>11} {result['bytes']:>11} "
+              f"{result['delivered']:>10} {result['p50']:>8.0f} {result['p95']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Load test for the cross-process channel layer (core.layers).
+
+For each worker count W, W processes each open C consumer channels in one
+chat group, then a publisher sends N group messages. Every message is
+delivered W*C times. Reports delivered messages/sec and fan-out latency
+(group_send to receive in each member) as W grows.
+
+Runs against the bundled pubsub_broker stand-in unless --redis-url is given.
+
+    cd Backend && python benchmarks/bench_channel_layer.py --workers 1 2 4 --consumers 50 --messages 2000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.layers import BatchingRedisPubSubChannelLayer  # noqa: E402
+import pubsub_broker  # noqa: E402
+
+GROUP = "chat_bench"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_broker(port, ready):
+    asyncio.run(pubsub_broker.serve(port, ready))
+
+
+async def consume(redis_url, batch_size, consumers, messages, timeout, ready, results):
+    layer = BatchingRedisPubSubChannelLayer(hosts=[redis_url], publish_batch_size=batch_size)
+    channels = [await layer.new_channel() for _ in range(consumers)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+    ready.put(os.getpid())
+
+    latencies = []
+
+    async def receive_all(channel):
+        for _ in range(messages):
+            message = await layer.receive(channel)
+            latencies.append(time.time() - message["sent"])
+
+    try:
+        await asyncio.wait_for(asyncio.gather(*(receive_all(c) for c in channels)), timeout)
+    except asyncio.TimeoutError:
+        pass
+    results.put((time.time(), latencies))
+    await layer.flush()
+
+
+def run_consumer(*args):
+    asyncio.run(consume(*args))
+
+
+async def publish(redis_url, batch_size, messages, window):
+    layer = BatchingRedisPubSubChannelLayer(hosts=[redis_url], publish_batch_size=batch_size)
+    started = time.time()
+    for offset in range(0, messages, window):
+        await asyncio.gather(*(
+            layer.group_send(GROUP, {"type": "chat.message", "message": "x" * 64, "sent": time.time()})
+            for _ in range(min(window, messages - offset))
+        ))
+    await layer.flush()
+    return started
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float("nan")
+
+
+def run(workers, args, redis_url):
+    ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+    procs = [
+        multiprocessing.Process(target=run_consumer, args=(
+            redis_url, args.batch_size, args.consumers, args.messages, args.timeout, ready, results
+        ))
+        for _ in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    for _ in procs:
+        ready.get()
+    time.sleep(0.2)  # let the group subscriptions settle on the broker
+
+    started = asyncio.run(publish(redis_url, args.batch_size, args.messages, args.window))
+    finished, latencies = started, []
+    for _ in procs:
+        end, worker_latencies = results.get()
+        finished = max(finished, end)
+        latencies.extend(worker_latencies)
+    for proc in procs:
+        proc.join()
+
+    latencies.sort()
+    expected = workers * args.consumers * args.messages
+    elapsed = finished - started
+    print(f"{workers:>7} {workers * args.consumers:>9} {len(latencies):>10}/{expected:<10} "
+          f"{len(latencies) / elapsed:>12.0f} {percentile(latencies, 0.5) * 1000:>8.2f} "
+          f"{percentile(latencies, 0.99) * 1000:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--consumers", type=int, default=50, help="group members per worker")
+    parser.add_argument("--messages", type=int, default=2000, help="group messages to publish")
+    parser.add_argument("--window", type=int, default=100, help="group_sends in flight at once")
+    parser.add_argument("--batch-size", type=int, default=100, help="max PUBLISHes per pipeline (1 disables batching)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--redis-url", help="use a real Redis instead of the local stand-in")
+    args = parser.parse_args()
+
+    broker = None
+    redis_url = args.redis_url
+    if not redis_url:
+        port = free_port()
+        broker_ready = multiprocessing.Event()
+        broker = multiprocessing.Process(target=run_broker, args=(port, broker_ready), daemon=True)
+        broker.start()
+        broker_ready.wait()
+        redis_url = f"redis://127.0.0.1:{port}"
+
+    print(f"broker={redis_url} consumers/worker={args.consumers} messages={args.messages} batch={args.batch_size}\n")
+    print(f"{'workers':>7} {'members':>9} {'delivered':>21} {'deliveries/s':>12} {'p50 ms':>8} {'p99 ms':>8}")
+    try:
+        for workers in args.workers:
+            run(workers, args, redis_url)
+    finally:
+        if broker is not None:
+            broker.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Benchmark: storing, paging and replaying chat history.
+
+Fills a throwaway database with --messages messages in each of --rooms
+rooms and times:
+
+  writes  a save() per message, as a consumer storing inline would, against
+          core.chat_history.history_writer's buffered bulk inserts
+  paging  core.chat_history.history_page walking back by keyset against
+          OFFSET paging at the same depth
+  replay  the last CHAT_HISTORY_REPLAY messages from the database against a
+          reconnect served from the room's in-memory ring
+
+    cd Backend && python benchmarks/bench_chat_history.py --messages 100000
+    python benchmarks/bench_chat_history.py --database-url postgres://...
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Backend.settings")
+
+
+def populate(room, count):
+    from core.models import ChatMessage
+
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = [
+        ChatMessage(room=room, body=json.dumps({"message": f"message {i}"}), timestamp=start + timedelta(seconds=i))
+        for i in range(count)
+    ]
+    ChatMessage.objects.bulk_create(rows, batch_size=5000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000, help="stored messages per room")
+    parser.add_argument("--rooms", type=int, default=3)
+    parser.add_argument("--writes", type=int, default=2000, help="messages written in the writes case")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--depth", type=int, default=500, help="page number for the deep paging cases")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--database-url", help="run against this PostgreSQL database instead of SQLite")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ.pop("DATABASE_URL", None)
+        os.environ["SQLITE_PATH"] = os.path.join(workdir, "chat.sqlite3")
+    os.environ.pop("REDIS_URL", None)
+
+    import django
+
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connection
+    from django.utils.timezone import now
+    from core.models import ChatMessage
+    from core.chat_history import history_page, history_writer, load_recent, message_json, room_history
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    rooms = [f"bench{n}" for n in range(args.rooms)]
+    ChatMessage.objects.filter(room__in=rooms + ["inline", "buffered"]).delete()
+    for room in rooms:
+        populate(room, args.messages)
+    room = rooms[0]
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    print(f"{connection.vendor}, {args.rooms} rooms x {args.messages} messages\n")
+
+    body = json.dumps({"message": "hello"})
+    started = time.perf_counter()
+    for _ in range(args.writes):
+        ChatMessage.objects.create(room="inline", body=body, timestamp=now())
+    inline = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in range(args.writes):
+        history_writer.record("buffered", body, now())
+    recorded = time.perf_counter() - started
+    history_writer.flush()
+    buffered = time.perf_counter() - started
+    print(f"{'writes':<28} {'us/message':>11} {'total ms':>10}")
+    print(f"{'save() per message':<28} {inline / args.writes * 1e6:>11.1f} {inline * 1000:>10.1f}")
+    print(f"{'record() (receive path)':<28} {recorded / args.writes * 1e6:>11.1f} {recorded * 1000:>10.1f}")
+    print(f"{'record() + bulk flush':<28} {buffered / args.writes * 1e6:>11.1f} {buffered * 1000:>10.1f}")
+
+    deep_token = None
+    for _ in range(args.depth - 1):
+        _, deep_token = history_page(room, args.page_size, deep_token)
+
+    def offset_page(page):
+        start = (page - 1) * args.page_size
+        stored = ChatMessage.objects.filter(room=room).order_by("-timestamp", "-pk")[start:start + args.page_size]
+        return [message_json(m) for m in stored]
+
+    cases = [
+        ("keyset, page 1", lambda: history_page(room, args.page_size)[0]),
+        (f"keyset, page {args.depth}", lambda: history_page(room, args.page_size, deep_token)[0]),
+        ("offset, page 1", lambda: offset_page(1)),
+        (f"offset, page {args.depth}", lambda: offset_page(args.depth)),
+    ]
+    print(f"\n{'paging':<28} {'ms/page':>11} {'results':>10}")
+    for name, run in cases:
+        messages = run()
+        per_page = timeit.timeit(run, number=args.iterations) / args.iterations * 1000
+        print(f"{name:<28} {per_page:>11.2f} {len(messages):>10}")
+
+    async def replay():
+        await room_history.join(room)
+        timings = {}
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            await load_recent(room, settings.CHAT_HISTORY_REPLAY)
+        timings["database"] = (time.perf_counter() - started) / args.iterations
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            await room_history.join(room)
+            await room_history.leave(room)
+        timings["in-memory ring"] = (time.perf_counter() - started) / args.iterations
+        return timings
+
+    print(f"\n{'replay of ' + str(settings.CHAT_HISTORY_REPLAY):<28} {'ms/connect':>11}")
+    for source, seconds in asyncio.run(replay()).items():
+        print(f"{source:<28} {seconds * 1000:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
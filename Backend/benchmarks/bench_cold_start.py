@@ -0,0 +1,79 @@
+"""
+Cold-start benchmark: process start to first response.
+
+Each run is a fresh interpreter that times django.setup(), importing the
+URLconf (core.views and friends), and the first request to a cheap endpoint
+(/health/) and to the OAuth start endpoint (/api/auth/google/, which loads
+the OAuth client config and google_auth_oauthlib on first use). --eager
+pre-imports the heavy Google/HTTP libraries first, as views.py used to,
+to show what deferring them saves.
+
+    cd Backend && python benchmarks/bench_cold_start.py [--runs 7] [--eager]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EAGER_IMPORTS = (
+    "googleapiclient.discovery", "googleapiclient.http", "google_auth_oauthlib.flow", "requests", "art",
+    "httpx", "google.oauth2.credentials", "google_auth_httplib2",
+)
+
+PROBE = """
+import importlib, json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {backend!r})
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Backend.settings")
+os.environ.setdefault("GOOGLE_CLIENT_ID", "bench")
+os.environ.setdefault("GOOGLE_CLIENT_SECRET", "bench")
+import django
+django.setup()
+timings = {{"django.setup": time.perf_counter() - start}}
+mark = time.perf_counter()
+for name in {eager!r}:
+    importlib.import_module(name)
+if {eager!r}:
+    timings["eager imports"] = time.perf_counter() - mark
+mark = time.perf_counter()
+import core.urls
+timings["import URLconf"] = time.perf_counter() - mark
+from django.test import Client
+client = Client()
+for label, path in (("first /health/", "/health/"), ("first /api/auth/google/", "/api/auth/google/")):
+    mark = time.perf_counter()
+    client.get(path)
+    timings[label] = time.perf_counter() - mark
+timings["total"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def run_once(eager):
+    code = PROBE.format(backend=BACKEND_DIR, eager=EAGER_IMPORTS if eager else ())
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, cwd=BACKEND_DIR, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--eager", action="store_true", help="pre-import the deferred libraries")
+    args = parser.parse_args()
+
+    runs = [run_once(args.eager) for _ in range(args.runs)]
+    print(f"{'eager' if args.eager else 'lazy'} imports, median of {args.runs} fresh processes\n")
+    for label in runs[0]:
+        values = sorted(run[label] * 1000 for run in runs)
+        print(f"{label:<26} {statistics.median(values):>9.1f} ms  (min {values[0]:.1f}, max {values[-1]:.1f})")
+
+
+if __name__ == "__main__":
+    main()
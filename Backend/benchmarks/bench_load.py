@@ -0,0 +1,433 @@
+"""
+End-to-end load test against a local daphne with a fake Google backend.
+
+Starts benchmarks/fake_google.py and `daphne Backend.asgi:application` on a
+throwaway SQLite database (or --database-url), signs in --users users through
+the OAuth callback, then drives each scenario at --concurrency and reports p50/p95/p99
+latency, throughput, errors, the server's peak RSS while the scenario ran and
+how many calls reached the fake Google backend. No real Google account or
+network access is needed.
+
+    cd Backend && python benchmarks/bench_load.py --concurrency 32 --requests 2000
+    python benchmarks/bench_load.py --latency-ms 40 --error-rate 0.02 --scenarios list index
+    python benchmarks/bench_load.py --save base.json; ...; python benchmarks/bench_load.py --compare base.json
+
+--compare exits non-zero when a scenario's p95 grows or its throughput drops
+by more than --tolerance relative to the saved run.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Event, Process
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_google import serve  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UPLOAD_BODY = os.urandom(64 * 1024)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class RssSampler(threading.Thread):
+    """Samples a process's resident set size from /proc (Linux only)."""
+
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.path = f"/proc/{pid}/status"
+        self.interval = interval
+        self.peak = 0
+        self.running = threading.Event()
+
+    def rss(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def run(self):
+        while True:
+            if self.running.is_set():
+                self.peak = max(self.peak, self.rss())
+            time.sleep(self.interval)
+
+    def measure(self):
+        self.peak = self.rss()
+        self.running.set()
+
+    def stop(self):
+        self.running.clear()
+        return self.peak
+
+
+class WebSocket:
+    """Just enough of a RFC 6455 client to drive ws/chat/."""
+
+    def __init__(self, reader, writer):
+        self.reader, self.writer = reader, writer
+
+    @classmethod
+    async def connect(cls, host, port, path):
+        reader, writer = await asyncio.open_connection(host, port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((
+            f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n"
+        ).encode())
+        status = await reader.readline()
+        if b" 101 " not in status:
+            raise ConnectionError(f"WebSocket handshake failed: {status!r}")
+        while await reader.readline() not in (b"\r\n", b""):
+            pass
+        return cls(reader, writer)
+
+    def write_frame(self, opcode, payload):
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = bytes([0x80 | opcode, 0x80 | length])
+        elif length < 65536:
+            header = bytes([0x80 | opcode, 0x80 | 126]) + length.to_bytes(2, "big")
+        else:
+            header = bytes([0x80 | opcode, 0x80 | 127]) + length.to_bytes(8, "big")
+        masked = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        self.writer.write(header + mask + masked)
+
+    async def send(self, text):
+        self.write_frame(0x1, text.encode())
+        await self.writer.drain()
+
+    async def recv(self):
+        while True:
+            head = await self.reader.readexactly(2)
+            opcode, length = head[0] & 0x0F, head[1] & 0x7F
+            if length == 126:
+                length = int.from_bytes(await self.reader.readexactly(2), "big")
+            elif length == 127:
+                length = int.from_bytes(await self.reader.readexactly(8), "big")
+            payload = await self.reader.readexactly(length)
+            if opcode == 0x9:
+                self.write_frame(0xA, payload)
+            elif opcode == 0x8:
+                raise ConnectionError("WebSocket closed by server")
+            elif opcode == 0x1:
+                return payload.decode()
+
+    async def close(self):
+        try:
+            self.write_frame(0x8, b"")
+            await self.writer.drain()
+        finally:
+            self.writer.close()
+
+
+class Result:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.elapsed = 0.0
+        self.peak_rss = 0
+        self.upstream_calls = 0
+
+    def summary(self):
+        latencies = sorted(self.latencies)
+        count = len(latencies) + self.errors
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "throughput": count / self.elapsed if self.elapsed else 0.0,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "peak_rss_mb": self.peak_rss / 2 ** 20,
+            "upstream_calls": self.upstream_calls,
+        }
+
+
+async def run_http(client, name, total, concurrency, make_request):
+    """Issue `total` requests from `concurrency` closed-loop workers."""
+    result = Result(name)
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            method, path, kwargs = make_request(i)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                result.latencies.append(time.perf_counter() - start)
+            else:
+                result.errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+async def run_chat(host, port, clients, messages, room_size, coalesce):
+    """Each client sends `messages` messages, waiting for its own echo before the next.
+
+    Latency is measured from send until each room member receives the message,
+    and throughput counts deliveries per second.
+    """
+    result = Result("ws_chat" + ("_coalesced" if coalesce else ""))
+    query = "?coalesce=1" if coalesce else ""
+    sockets = await asyncio.gather(*(
+        WebSocket.connect(host, port, f"/ws/chat/bench{i // room_size}/{query}") for i in range(clients)
+    ))
+    expected = [messages * min(room_size, clients - i // room_size * room_size) for i in range(clients)]
+
+    async def member(index, socket):
+        own_echo = asyncio.Event()
+        received = 0
+
+        async def receive():
+            nonlocal received
+            while received < expected[index]:
+                frame = json.loads(await socket.recv())
+                now = time.perf_counter()
+                for item in frame.get("messages", [frame]):
+                    sender, _, sent = item["message"].partition(":")
+                    result.latencies.append(now - float(sent))
+                    received += 1
+                    if sender == str(index):
+                        own_echo.set()
+
+        receiver = asyncio.create_task(receive())
+        for _ in range(messages):
+            own_echo.clear()
+            await socket.send(json.dumps({"message": f"{index}:{time.perf_counter()!r}"}))
+            await own_echo.wait()
+        try:
+            await asyncio.wait_for(receiver, timeout=30)
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            result.errors += expected[index] - received
+
+    start = time.perf_counter()
+    await asyncio.gather(*(member(i, socket) for i, socket in enumerate(sockets)))
+    result.elapsed = time.perf_counter() - start
+    await asyncio.gather(*(socket.close() for socket in sockets), return_exceptions=True)
+    return result
+
+
+def upload_request(path, users, query=""):
+    def make(i):
+        files = {"file": (f"bench-{i}.bin", UPLOAD_BODY, "application/octet-stream")}
+        return "POST", path + query, {"headers": {"User-Email": users[i % len(users)]}, "files": files}
+    return make
+
+
+def get_request(path, users):
+    def make(i):
+        return "GET", path, {"headers": {"User-Email": users[i % len(users)]}}
+    return make
+
+
+SCENARIOS = {
+    "health": lambda users: get_request("/api/health/", users),
+    "list": lambda users: get_request("/api/drive/files/?page_size=100", users),
+    "list_all": lambda users: get_request("/api/drive/files/?all=true", users),
+    "index": lambda users: get_request("/api/drive/index/?page_size=100", users),
+    "upload": lambda users: upload_request("/api/drive/upload/", users, "?dedup=false"),
+    "queued_upload": lambda users: upload_request("/api/drive/upload/", users, "?mode=async&dedup=false"),
+    "async_upload": lambda users: upload_request("/api/async/drive/upload/", users),
+}
+
+
+def wait_for(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_stack(args, workdir):
+    ready = Event()
+    fake = Process(target=serve, args=(args.fake_port, ready), kwargs={
+        "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "error_rate": args.error_rate,
+        "error_status": args.error_status, "files": args.files,
+    }, daemon=True)
+    fake.start()
+    ready.wait(10)
+
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    env = dict(
+        os.environ,
+        GOOGLE_API_BASE_URL=fake_url,
+        GOOGLE_OAUTH2_BASE_URL=fake_url,
+        GOOGLE_CLIENT_ID="bench",
+        GOOGLE_CLIENT_SECRET="bench",
+        OAUTHLIB_INSECURE_TRANSPORT="1",
+        SQLITE_PATH=os.path.join(workdir, "bench.sqlite3"),
+        DRIVE_CONTENT_CACHE_DIR=os.path.join(workdir, "content-cache"),
+        DRIVE_UPLOAD_SPOOL_DIR=os.path.join(workdir, "upload-spool"),
+        DEBUG="False",
+    )
+    env.pop("GOOGLE_CLIENT_SECRET_JSON", None)
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    else:
+        env.pop("DATABASE_URL", None)
+    if args.redis_url:
+        env["REDIS_URL"] = args.redis_url
+    else:
+        env.pop("REDIS_URL", None)
+
+    subprocess.run([sys.executable, "manage.py", "migrate", "--run-syncdb", "-v", "0"],
+                   cwd=BACKEND_DIR, env=env, check=True)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "daphne", "-b", "127.0.0.1", "-p", str(args.port), "Backend.asgi:application"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    wait_for(f"http://127.0.0.1:{args.port}/api/health/")
+    return fake, server, fake_url
+
+
+async def sign_in(client, users, attempts=5):
+    """Run the OAuth callback for every user, retrying injected failures."""
+    async def one(email):
+        for _ in range(attempts):
+            response = await client.get(f"/api/auth/callback/?code={email}")
+            if response.status_code == 200:
+                return
+        raise RuntimeError(f"Could not sign in {email}: {response.status_code} {response.text}")
+
+    await asyncio.gather(*(one(email) for email in users))
+
+
+def upstream_calls(fake_url):
+    stats = httpx.get(f"{fake_url}/__stats").json()
+    return sum(count for endpoint, count in stats.items() if not endpoint.endswith("/__stats"))
+
+
+async def run(args, server, fake_url):
+    base_url = f"http://127.0.0.1:{args.port}"
+    users = [f"bench{i}@example.com" for i in range(args.users)]
+    sampler = RssSampler(server.pid)
+    sampler.start()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = []
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await sign_in(client, users)
+
+        for name in args.scenarios:
+            calls = upstream_calls(fake_url)
+            sampler.measure()
+            if name in ("ws_chat", "ws_chat_coalesced"):
+                result = await run_chat("127.0.0.1", args.port, args.ws_clients, args.ws_messages,
+                                        args.room_size, coalesce=name == "ws_chat_coalesced")
+            else:
+                total = args.requests // 10 if name in ("list_all", "upload", "queued_upload", "async_upload") else args.requests
+                result = await run_http(client, name, max(total, 1), args.concurrency, SCENARIOS[name](users))
+            result.peak_rss = sampler.stop()
+            result.upstream_calls = upstream_calls(fake_url) - calls
+            results.append(result)
+            print_row(name, result.summary())
+    return {result.name: result.summary() for result in results}
+
+
+def print_row(name, summary):
+    print(
+        f"{name:<20} {summary['requests']:>8} {summary['errors']:>6} {summary['throughput']:>9.1f} "
+        f"{summary['p50_ms']:>8.1f} {summary['p95_ms']:>8.1f} {summary['p99_ms']:>8.1f} "
+        f"{summary['peak_rss_mb']:>8.1f} {summary['upstream_calls']:>9}",
+        flush=True,
+    )
+
+
+def compare(summaries, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["scenarios"]
+    regressions = []
+    for name, before in baseline.items():
+        after = summaries.get(name)
+        if after is None:
+            continue
+        if after["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.1f} -> {after['p95_ms']:.1f} ms")
+        if after["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput']:.1f} -> {after['throughput']:.1f} req/s")
+    print()
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if not regressions:
+        print(f"No regressions beyond {tolerance:.0%} against {baseline_path}")
+    return not regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS) + ["ws_chat", "ws_chat_coalesced"],
+                        choices=list(SCENARIOS) + ["ws_chat", "ws_chat_coalesced"])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="per scenario (uploads and list_all run 1/10th)")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--files", type=int, default=500, help="files in each fake Drive")
+    parser.add_argument("--ws-clients", type=int, default=100)
+    parser.add_argument("--ws-messages", type=int, default=20, help="messages sent per WebSocket client")
+    parser.add_argument("--room-size", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=20, help="fake Google response latency")
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--fake-port", type=int, default=8765)
+    parser.add_argument("--database-url", help="run against this PostgreSQL database instead of SQLite")
+    parser.add_argument("--redis-url", help="run chat over Redis instead of the in-memory layer")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        fake, server, fake_url = start_stack(args, workdir)
+        try:
+            print(f"concurrency {args.concurrency}, fake Google latency {args.latency_ms}+/-{args.jitter_ms} ms, "
+                  f"error rate {args.error_rate}\n")
+            print(f"{'scenario':<20} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+                  f"{'p99 ms':>8} {'RSS MB':>8} {'upstream':>9}")
+            summaries = asyncio.run(run(args, server, fake_url))
+        finally:
+            server.terminate()
+            server.wait(10)
+            fake.terminate()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": vars(args), "scenarios": summaries}, f, indent=2)
+    if args.compare and not compare(summaries, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: Backend.logger.log() against the previous inspect-based log().
+
+Both write to os.devnull so only the per-call overhead on the calling thread
+is measured.
+
+    cd Backend && python benchmarks/bench_logging.py [iterations]
+"""
+
+import inspect
+import json
+import logging
+import os
+import socket
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Backend.settings")
+
+from Backend import logger as new_logger  # noqa: E402
+from Backend.logger import EnhancedDateTimeEncoder  # noqa: E402
+
+
+# The previous implementation, kept verbatim apart from its handler target
+class LegacyLogFilter(logging.Filter):
+    def filter(self, record):
+        record.hostname = socket.gethostbyname(socket.gethostname())
+        return True
+
+
+legacy_logger = logging.getLogger("Backend.bench.legacy")
+legacy_logger.setLevel(logging.INFO)
+legacy_logger.propagate = False
+legacy_handler = logging.StreamHandler(open(os.devnull, "w"))
+legacy_handler.setFormatter(new_logger.formatter)
+legacy_logger.addHandler(legacy_handler)
+legacy_logger.addFilter(LegacyLogFilter())
+
+
+def legacy_log(level, function, status_code=None, **kwargs):
+    log_message = json.dumps(kwargs, cls=EnhancedDateTimeEncoder)
+    args_str = None
+    if level >= logging.ERROR:
+        frame = inspect.currentframe().f_back
+        args, _, _, values = inspect.getargvalues(frame)
+        args_dict = {arg: values[arg] for arg in args if arg != 'self'}
+        args_str = json.dumps(args_dict, cls=EnhancedDateTimeEncoder)
+    source_file = os.path.relpath(inspect.stack()[1].filename)
+    frame_number = inspect.stack()[1].lineno
+    status_code_str = "status_code:" + str(status_code) if status_code is not None else "status_code:N/A"
+    if args_str:
+        log_details = f"file:{source_file} - line_num:{frame_number} - function:{function} - {status_code_str} - args:{args_str} - message:{log_message}"
+    else:
+        log_details = f"file:{source_file} - line_num:{frame_number} - function:{function} - {status_code_str} - message:{log_message}"
+    legacy_logger.log(level, log_details)
+
+
+def view_like_call(log_fn, level, file_id="1AbC"):
+    log_fn(level=level, function="upload_to_drive", message=f"File uploaded successfully: {file_id}")
+
+
+def bench(label, log_fn, level, number):
+    seconds = timeit.timeit(lambda: view_like_call(log_fn, level), number=number)
+    per_call = seconds / number * 1e6
+    print(f"{label:<28} {per_call:10.2f} us/call")
+    return per_call
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    # Route the new logger's listener to devnull as well
+    new_logger.stdout_handler.setStream(open(os.devnull, "w"))
+
+    print(f"{number} calls each\n")
+    for level_name, level in (("INFO", logging.INFO), ("ERROR", logging.ERROR), ("DEBUG (disabled)", logging.DEBUG)):
+        new_logger.logger.setLevel(logging.INFO)
+        old = bench(f"legacy log() {level_name}", legacy_log, level, number)
+        new = bench(f"log() {level_name}", new_logger.log, level, number)
+        print(f"{'speedup':<28} {old / new:10.1f}x\n")
+
+
+if __name__ == "__main__":
+    main()
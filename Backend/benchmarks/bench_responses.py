@@ -0,0 +1,80 @@
+"""
+Benchmark: encoding and shipping a 10k-file Drive listing.
+
+Compares the stdlib encoder behind JsonResponse with core.responses'
+orjson encoder, then the bytes on the wire and compression time for
+identity, gzip and brotli as applied by CompressionMiddleware, and the
+cost of a conditional GET answered with 304.
+
+    cd Backend && python benchmarks/bench_responses.py [files] [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Backend.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.http import JsonResponse  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from core.responses import CompressionMiddleware, json_response, not_modified, listing_etag  # noqa: E402
+
+MIME_TYPES = ["application/pdf", "image/jpeg", "text/plain", "application/vnd.google-apps.folder"]
+
+
+def make_listing(count):
+    return {
+        "files": [
+            {
+                "id": f"1{i:032x}"[:33],
+                "name": f"Project report {i} - final (v{i % 7}).pdf",
+                "mimeType": MIME_TYPES[i % len(MIME_TYPES)],
+                "createdTime": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T12:{i % 60:02d}:00.000Z",
+            }
+            for i in range(count)
+        ],
+        "next_page_token": None,
+    }
+
+
+def per_call_ms(fn, number):
+    return timeit.timeit(fn, number=number) / number * 1000
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    number = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    listing = make_listing(count)
+    factory = RequestFactory()
+
+    print(f"{count}-file listing, {number} iterations\n")
+    print(f"{'encoder':<24} {'ms/response':>12}")
+    stdlib = per_call_ms(lambda: JsonResponse(listing), number)
+    fast = per_call_ms(lambda: json_response(listing), number)
+    print(f"{'JsonResponse (stdlib)':<24} {stdlib:>12.2f}")
+    print(f"{'json_response (orjson)':<24} {fast:>12.2f}")
+    print(f"{'speedup':<24} {stdlib / fast:>11.1f}x\n")
+
+    body = json_response(listing).content
+    print(f"{'encoding':<24} {'bytes':>12} {'ratio':>8} {'ms/response':>12}")
+    print(f"{'identity':<24} {len(body):>12} {1:>8.2f} {0:>12.2f}")
+    for coding in ("gzip", "br"):
+        request = factory.get("/api/drive/files/", HTTP_ACCEPT_ENCODING=coding)
+        middleware = CompressionMiddleware(lambda r: json_response(listing))
+        response = middleware(request)
+        seconds = per_call_ms(lambda: middleware.process_response(request, json_response(listing)), number) - fast
+        print(f"{coding:<24} {len(response.content):>12} {len(body) / len(response.content):>8.1f} {seconds:>12.2f}")
+
+    etag = listing_etag("drive", "user@example.com", "12345", 100, "", "")
+    request = factory.get("/api/drive/files/", HTTP_IF_NONE_MATCH=etag)
+    revalidate = per_call_ms(lambda: not_modified(request, etag), number * 100)
+    print(f"\n304 revalidation: {revalidate * 1000:.1f} us, 0 body bytes (skips listing, encoding and compression)")
+
+
+if __name__ == "__main__":
+    main()
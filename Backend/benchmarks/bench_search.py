@@ -0,0 +1,114 @@
+"""
+Benchmark: searching a large Drive index.
+
+Fills a throwaway database with --files index rows for each of --users
+users and times core.drive_search.search_index for typical searches
+(substring, prefix, type and date filters, a deep keyset page) against
+reading the user's whole index and filtering it in Python, which is what
+clients of the plain listing do today.
+
+    cd Backend && python benchmarks/bench_search.py --files 100000
+    python benchmarks/bench_search.py --database-url postgres://...   # with the trigram index
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "Backend.settings")
+
+WORDS = ["report", "invoice", "holiday", "budget", "scan", "notes", "draft", "photo", "contract", "slides"]
+MIME_TYPES = ["application/pdf", "image/jpeg", "text/plain", "application/vnd.google-apps.folder", "video/mp4"]
+
+
+def populate(user, count):
+    from core.models import DriveFile
+
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    rows = [
+        DriveFile(
+            user=user,
+            file_id=f"{user.pk}-{i:08d}",
+            name=f"{WORDS[i % len(WORDS)].title()} {i} {WORDS[i * 7 % len(WORDS)]}.dat",
+            mime_type=MIME_TYPES[i % len(MIME_TYPES)],
+            created_time=start + timedelta(minutes=i * 13),
+            size=i,
+        )
+        for i in range(count)
+    ]
+    DriveFile.objects.bulk_create(rows, batch_size=5000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100000, help="index rows per user")
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--database-url", help="run against this PostgreSQL database instead of SQLite")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        os.environ.pop("DATABASE_URL", None)
+        os.environ["SQLITE_PATH"] = os.path.join(workdir, "search.sqlite3")
+
+    import django
+
+    django.setup()
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+    from django.db import connection
+    from core.models import DriveFile
+    from core.drive_index import as_drive_json
+    from core.drive_search import parse_search_params, search_index
+
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    users = []
+    for n in range(args.users):
+        user, _ = User.objects.get_or_create(username=f"search-bench-{n}@example.com")
+        DriveFile.objects.filter(user=user).delete()
+        populate(user, args.files)
+        users.append(user)
+    user = users[0]
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def client_side(term):
+        files = [as_drive_json(f) for f in DriveFile.objects.filter(user=user).order_by("pk")]
+        return sorted((f for f in files if term in f["name"].lower()), key=lambda f: f["name"])[:100]
+
+    newest = parse_search_params({"sort": "-created_time"})
+    deep_token = None
+    for _ in range(50):
+        _, deep_token = search_index(user, newest, 100, deep_token)
+
+    cases = [
+        ("substring 'liday 12'", lambda: search_index(user, parse_search_params({"q": "liday 12"}), 100)),
+        ("substring, no match", lambda: search_index(user, parse_search_params({"q": "quarterly"}), 100)),
+        ("prefix 'Budget 4'", lambda: search_index(user, parse_search_params({"prefix": "Budget 4"}), 100)),
+        ("type + date range", lambda: search_index(user, parse_search_params({
+            "mime_type": "image/*,application/pdf", "created_after": "2021-03-01", "created_before": "2021-04-01",
+            "sort": "-created_time"}), 100)),
+        ("newest first, page 1", lambda: search_index(user, newest, 100)),
+        ("newest first, page 51", lambda: search_index(user, newest, 100, deep_token)),
+        ("client-side filter", lambda: client_side("liday 12")),
+    ]
+
+    print(f"{connection.vendor}, {args.users} users x {args.files} files, {args.iterations} iterations\n")
+    print(f"{'search':<24} {'ms/query':>10} {'results':>8}")
+    for name, run in cases:
+        result = run()
+        files = result[0] if isinstance(result, tuple) else result
+        per_query = timeit.timeit(run, number=args.iterations) / args.iterations * 1000
+        print(f"{name:<24} {per_query:>10.2f} {len(files):>8}")
+
+
+if __name__ == "__main__":
+    main()
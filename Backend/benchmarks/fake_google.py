@@ -0,0 +1,477 @@
+"""
+Local stand-in for the Google endpoints the backend calls.
+
+Serves the OAuth token endpoint, userinfo and the Drive v3 calls used by
+core (files.list with pagination, name/mimeType/createdTime `q` filters and
+orderBy, files.get incl. alt=media, files.create
+as multipart, media and resumable uploads, files.copy, files.delete,
+changes.getStartPageToken and changes.list) from memory, uploaded bytes
+included, with configurable latency and error injection. Point the backend at it with
+
+    GOOGLE_API_BASE_URL=http://127.0.0.1:8765 GOOGLE_OAUTH2_BASE_URL=http://127.0.0.1:8765
+
+Authorization codes are user emails: exchanging code "alice@example.com"
+yields tokens for alice, whose Drive is seeded with --files synthetic files.
+GET /__stats returns per-endpoint request counts.
+
+    python benchmarks/fake_google.py --port 8765 --latency-ms 20 --error-rate 0.01
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RESUMABLE_CHUNK = 256 * 1024
+MIME_TYPES = ["application/pdf", "image/jpeg", "text/plain", "video/mp4"]
+
+
+class FakeDrive:
+    """Per-user files and changes log, shared by every request thread."""
+
+    def __init__(self, files_per_user, file_size):
+        self.files_per_user = files_per_user
+        self.file_size = file_size
+        self.lock = threading.Lock()
+        self.users = {}  # email -> {"files": {id: file}, "order": [ids], "changes": [(file id, removed)]}
+        self.uploads = {}  # upload id -> in-progress resumable upload
+        self.ids = itertools.count(1)
+        self.stats = {}
+
+    def count(self, endpoint):
+        with self.lock:
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+
+    def content(self, file):
+        if "_content" in file:
+            return file["_content"]
+        seed = file["id"].encode()
+        return (seed * (file["_size"] // len(seed) + 1))[:file["_size"]]
+
+    def make_file(self, name, mime_type, size, md5):
+        file_id = f"fake{next(self.ids):012d}"
+        return {
+            "id": file_id, "name": name, "mimeType": mime_type, "version": "1",
+            "createdTime": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            "size": str(size), "md5Checksum": md5, "_size": size,
+        }
+
+    def drive(self, email):
+        with self.lock:
+            drive = self.users.get(email)
+            if drive is None:
+                drive = self.users[email] = {"files": {}, "order": [], "changes": []}
+                for i in range(self.files_per_user):
+                    file = self.make_file(f"file {i}.txt", MIME_TYPES[i % len(MIME_TYPES)], self.file_size, "")
+                    file["md5Checksum"] = hashlib.md5(self.content(file)).hexdigest()
+                    drive["files"][file["id"]] = file
+                    drive["order"].append(file["id"])
+            return drive
+
+    def add(self, email, file):
+        drive = self.drive(email)
+        with self.lock:
+            drive["files"][file["id"]] = file
+            drive["order"].append(file["id"])
+            drive["changes"].append((file["id"], False))
+        return file
+
+    def remove(self, email, file_id):
+        drive = self.drive(email)
+        with self.lock:
+            if drive["files"].pop(file_id, None) is None:
+                return False
+            drive["order"].remove(file_id)
+            drive["changes"].append((file_id, True))
+            return True
+
+
+def public(file):
+    return {key: value for key, value in file.items() if not key.startswith("_")}
+
+
+QUERY_CLAUSE_RE = re.compile(r"^(name|mimeType|createdTime)\s*(contains|=|!=|>=|<=|>|<)\s*'((?:[^'\\]|\\.)*)'$")
+
+
+def clause_matches(file, clause):
+    match = QUERY_CLAUSE_RE.match(clause.strip())
+    if not match:
+        raise ValueError(f"Unsupported query clause: {clause}")
+    field, op, value = match.groups()
+    value = re.sub(r"\\(.)", r"\1", value)
+    actual = file.get(field, "")
+    if op == "contains":
+        if field == "name":
+            # Drive matches name terms against the start of the name's words
+            words = [actual] + re.split(r"[^0-9a-zA-Z]+", actual)
+            return any(word.lower().startswith(value.lower()) for word in words)
+        return value in actual
+    if field == "createdTime":
+        actual, value = actual[:19], value[:19]  # compare as UTC timestamps without fractions
+    return {"=": actual == value, "!=": actual != value, ">=": actual >= value, "<=": actual <= value,
+            ">": actual > value, "<": actual < value}[op]
+
+
+def query_matches(file, q):
+    """Evaluate the `and`-joined clauses (or parenthesised `or` groups) of a files.list q."""
+    for part in q.split(" and "):
+        part = part.strip()
+        options = part[1:-1].split(" or ") if part.startswith("(") else [part]
+        if not any(clause_matches(file, option) for option in options):
+            return False
+    return True
+
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeGoogle/1.0"
+
+    # Plumbing
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status, message, reason="backendError"):
+        self.send_json(status, {"error": {
+            "code": status, "message": message, "errors": [{"reason": reason, "message": message}],
+        }})
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def user_email(self):
+        token = (self.headers.get("Authorization") or "").removeprefix("Bearer ")
+        if not token.startswith("fake."):
+            return None
+        return token.split(".", 2)[2]
+
+    def dispatch(self, method):
+        config = self.server.config
+        url = urlparse(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        self.body = self.read_body() if method in ("POST", "PUT", "PATCH") else b""
+        route, handler = self.route(method, url.path)
+        self.server.drive.count(f"{method} {route}")
+
+        latency = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+        if route != "/__stats" and random.random() < config.error_rate:
+            reason = "rateLimitExceeded" if config.error_status == 429 else "backendError"
+            return self.send_error_json(config.error_status, "Injected error", reason)
+        if handler is None:
+            return self.send_error_json(404, f"No fake for {method} {url.path}", "notFound")
+        handler(*self.route_args)
+
+    def route(self, method, path):
+        parts = path.strip("/").split("/")
+        self.route_args = ()
+        routes = {
+            ("POST", "/token"): self.token,
+            ("GET", "/oauth2/v1/userinfo"): self.userinfo,
+            ("GET", "/drive/v3/files"): self.list_files,
+            ("POST", "/upload/drive/v3/files"): self.create_upload,
+            ("PUT", "/upload/drive/v3/files"): self.resume_upload,
+            ("GET", "/drive/v3/changes/startPageToken"): self.start_page_token,
+            ("GET", "/drive/v3/changes"): self.list_changes,
+            ("GET", "/__stats"): self.stats,
+        }
+        if (method, path) in routes:
+            return path, routes[(method, path)]
+        if parts[:3] == ["drive", "v3", "files"] and len(parts) in (4, 5):
+            self.route_args = (parts[3],)
+            if len(parts) == 5 and parts[4] == "copy" and method == "POST":
+                return "/drive/v3/files/{id}/copy", self.copy_file
+            if len(parts) == 4 and method == "GET":
+                return "/drive/v3/files/{id}", self.get_file
+            if len(parts) == 4 and method == "DELETE":
+                return "/drive/v3/files/{id}", self.delete_file
+        return path, None
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    # OAuth
+
+    def token(self):
+        form = {key: values[-1] for key, values in parse_qs(self.body.decode()).items()}
+        grant_type = form.get("grant_type")
+        if grant_type == "authorization_code":
+            email = form.get("code", "")
+        elif grant_type == "refresh_token":
+            email = form.get("refresh_token", "").removeprefix("refresh.")
+        else:
+            return self.send_json(400, {"error": "unsupported_grant_type"})
+        if "@" not in email:
+            return self.send_json(400, {"error": "invalid_grant", "error_description": "Bad code"})
+        self.send_json(200, {
+            "access_token": f"fake.{next(self.server.drive.ids)}.{email}",
+            "refresh_token": f"refresh.{email}",
+            "expires_in": 3599,
+            "token_type": "Bearer",
+        })
+
+    def userinfo(self):
+        email = self.user_email()
+        if not email:
+            return self.send_error_json(401, "Invalid Credentials", "authError")
+        self.send_json(200, {"id": hashlib.md5(email.encode()).hexdigest()[:20], "email": email,
+                             "verified_email": True, "name": email.split("@")[0]})
+
+    # Drive
+
+    def authorized_drive(self):
+        email = self.user_email()
+        if not email:
+            self.send_error_json(401, "Invalid Credentials", "authError")
+            return None, None
+        return email, self.server.drive.drive(email)
+
+    def list_files(self):
+        email, drive = self.authorized_drive()
+        if not drive:
+            return
+        page_size = min(int(self.query.get("pageSize", 100)), 1000)
+        offset = int(self.query.get("pageToken", 0))
+        ids = drive["order"]
+        q, order_by = self.query.get("q"), self.query.get("orderBy")
+        if q or order_by:
+            files = [drive["files"][file_id] for file_id in ids if file_id in drive["files"]]
+            try:
+                files = [file for file in files if query_matches(file, q)] if q else files
+            except ValueError as e:
+                return self.send_error_json(400, str(e), "invalid")
+            if order_by:
+                key, _, direction = order_by.partition(" ")
+                files.sort(key=lambda file: file.get(key, ""), reverse=direction == "desc")
+            ids = [file["id"] for file in files]
+        page = ids[offset:offset + page_size]
+        body = {"files": [public(drive["files"][file_id]) for file_id in page if file_id in drive["files"]]}
+        if offset + page_size < len(ids):
+            body["nextPageToken"] = str(offset + page_size)
+        self.send_json(200, body)
+
+    def get_file(self, file_id):
+        email, drive = self.authorized_drive()
+        if not drive:
+            return
+        file = drive["files"].get(file_id)
+        if not file:
+            return self.send_error_json(404, f"File not found: {file_id}.", "notFound")
+        if self.query.get("alt") != "media":
+            return self.send_json(200, public(file))
+
+        content = self.server.drive.content(file)
+        status, start, end = 200, 0, len(content) - 1
+        requested = self.headers.get("Range", "")
+        if requested.startswith("bytes="):
+            first, _, last = requested[6:].partition("-")
+            start, end, status = int(first), min(int(last or end), end), 206
+        self.send_response(status)
+        self.send_header("Content-Type", file["mimeType"])
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        self.end_headers()
+        self.wfile.write(content[start:end + 1])
+
+    def delete_file(self, file_id):
+        email, drive = self.authorized_drive()
+        if not drive:
+            return
+        if not self.server.drive.remove(email, file_id):
+            return self.send_error_json(404, f"File not found: {file_id}.", "notFound")
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def copy_file(self, file_id):
+        email, drive = self.authorized_drive()
+        if not drive:
+            return
+        source = drive["files"].get(file_id)
+        if not source:
+            return self.send_error_json(404, f"File not found: {file_id}.", "notFound")
+        metadata = json.loads(self.body or b"{}")
+        copy = self.server.drive.make_file(
+            metadata.get("name", f"Copy of {source['name']}"), source["mimeType"], source["_size"],
+            source["md5Checksum"]
+        )
+        if "_content" in source:
+            copy["_content"] = source["_content"]
+        self.send_json(200, public(self.server.drive.add(email, copy)))
+
+    def create_upload(self):
+        email, drive = self.authorized_drive()
+        if not drive:
+            return
+        upload_type = self.query.get("uploadType")
+        if upload_type == "resumable":
+            upload_id = f"upload{next(self.server.drive.ids)}"
+            metadata = json.loads(self.body or b"{}")
+            self.server.drive.uploads[upload_id] = {
+                "email": email,
+                "name": metadata.get("name", "Untitled"),
+                "mime_type": self.headers.get("X-Upload-Content-Type", "application/octet-stream"),
+                "data": bytearray(),
+            }
+            location = f"http://{self.headers['Host']}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}"
+            self.send_response(200)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if upload_type == "multipart":
+            message = BytesParser(policy=HTTP).parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + self.body
+            )
+            metadata_part, media_part = list(message.iter_parts())[:2]
+            metadata = json.loads(metadata_part.get_payload(decode=True) or b"{}")
+            media, mime_type = media_part.get_payload(decode=True), media_part.get_content_type()
+        elif upload_type == "media":
+            metadata, media = {}, self.body
+            mime_type = self.headers.get("Content-Type", "application/octet-stream")
+        else:
+            return self.send_error_json(400, f"Unsupported uploadType: {upload_type}", "badRequest")
+
+        file = self.server.drive.make_file(
+            metadata.get("name", "Untitled"), metadata.get("mimeType", mime_type), len(media),
+            hashlib.md5(media).hexdigest()
+        )
+        file["_content"] = media
+        self.send_json(200, public(self.server.drive.add(email, file)))
+
+    def resume_upload(self):
+        upload = self.server.drive.uploads.get(self.query.get("upload_id"))
+        if upload is None:
+            return self.send_error_json(404, "Upload session not found", "notFound")
+        content_range = (self.headers.get("Content-Range") or "").removeprefix("bytes ")
+        span, _, total = content_range.partition("/")
+        if span != "*" and span:
+            start = int(span.split("-")[0])
+            if start == len(upload["data"]):
+                data = self.body
+                if start + len(data) < int(total):
+                    # Like Drive, only commit whole 256 KiB blocks before the last chunk
+                    data = data[:len(data) // RESUMABLE_CHUNK * RESUMABLE_CHUNK]
+                upload["data"] += data
+
+        committed = len(upload["data"])
+        if total != "*" and committed == int(total):
+            self.server.drive.uploads.pop(self.query["upload_id"], None)
+            file = self.server.drive.make_file(
+                upload["name"], upload["mime_type"], committed, hashlib.md5(upload["data"]).hexdigest()
+            )
+            file["_content"] = bytes(upload["data"])
+            return self.send_json(200, public(self.server.drive.add(upload["email"], file)))
+
+        self.send_response(308)
+        if committed:
+            self.send_header("Range", f"bytes=0-{committed - 1}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def start_page_token(self):
+        email, drive = self.authorized_drive()
+        if drive is not None:
+            self.send_json(200, {"startPageToken": str(len(drive["changes"]) + 1)})
+
+    def list_changes(self):
+        email, drive = self.authorized_drive()
+        if not drive:
+            return
+        page_size = min(int(self.query.get("pageSize", 100)), 1000)
+        start = int(self.query.get("pageToken", 1)) - 1
+        entries = drive["changes"][start:start + page_size]
+        changes = []
+        for file_id, removed in entries:
+            file = drive["files"].get(file_id)
+            change = {"fileId": file_id, "removed": removed or file is None}
+            if file and not removed:
+                change["file"] = public(file)
+            changes.append(change)
+        body = {"changes": changes}
+        next_token = str(start + len(entries) + 1)
+        if start + len(entries) < len(drive["changes"]):
+            body["nextPageToken"] = next_token
+        else:
+            body["newStartPageToken"] = next_token
+        self.send_json(200, body)
+
+    def stats(self):
+        with self.server.drive.lock:
+            self.send_json(200, dict(self.server.drive.stats))
+
+
+class FakeGoogleServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a slow or failed call are expected under load
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_server(port, latency_ms=0, jitter_ms=0, error_rate=0.0, error_status=503, files=1000, file_size=4096):
+    server = FakeGoogleServer(("127.0.0.1", port), FakeGoogleHandler)
+    server.config = argparse.Namespace(
+        latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate, error_status=error_status
+    )
+    server.drive = FakeDrive(files, file_size)
+    return server
+
+
+def serve(port=8765, ready=None, **options):
+    server = make_server(port, **options)
+    if ready is not None:
+        ready.set()
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="+/- uniform jitter on the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="status of injected failures (e.g. 429)")
+    parser.add_argument("--files", type=int, default=1000, help="files seeded per user")
+    parser.add_argument("--file-size", type=int, default=4096, help="bytes per seeded file")
+    args = parser.parse_args()
+    print(f"Fake Google on http://127.0.0.1:{args.port}")
+    serve(args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+          error_status=args.error_status, files=args.files, file_size=args.file_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Minimal local stand-in for a Redis pub/sub broker.
+
+Speaks enough RESP2 (PING, PUBLISH, SUBSCRIBE, UNSUBSCRIBE, plus no-op
+CLIENT/SELECT) for the Redis pub/sub channel layer, so the channel layer
+load test can run without a Redis server.
+
+    python benchmarks/pubsub_broker.py [port]
+"""
+
+import asyncio
+import sys
+
+
+def encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        value = value.encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+
+
+class PubSubBroker:
+    def __init__(self):
+        self.subscribers = {}  # channel -> set of writers
+
+    async def read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                command = await self.read_command(reader)
+                if command is None:
+                    break
+                name = command[0].upper()
+                if name == b"PUBLISH":
+                    receivers = self.subscribers.get(command[1], ())
+                    message = encode([b"message", command[1], command[2]])
+                    for receiver in receivers:
+                        receiver.write(message)
+                    writer.write(encode(len(receivers)))
+                elif name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(encode([b"subscribe", channel, len(subscribed)]))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:] or list(subscribed):
+                        self.subscribers.get(channel, set()).discard(writer)
+                        subscribed.discard(channel)
+                        writer.write(encode([b"unsubscribe", channel, len(subscribed)]))
+                elif name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                else:
+                    writer.write(b"+OK\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+
+async def serve(port=6399, ready=None):
+    server = await asyncio.start_server(PubSubBroker().handle, "127.0.0.1", port)
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve(int(sys.argv[1]) if len(sys.argv) > 1 else 6399))
@@ -0,0 +1,182 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from core.models import UserToken
+from core.credentials import aget_credentials, ainvalidate_credentials
+from core import google_http
+from core.google_http import GoogleAPIError
+from core.drive_scheduler import QuotaExceeded
+from core.views import (
+    ASYNC_REDIRECT_URI, LIST_FIELDS, MAX_PAGE_SIZE, get_page_size, encode_files_page, drive_listing_etag,
+    rate_limited_response
+)
+from core.responses import json_response, not_modified
+from Backend.logger import log
+from logging import INFO, ERROR
+from datetime import timedelta
+import asyncio
+import json
+from django.utils.timezone import now
+
+
+# Helper Functions
+async def listing_feed_position(request, access_token, user_email):
+    """The Drive changes feed position a listing's ETag is derived from.
+
+    Checking If-None-Match needs the current position. Any earlier one is a
+    safe ETag for a listing read after it, as it only matches while nothing
+    has changed, so unconditional requests reuse the last position seen for
+    the user and only ask Drive when there is none.
+    """
+    key = f"drive-start-page-token:{user_email}"
+    start_page_token = None
+    if not request.headers.get("If-None-Match"):
+        start_page_token = await cache.aget(key)
+    if start_page_token is None:
+        start_page_token = await google_http.get_start_page_token(access_token)
+        await cache.aset(key, start_page_token, None)
+    return start_page_token
+
+async def astream_all_files(access_token, page_size):
+    """Walk every page of the listing, yielding JSON as each page arrives.
+
+    An async generator, so the ASGI server sends each page as it is encoded
+    instead of collecting the whole listing first.
+    """
+    yield '{"files": ['
+    page_token = None
+    total = 0
+    try:
+        while True:
+            list_params = {"pageSize": page_size, "fields": LIST_FIELDS}
+            if page_token:
+                list_params["pageToken"] = page_token
+            response = await google_http.list_files(access_token, **list_params)
+            files = response.get("files", [])
+            yield encode_files_page(files, total == 0)
+            total += len(files)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+        log(level=INFO, function="astream_all_files", message=f"Streamed {total} files.")
+        yield "]}"
+    except (GoogleAPIError, QuotaExceeded) as e:
+        # Headers are already sent, so report the failure inside the body
+        log(level=ERROR, function="astream_all_files", message=str(e))
+        reason = e.reason if isinstance(e, GoogleAPIError) else str(e)
+        yield "], " + json.dumps({"error": f"Google API Error: {reason}"})[1:]
+
+# Views
+@csrf_exempt
+async def async_google_callback(request):
+    """Handle OAuth callback without blocking a worker thread"""
+    try:
+        code = request.GET.get("code")
+        if not code:
+            return JsonResponse({"error": "Missing authorization code"}, status=400)
+
+        tokens = await google_http.exchange_code(code, ASYNC_REDIRECT_URI)
+        user_info = await google_http.fetch_user_info(tokens["access_token"])
+        expires_at = now() + timedelta(seconds=tokens.get("expires_in", 3600))
+
+        user, _ = await User.objects.aget_or_create(
+            username=user_info["email"],
+            defaults={"email": user_info["email"]}
+        )
+
+        await UserToken.objects.aupdate_or_create(
+            user=user,
+            defaults={
+                "access_token": tokens["access_token"],
+                "refresh_token": tokens.get("refresh_token"),
+                "expires_at": expires_at
+            }
+        )
+        await ainvalidate_credentials(user.username)
+
+        log(level=INFO, function="async_google_callback", message=f"User authenticated: {user.email}")
+        return JsonResponse({
+            "access_token": tokens["access_token"],
+            "refresh_token": tokens.get("refresh_token"),
+            "expires_in": expires_at.timestamp(),
+            "user": user_info
+        })
+    except Exception as e:
+        log(level=ERROR, function="async_google_callback", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+async def async_upload_to_drive(request):
+    """Upload file to Google Drive without blocking a worker thread"""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        user_email = request.headers.get("User-Email")
+        cached = await aget_credentials(user_email)
+        if not cached:
+            return JsonResponse({"error": "Unauthorized"}, status=401)
+
+        # Parsing the multipart body reads the spooled request from disk
+        files = await asyncio.to_thread(lambda: request.FILES)
+        file_obj = files["file"]
+        uploaded_file = await google_http.upload_file(cached.credentials.token, file_obj)
+
+        log(level=INFO, function="async_upload_to_drive", message=f"File uploaded successfully: {uploaded_file['id']}")
+        return JsonResponse({"file_id": uploaded_file["id"]})
+
+    except (GoogleAPIError, QuotaExceeded) as e:
+        log(level=ERROR, function="async_upload_to_drive", message=str(e))
+        return rate_limited_response(e) or JsonResponse({"error": f"Google API Error: {str(e)}"}, status=500)
+    except Exception as e:
+        log(level=ERROR, function="async_upload_to_drive", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+async def async_list_drive_files(request):
+    """List files in Google Drive without blocking a worker thread"""
+    try:
+        user_email = request.headers.get("User-Email")
+        cached = await aget_credentials(user_email)
+        if not cached:
+            return JsonResponse({"error": "Unauthorized"}, status=401)
+
+        if request.GET.get("all") == "true":
+            # No ETag: a walk Drive fails partway through still ends in a 200,
+            # and a client must not keep that truncated listing as current
+            return StreamingHttpResponse(
+                astream_all_files(cached.credentials.token, MAX_PAGE_SIZE),
+                content_type="application/json"
+            )
+
+        start_page_token = await listing_feed_position(request, cached.credentials.token, user_email)
+        etag = drive_listing_etag(request, user_email, start_page_token)
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+
+        list_params = {"pageSize": get_page_size(request), "fields": LIST_FIELDS}
+        if request.GET.get("page_token"):
+            list_params["pageToken"] = request.GET["page_token"]
+        listing = await google_http.list_files(cached.credentials.token, **list_params)
+
+        log(level=INFO, function="async_list_drive_files", message=f"Retrieved {len(listing.get('files', []))} files.")
+        response = json_response({
+            "files": listing.get("files", []),
+            "next_page_token": listing.get("nextPageToken")
+        })
+        response["ETag"] = etag
+        return response
+
+    except QuotaExceeded as e:
+        log(level=ERROR, function="async_list_drive_files", message=str(e))
+        return rate_limited_response(e)
+    except GoogleAPIError as e:
+        log(level=ERROR, function="async_list_drive_files", message=str(e))
+        return rate_limited_response(e) or JsonResponse(
+            {"error": f"Google API Error: {e.reason}"}, status=e.status_code
+        )
+    except Exception as e:
+        log(level=ERROR, function="async_list_drive_files", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
@@ -0,0 +1,270 @@
+import asyncio
+import atexit
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from django.conf import settings
+from django.db import close_old_connections
+from core.models import ChatMessage
+from core.metrics import CallbackMetric, Counter, Histogram
+from Backend.logger import log
+from logging import ERROR
+
+ROOM_MAX_LENGTH = ChatMessage._meta.get_field("room").max_length
+
+history_writes = Counter(
+    "chat_history_writes_total", "Chat messages handed to the history writer, by outcome.", ("result",)
+)
+history_flush_duration = Histogram(
+    "chat_history_flush_duration_seconds", "Time taken by each bulk insert of chat history."
+)
+history_replays = Counter(
+    "chat_history_replays_total", "Chat connections sent recent messages, by where the room's history came from.",
+    ("source",)
+)
+
+
+def room_group(room):
+    """Channel layer group of a chat room's members."""
+    return f"chat_{room}"
+
+
+class ChatHistoryWriter:
+    """Write-behind buffer persisting chat messages in bulk.
+
+    record() only appends to a list, so a consumer's receive path never waits
+    on the database. A background thread inserts the buffer with one
+    bulk_create once CHAT_HISTORY_FLUSH_SIZE messages are waiting or the
+    oldest has waited CHAT_HISTORY_FLUSH_INTERVAL_MS. At most
+    CHAT_HISTORY_MAX_PENDING messages are buffered; while the database is
+    unreachable the oldest are dropped rather than held without limit.
+    """
+
+    def __init__(self, flush_size, flush_interval, max_pending):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def record(self, room, body, timestamp):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chat-history-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            if len(self.pending) >= self.max_pending:
+                del self.pending[0]
+                history_writes.inc(result="dropped")
+            self.pending.append(ChatMessage(room=room, body=body, timestamp=timestamp))
+            # The first message starts the flush timer; a full buffer ends it early
+            if len(self.pending) == 1 or len(self.pending) >= self.flush_size:
+                self._cond.notify()
+
+    def pending_for(self, room):
+        """Messages for the room recorded here but not yet written."""
+        with self._cond:
+            return [message for message in self.pending if message.room == room]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self.pending)
+                self._cond.wait_for(lambda: len(self.pending) >= self.flush_size, timeout=self.flush_interval)
+                batch, self.pending = self.pending, []
+            self.write(batch)
+
+    def flush(self):
+        """Write whatever is buffered now, on the calling thread."""
+        with self._cond:
+            batch, self.pending = self.pending, []
+        if batch:
+            self.write(batch)
+
+    def write(self, batch):
+        close_old_connections()
+        started = time.perf_counter()
+        try:
+            ChatMessage.objects.bulk_create(batch, batch_size=max(self.flush_size, 1))
+            history_writes.inc(len(batch), result="ok")
+        except Exception as e:
+            self.lost(len(batch), e)
+        finally:
+            history_flush_duration.observe(time.perf_counter() - started)
+            close_old_connections()
+
+    def lost(self, count, error):
+        # Logged apart from write() so the record carries no message contents
+        history_writes.inc(count, result="error")
+        log(level=ERROR, function="ChatHistoryWriter.write", message=f"Lost {count} chat messages: {str(error)}")
+
+
+history_writer = ChatHistoryWriter(
+    settings.CHAT_HISTORY_FLUSH_SIZE, settings.CHAT_HISTORY_FLUSH_INTERVAL_MS / 1000, settings.CHAT_HISTORY_MAX_PENDING
+)
+CallbackMetric("chat_history_pending", "Chat messages buffered for the next bulk insert.", "gauge",
+               lambda: len(history_writer.pending))
+
+
+class Ring:
+    def __init__(self, size):
+        # (ISO timestamp, frame text), oldest first
+        self.messages = deque(maxlen=size)
+        self.members = 0
+        self.idle_since = None
+        self.ready = asyncio.Event()
+
+
+class RoomHistory:
+    """The last few messages of each room with members in this process, for replay on connect.
+
+    While a room has members here, and for CHAT_HISTORY_IDLE_TTL seconds after
+    the last one leaves, a channel of the process's own belongs to the room's
+    group, so each message reaches the ring once per process whichever
+    worker it was sent to. A ring is seeded from the database when the room
+    first gets a member here; later joins and reconnects replay from memory.
+    """
+
+    def __init__(self, size, max_rooms, idle_ttl):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.idle_ttl = idle_ttl
+        self.rings = OrderedDict()
+        self.channel = None
+        self.loop = None
+        self._listener = None
+
+    async def _start(self):
+        from channels.layers import get_channel_layer
+
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        channel_layer = get_channel_layer()
+        channel = await channel_layer.new_channel("chat-history.")
+        if self.loop is loop:
+            # Another join started the listener meanwhile
+            return
+        self.loop, self.rings = loop, OrderedDict()
+        self.channel_layer, self.channel = channel_layer, channel
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self.channel_layer.receive(self.channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log(level=ERROR, function="RoomHistory.listen", message=str(e))
+                await asyncio.sleep(1)
+                continue
+            ring = self.rings.get(message.get("room"))
+            if ring is None or message.get("type") != "chat_message":
+                continue
+            texts = message.get("texts", [])
+            ring.messages.extend(zip(message.get("timestamps") or [None] * len(texts), texts))
+
+    async def join(self, room):
+        """Count a member in; returns the room's recent messages as (timestamp, text) pairs, oldest first."""
+        await self._start()
+        ring = self.rings.get(room)
+        if ring is None:
+            ring = self.rings[room] = Ring(self.size)
+            try:
+                await self.channel_layer.group_add(room_group(room), self.channel)
+                try:
+                    seed = await load_recent(room, self.size)
+                except Exception as e:
+                    # Live chat goes on without history while the database is unavailable
+                    log(level=ERROR, function="RoomHistory.join", message=f"History for {room} not loaded: {str(e)}")
+                    seed = []
+                # Anything the listener caught while loading is newer than the seed
+                live = list(ring.messages)
+                seen = set(live)
+                ring.messages.clear()
+                ring.messages.extend([message for message in seed if message not in seen] + live)
+            finally:
+                ring.ready.set()
+            source = "database"
+        else:
+            await ring.ready.wait()
+            source = "memory"
+        ring.members += 1
+        ring.idle_since = None
+        self.rings.move_to_end(room)
+        await self._evict()
+        history_replays.inc(source=source)
+        return list(ring.messages)
+
+    async def leave(self, room):
+        ring = self.rings.get(room)
+        if ring is not None and ring.members > 0:
+            ring.members -= 1
+            if not ring.members:
+                ring.idle_since = time.monotonic()
+        await self._evict()
+
+    async def _evict(self):
+        current = time.monotonic()
+        for room, ring in list(self.rings.items()):
+            if ring.members or ring.idle_since is None:
+                continue
+            if len(self.rings) > self.max_rooms or current - ring.idle_since > self.idle_ttl:
+                del self.rings[room]
+                await self.channel_layer.group_discard(room_group(room), self.channel)
+
+
+room_history = RoomHistory(settings.CHAT_HISTORY_REPLAY, settings.CHAT_HISTORY_ROOMS, settings.CHAT_HISTORY_IDLE_TTL)
+
+
+async def load_recent(room, limit):
+    """The room's last `limit` messages from the database and this process's write buffer, oldest first."""
+    stored = ChatMessage.objects.filter(room=room).order_by("-timestamp", "-pk")[:limit]
+    messages = {(m.timestamp.isoformat(), m.body) async for m in stored}
+    messages.update((m.timestamp.isoformat(), m.body) for m in history_writer.pending_for(room))
+    return sorted(messages, key=lambda message: message[0])[-limit:]
+
+
+def encode_page_token(timestamp, pk):
+    payload = json.dumps([timestamp.isoformat(), pk], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_page_token(token):
+    try:
+        timestamp, pk = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid page_token")
+
+
+def message_json(message):
+    return {
+        "id": message.pk,
+        "timestamp": message.timestamp.isoformat().replace("+00:00", "Z"),
+        "message": json.loads(message.body).get("message"),
+    }
+
+
+def history_page(room, page_size, page_token=None):
+    """A page of the room's stored messages, newest first; returns (messages, next_page_token).
+
+    Pages are walked by keyset on (timestamp, id) down the (room, timestamp)
+    index, so older pages cost the same as the newest.
+    """
+    messages = ChatMessage.objects.filter(room=room)
+    if page_token:
+        timestamp, pk = decode_page_token(page_token)
+        # Written as a range plus an exclusion rather than an OR, so the index is seeked into, not scanned
+        messages = messages.filter(timestamp__lte=timestamp).exclude(timestamp=timestamp, pk__gte=pk)
+    page = list(messages.order_by("-timestamp", "-pk")[:page_size + 1])
+    next_page_token = None
+    if len(page) > page_size:
+        last = page[page_size - 1]
+        next_page_token = encode_page_token(last.timestamp, last.pk)
+    return [message_json(m) for m in page[:page_size]], next_page_token
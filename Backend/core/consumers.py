@@ -1,25 +1,272 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from urllib.parse import parse_qs
+from collections import deque
+from django.utils.timezone import now
+from core.metrics import websocket_active, websocket_connections, websocket_messages, websocket_overflows
+from Backend.logger import log
+from logging import ERROR, WARNING
+import asyncio
 import json
+import time
+
+def scope_user_email(scope):
+    """The User-Email header, or ?user_email= for clients that cannot set headers."""
+    headers = dict(scope.get("headers", []))
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return headers.get(b"user-email", b"").decode() or query.get("user_email", [""])[0]
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """Chat room member.
+
+    Messages are JSON-encoded once by the sender and fanned out to the room as
+    pre-serialized text. Connecting with ?coalesce=1 batches traffic in both
+    directions: incoming messages are published to the room and outgoing ones
+    sent to the client as one {"messages": [...]} frame every
+    CHAT_COALESCE_INTERVAL_MS.
+
+    send() returns once daphne has taken a frame, so a slow client's backlog
+    builds up in daphne's write buffer where the consumer cannot see it.
+    Instead each connection may have CHAT_SEND_BUFFER_BYTES of messages
+    queued or sent since the client's last frame; any frame, including a
+    bare {"ack": true}, resets the budget. A connection over it is closed
+    with code 1013.
+
+    Messages are stored through core.chat_history's write-behind buffer, and
+    on connect the room's last CHAT_HISTORY_REPLAY messages (?replay=N for
+    fewer) are sent first, framed like live ones, from this process's ring.
+    """
+
+    # Live messages also in the replay are dropped for this long after connect
+    REPLAY_OVERLAP_SECONDS = 5
+
     async def connect(self):
+        # Imported here: routing is loaded before the app registry is ready
+        from core.chat_history import room_group
+
+        websocket_connections.inc(consumer="chat")
+        websocket_active.inc(consumer="chat")
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
-        self.room_group_name = f"chat_{self.room_name}"
+        self.room_group_name = room_group(self.room_name)
+
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.coalesce = query.get("coalesce", ["0"])[0] in ("1", "true")
+        self.coalesce_interval = settings.CHAT_COALESCE_INTERVAL_MS / 1000
+        self.send_queue = deque()
+        self.send_ready = asyncio.Event()
+        self.overflowed = False
+        self.unacked_bytes = 0
+        self.pending_messages = []
+        self.publish_task = None
+        self.replayed = set()
+        self.in_history = False
+        self.sender_task = asyncio.create_task(self.drain_send_queue())
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
         await self.accept()
+        if settings.CHAT_HISTORY_REPLAY > 0:
+            await self.replay(query.get("replay", [""])[0])
+
+    async def replay(self, requested):
+        from core.chat_history import room_history
+
+        try:
+            count = max(0, min(int(requested), settings.CHAT_HISTORY_REPLAY))
+        except ValueError:
+            count = settings.CHAT_HISTORY_REPLAY
+        # Joined after the room group, so nothing sent meanwhile is missed;
+        # what arrives both ways is dropped in chat_message
+        recent = await room_history.join(self.room_name)
+        self.in_history = True
+        recent = recent[-count:] if count else []
+        if recent:
+            self.replayed = set(recent)
+            self.replayed_until = time.monotonic() + self.REPLAY_OVERLAP_SECONDS
+            self.queue_texts([text for _, text in recent])
 
     async def disconnect(self, close_code):
+        websocket_active.dec(consumer="chat")
+        self.sender_task.cancel()
+        if self.publish_task is not None:
+            await self.publish_task
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if self.in_history:
+            from core.chat_history import room_history
+
+            await room_history.leave(self.room_name)
 
     async def receive(self, text_data):
+        from core.chat_history import ROOM_MAX_LENGTH, history_writer
+
+        websocket_messages.inc(consumer="chat", direction="received")
+        # The client is reading: everything sent so far is off daphne's buffer
+        self.unacked_bytes = 0
         data = json.loads(text_data)
-        message = data["message"]
-        
-        await self.channel_layer.group_send(
-            self.room_group_name, {"type": "chat_message", "message": message}
-        )
+        if "message" not in data:
+            return
+        # Encoded once here; every member forwards this text as-is
+        text = json.dumps({"message": data["message"]})
+        sent_at = now()
+        if len(self.room_name) <= ROOM_MAX_LENGTH:
+            history_writer.record(self.room_name, text, sent_at)
+
+        if not self.coalesce:
+            await self.channel_layer.group_send(self.room_group_name, {
+                "type": "chat_message", "room": self.room_name, "texts": [text], "timestamps": [sent_at.isoformat()]
+            })
+            return
+
+        self.pending_messages.append((sent_at.isoformat(), text))
+        if self.publish_task is None:
+            self.publish_task = asyncio.create_task(self.publish_pending())
+
+    async def publish_pending(self):
+        await asyncio.sleep(self.coalesce_interval)
+        messages, self.pending_messages = self.pending_messages, []
+        self.publish_task = None
+        await self.channel_layer.group_send(self.room_group_name, {
+            "type": "chat_message", "room": self.room_name,
+            "texts": [text for _, text in messages], "timestamps": [timestamp for timestamp, _ in messages]
+        })
 
     async def chat_message(self, event):
-        message = event["message"]
-        await self.send(text_data=json.dumps({"message": message}))
+        if self.overflowed:
+            return
+        texts = event.get("texts") or [json.dumps({"message": event["message"]})]
+        if self.replayed:
+            if time.monotonic() > self.replayed_until:
+                self.replayed = set()
+            else:
+                timestamps = event.get("timestamps") or [None] * len(texts)
+                texts = [text for timestamp, text in zip(timestamps, texts) if (timestamp, text) not in self.replayed]
+                if not texts:
+                    return
+        # json.dumps escapes non-ASCII, so characters are bytes
+        size = sum(len(text) for text in texts)
+        if self.unacked_bytes + size > settings.CHAT_SEND_BUFFER_BYTES:
+            self.overflowed = True
+            websocket_overflows.inc(consumer="chat")
+            log(level=WARNING, function="chat_message",
+                message=f"Send budget exhausted for {self.channel_name} in {self.room_group_name}; disconnecting.")
+            await self.close(code=1013)
+            return
+        self.queue_texts(texts, size)
+
+    def queue_texts(self, texts, size=None):
+        self.unacked_bytes += sum(len(text) for text in texts) if size is None else size
+        self.send_queue.extend(texts)
+        self.send_ready.set()
+
+    async def drain_send_queue(self):
+        try:
+            while True:
+                await self.send_ready.wait()
+                if self.coalesce:
+                    # Let messages arriving within the interval share this frame
+                    await asyncio.sleep(self.coalesce_interval)
+                self.send_ready.clear()
+                texts = list(self.send_queue)
+                self.send_queue.clear()
+                websocket_messages.inc(len(texts), consumer="chat", direction="sent")
+                if self.coalesce:
+                    await self.send(text_data='{"messages": [' + ",".join(texts) + "]}")
+                else:
+                    for text in texts:
+                        await self.send(text_data=text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Nothing would be delivered on this connection again
+            log(level=ERROR, function="drain_send_queue",
+                message=f"Sending to {self.channel_name} failed: {str(e)}; closing.")
+            await self.close(code=1011)
+
+
+class UploadJobConsumer(AsyncWebsocketConsumer):
+    """Pushes a user's queued upload jobs as they change.
+
+    The user is named by the User-Email header, or ?user_email= for clients
+    that cannot set headers. On connect the user's unfinished jobs are sent,
+    then one {"type": "upload_job", "job": {...}} frame per status or
+    progress update.
+    """
+
+    async def connect(self):
+        # Imported here: routing is loaded before the app registry is ready
+        from core.models import UploadJob
+        from core.credentials import aget_user_tokens
+        from core.upload_queue import job_group, upload_job_json
+
+        user_email = scope_user_email(self.scope)
+        token_data = await aget_user_tokens(user_email) if user_email else None
+        if token_data is None:
+            await self.close()
+            return
+
+        websocket_connections.inc(consumer="upload_jobs")
+        websocket_active.inc(consumer="upload_jobs")
+        self.group_name = job_group(token_data.user_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        active = UploadJob.objects.filter(
+            user_id=token_data.user_id, status__in=(UploadJob.QUEUED, UploadJob.UPLOADING)
+        ).order_by("created_at")
+        async for job in active:
+            await self.upload_job({"job": upload_job_json(job)})
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "group_name"):
+            websocket_active.dec(consumer="upload_jobs")
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def upload_job(self, event):
+        websocket_messages.inc(consumer="upload_jobs", direction="sent")
+        await self.send(text_data=json.dumps({"type": "upload_job", "job": event["job"]}))
+
+
+class DriveChangesConsumer(AsyncWebsocketConsumer):
+    """Pushes deltas from the user's Drive changes feed.
+
+    The user is named as for UploadJobConsumer. Once the feed position is
+    taken a {"type": "ready"} frame is sent; list files after it and apply
+    each {"type": "drive_changes", "added": [...], "modified": [...],
+    "removed": [ids]} frame on top. All of a user's connections to one
+    process share a single poller (core.drive_changes.ChangeWatcher). The
+    connection is closed with code 4401 if the user's Google account is
+    disconnected.
+    """
+
+    async def connect(self):
+        from core.credentials import aget_user_tokens
+        from core.drive_changes import subscribe
+
+        user_email = scope_user_email(self.scope)
+        token_data = await aget_user_tokens(user_email) if user_email else None
+        if token_data is None:
+            await self.close()
+            return
+
+        websocket_connections.inc(consumer="drive_changes")
+        websocket_active.inc(consumer="drive_changes")
+        self.user_email = token_data.user.username
+        await self.accept()
+        if not await subscribe(self.user_email, self.channel_name):
+            await self.close(code=4401)
+            return
+        await self.send(text_data=json.dumps({"type": "ready"}))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "user_email"):
+            from core.drive_changes import unsubscribe
+
+            websocket_active.dec(consumer="drive_changes")
+            unsubscribe(self.user_email, self.channel_name)
+
+    async def drive_changes(self, event):
+        websocket_messages.inc(consumer="drive_changes", direction="sent")
+        await self.send(text_data=event["text"])
+
+    async def drive_changes_closed(self, event):
+        await self.close(code=4401)
@@ -0,0 +1,260 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.timezone import make_aware, make_naive
+from core.models import UserToken
+from core import google_http
+from core.metrics import timed, token_refreshes
+from Backend.logger import log
+from logging import INFO
+
+
+SCOPES = [
+    "openid",
+    "https://www.googleapis.com/auth/userinfo.email",
+    "https://www.googleapis.com/auth/userinfo.profile",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive.readonly"
+]
+
+
+def get_user_tokens(user_email):
+    try:
+        return UserToken.objects.select_related("user").get(user__username=user_email)
+    except UserToken.DoesNotExist:
+        return None
+
+async def aget_user_tokens(user_email):
+    try:
+        return await UserToken.objects.select_related("user").aget(user__username=user_email)
+    except UserToken.DoesNotExist:
+        return None
+
+def build_credentials(token_data):
+    from google.oauth2.credentials import Credentials
+
+    client_id, client_secret = google_http.client_credentials()
+    return Credentials(
+        token=token_data.access_token,
+        refresh_token=token_data.refresh_token,
+        token_uri=google_http.TOKEN_URI,
+        client_id=client_id,
+        client_secret=client_secret,
+        scopes=SCOPES,
+        # google-auth compares expiry against naive UTC
+        expiry=make_naive(token_data.expires_at, timezone.utc)
+    )
+
+def authorized_http(credentials):
+    """Bind credentials to the shared transport pool; cheap, and safe to share across threads."""
+    from google_auth_httplib2 import AuthorizedHttp
+
+    return AuthorizedHttp(credentials, http=google_http.get_http_pool())
+
+
+class CachedCredentials:
+    """A user's token row and the Credentials built from it."""
+
+    def __init__(self, token_data, generation):
+        self.token_data = token_data
+        self.credentials = build_credentials(token_data)
+        self.generation = generation
+        self.cached_at = time.monotonic()
+
+    def update(self, token_data):
+        self.token_data = token_data
+        self.credentials.token = token_data.access_token
+        self.credentials.expiry = make_naive(token_data.expires_at, timezone.utc)
+        if not SHARED_GENERATIONS:
+            # The row is the generation; a refresh here must not invalidate the entry
+            self.generation = token_data.expires_at
+
+
+class CredentialCache:
+    """TTL-bounded LRU of CachedCredentials keyed by user email."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_email, generation):
+        with self._lock:
+            entry = self._entries.get(user_email)
+            if entry is None:
+                return None
+            if entry.generation != generation or time.monotonic() - entry.cached_at > self.ttl:
+                del self._entries[user_email]
+                return None
+            self._entries.move_to_end(user_email)
+            return entry
+
+    def put(self, user_email, entry):
+        with self._lock:
+            self._entries[user_email] = entry
+            self._entries.move_to_end(user_email)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def adopt(self, user_email, token_data):
+        """Hand a token refreshed elsewhere in this process to the user's cached entry, if any."""
+        with self._lock:
+            entry = self._entries.get(user_email)
+        if entry is not None and entry.token_data.pk == token_data.pk:
+            entry.update(token_data)
+
+    def discard(self, user_email):
+        with self._lock:
+            self._entries.pop(user_email, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+credential_cache = CredentialCache(settings.CREDENTIAL_CACHE_SIZE, settings.CREDENTIAL_CACHE_TTL)
+
+
+# Loads and refreshes for a user are serialised on one of a fixed set of lock
+# stripes, so concurrent requests for the same user share a single refresh.
+# Async callers take the same locks from a worker thread.
+LOCK_STRIPES = 64
+_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+def _stripe(user_email):
+    return hash(user_email) % LOCK_STRIPES
+
+
+# Cache backends whose contents (and locks) only hold within one process
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+# Each user has a generation counter in Django's cache. Bumping it makes every
+# process sharing that cache backend drop its local entry on the next lookup.
+# A per-process cache can't reach other processes, so there the generation is
+# the token row's expires_at, which every write to the row changes; that costs
+# a query per lookup, and an entry is dropped once its row is deleted.
+SHARED_GENERATIONS = settings.CACHES["default"]["BACKEND"] not in PROCESS_LOCAL_CACHES
+
+def _generation_key(user_email):
+    return f"credentials:generation:{user_email}"
+
+def get_generation(user_email):
+    if not SHARED_GENERATIONS:
+        return UserToken.objects.filter(user__username=user_email).values_list("expires_at", flat=True).first()
+    return cache.get(_generation_key(user_email), 0)
+
+async def aget_generation(user_email):
+    if not SHARED_GENERATIONS:
+        return await UserToken.objects.filter(user__username=user_email).values_list(
+            "expires_at", flat=True
+        ).afirst()
+    return await cache.aget(_generation_key(user_email), 0)
+
+def invalidate_credentials(user_email):
+    key = _generation_key(user_email)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+    credential_cache.discard(user_email)
+
+async def ainvalidate_credentials(user_email):
+    key = _generation_key(user_email)
+    await cache.aadd(key, 0, None)
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aset(key, 1, None)
+    credential_cache.discard(user_email)
+
+
+@timed("refresh")
+def refresh_credentials(entry):
+    """Refresh an expired access token and persist it.
+
+    The row is re-read first, so if another worker process has already
+    refreshed it we adopt its token instead of refreshing again. Google is
+    called outside any transaction, and the new token is only written if
+    the row still holds the expiry we refreshed from; otherwise the row
+    written meanwhile wins.
+    """
+    token_data = UserToken.objects.select_related("user").get(pk=entry.token_data.pk)
+    entry.update(token_data)
+    if not entry.credentials.expired:
+        return
+    from google.auth.transport.requests import Request
+
+    try:
+        entry.credentials.refresh(Request(google_http.get_session()))
+    except Exception:
+        token_refreshes.inc(result="error")
+        raise
+    token_refreshes.inc(result="ok")
+    access_token = entry.credentials.token
+    expires_at = make_aware(entry.credentials.expiry, timezone.utc)
+    updated = UserToken.objects.filter(pk=token_data.pk, expires_at=token_data.expires_at).update(
+        access_token=access_token, expires_at=expires_at
+    )
+    if not updated:
+        entry.update(UserToken.objects.select_related("user").get(pk=token_data.pk))
+        return
+    token_data.access_token = access_token
+    token_data.expires_at = expires_at
+    entry.update(token_data)
+    log(level=INFO, function="refresh_credentials", message=f"Access token refreshed for {token_data.user.username}.")
+
+
+@timed("auth")
+def get_credentials(user_email):
+    """Return the user's CachedCredentials with a usable access token, or None.
+
+    Cache hits with an unexpired token take no lock. Otherwise the caller
+    takes the user's lock and re-checks, so of N concurrent requests only
+    the first loads the row and refreshes; the rest reuse its result.
+    """
+    if not user_email:
+        return None
+    generation = get_generation(user_email)
+    entry = credential_cache.get(user_email, generation)
+    if entry is not None and not entry.credentials.expired:
+        return entry
+    return load_credentials(user_email, generation)
+
+async def aget_credentials(user_email):
+    """Async counterpart of get_credentials.
+
+    Misses and refreshes run the sync path in a worker thread, so they take
+    the same user lock as sync requests. Not the thread sync
+    views share, so a slow refresh only holds up lookups sharing its lock.
+    """
+    with timed("auth"):
+        if not user_email:
+            return None
+        generation = await aget_generation(user_email)
+        entry = credential_cache.get(user_email, generation)
+        if entry is not None and not entry.credentials.expired:
+            return entry
+        return await database_sync_to_async(load_credentials, thread_sensitive=False)(user_email, generation)
+
+def load_credentials(user_email, generation):
+    """Load and refresh the user's entry under their lock; returns it, or None without a token."""
+    with _locks[_stripe(user_email)]:
+        entry = credential_cache.get(user_email, generation)
+        if entry is None:
+            token_data = get_user_tokens(user_email)
+            if not token_data:
+                return None
+            entry = CachedCredentials(token_data, generation)
+            credential_cache.put(user_email, entry)
+        if entry.credentials.expired:
+            refresh_credentials(entry)
+    return entry
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+from googleapiclient.errors import HttpError
+from core.models import DriveFile
+from core.drive_index import FILE_FIELDS, upsert_files, bump_index_version
+from core.metrics import CallbackMetric
+from Backend.logger import log
+from logging import INFO
+
+# Process-wide totals for uploads answered from the index instead of re-sent
+dedup_metrics = {"hits": 0, "bytes_saved": 0}
+_metrics_lock = threading.Lock()
+CallbackMetric("drive_dedup_hits_total", "Uploads answered from the index instead of re-sent.", "counter",
+               lambda: dedup_metrics["hits"])
+CallbackMetric("drive_dedup_bytes_saved_total", "Upload bytes not sent thanks to deduplication.", "counter",
+               lambda: dedup_metrics["bytes_saved"])
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Compute each uploaded file's MD5 and size while its chunks arrive.
+
+    Runs ahead of Django's own upload handlers and passes every chunk on
+    unchanged, so hashing costs no extra pass over the file.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.checksums = {}  # field name -> [(md5, size), ...] in upload order
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.md5 = hashlib.md5(usedforsecurity=False)
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.md5.update(raw_data)
+        self.size += len(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.checksums.setdefault(self.field_name, []).append((self.md5.hexdigest(), self.size))
+        return None
+
+
+def hash_uploads(request):
+    """Install a HashingUploadHandler. Must be called before request.FILES is read."""
+    handler = HashingUploadHandler(request)
+    request.upload_handlers.insert(0, handler)
+    return handler
+
+
+def record_saving(size):
+    with _metrics_lock:
+        dedup_metrics["hits"] += 1
+        dedup_metrics["bytes_saved"] += size
+
+
+def deduplicate_upload(drive_service, user, name, md5, size):
+    """Answer an upload from a file the user already has on Drive, if any.
+
+    A match with the same name is returned as is; otherwise Drive makes a
+    server-side copy under the new name. Returns the Drive file, or None when
+    the upload has to be sent. Index rows that no longer match Drive are
+    dropped so the next upload does not hit them again.
+    """
+    for duplicate in DriveFile.objects.filter(user=user, md5_checksum=md5, size=size)[:5]:
+        try:
+            if duplicate.name == name:
+                file = drive_service.files().get(
+                    fileId=duplicate.file_id, fields=f"{FILE_FIELDS}, trashed"
+                ).execute()
+            else:
+                file = drive_service.files().copy(
+                    fileId=duplicate.file_id, body={"name": name}, fields=f"{FILE_FIELDS}, trashed"
+                ).execute()
+        except HttpError as e:
+            if e.status_code != 404:
+                raise
+            with transaction.atomic():
+                duplicate.delete()
+                bump_index_version(user)
+            continue
+
+        if file.get("trashed") or file.get("md5Checksum") != md5:
+            if file["id"] != duplicate.file_id:
+                drive_service.files().delete(fileId=file["id"]).execute()
+            with transaction.atomic():
+                duplicate.delete()
+                bump_index_version(user)
+            continue
+
+        upsert_files(user, [file])
+        record_saving(size)
+        log(level=INFO, function="deduplicate_upload",
+            message=f"Skipped re-uploading {size} bytes of {name}: matches {duplicate.file_id}")
+        return file
+    return None
@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from googleapiclient.errors import HttpError
+from core.drive_scheduler import scheduler, user_key
+from Backend.logger import log
+from logging import INFO, ERROR
+
+
+# Google caps a Drive batch request at 100 calls
+BATCH_LIMIT = 100
+OPERATIONS = ("get", "rename", "move", "delete")
+GET_FIELDS = "id, name, mimeType, createdTime, modifiedTime, parents, size, md5Checksum"
+
+
+def scheduler_key(drive_service):
+    """The key the scheduler files this service's calls under, as google_http's transport does."""
+    headers = {}
+    drive_service._http.credentials.apply(headers)
+    return user_key(headers)
+
+
+def retry_delay(key, request, exception, attempt):
+    """Seconds to wait before resending a failed call in another batch, or None to report its error.
+
+    The scheduler decides, as for every other Drive call: rate limited calls
+    pause the bucket they name, and other failures are only resent for
+    idempotent methods, within DRIVE_RETRY_MAX_ATTEMPTS.
+    """
+    if isinstance(exception, HttpError) and exception.resp is not None:
+        return scheduler.retry_delay(
+            key, request.method, request.uri, exception.status_code, exception.content, exception.resp, attempt
+        )
+    # The batch round trip failed, or its response could not be parsed (BatchError)
+    return scheduler.error_delay(request.method, request.uri, attempt)
+
+
+def build_request(files, operation, item):
+    if operation == "get":
+        return files.get(fileId=item["id"], fields=GET_FIELDS)
+    if operation == "parents":
+        return files.get(fileId=item["id"], fields="id, parents")
+    if operation == "rename":
+        return files.update(fileId=item["id"], body={"name": item["name"]}, fields="id, name")
+    if operation == "move":
+        return files.update(
+            fileId=item["id"],
+            addParents=item["folder_id"],
+            removeParents=",".join(item.get("parents", [])),
+            fields="id, parents"
+        )
+    if operation == "delete":
+        return files.delete(fileId=item["id"])
+    raise ValueError(f"Unknown operation: {operation}")
+
+
+def execute_batch(drive_service, requests):
+    """Send requests as one batch HTTP request; return (response, exception) per request."""
+    import httplib2
+
+    outcomes = {}
+
+    def callback(request_id, response, exception):
+        outcomes[request_id] = (response, exception)
+
+    batch = drive_service.new_batch_http_request(callback=callback)
+    for i, request in enumerate(requests):
+        batch.add(request, request_id=str(i))
+    try:
+        batch.execute()
+    except (HttpError, httplib2.HttpLib2Error, OSError) as e:
+        # The whole round trip failed, so every call in it failed with it
+        return [(None, e) for _ in requests]
+    return [outcomes.get(str(i), (None, None)) for i in range(len(requests))]
+
+
+def execute_with_retries(drive_service, operation, items):
+    """Run a chunk of items, re-batching only the calls that failed transiently.
+
+    Returns (succeeded, failed): a list of (item, response) pairs and a list
+    of per-item error results.
+    """
+    key = scheduler_key(drive_service)
+    files = drive_service.files()
+    succeeded, failed = [], []
+    pending = items
+    attempt = 0
+    while pending:
+        requests = [build_request(files, operation, item) for item in pending]
+        retry, delays = [], []
+        for item, request, (response, exception) in zip(pending, requests, execute_batch(drive_service, requests)):
+            if exception is None:
+                succeeded.append((item, response))
+                continue
+            delay = retry_delay(key, request, exception, attempt)
+            if delay is None:
+                failed.append(error_result(item, exception))
+            else:
+                retry.append(item)
+                delays.append(delay)
+        pending = retry
+        attempt += 1
+        if delays:
+            # The resent batch then takes its rate limit token like any other call
+            time.sleep(max(delays))
+    return succeeded, failed
+
+
+def error_result(item, exception):
+    if isinstance(exception, HttpError) and exception.resp is not None:
+        return {"id": item["id"], "status": "error", "code": exception.status_code,
+                "error": f"Google API Error: {exception._get_reason()}"}
+    return {"id": item["id"], "status": "error", "error": str(exception)}
+
+
+def run_chunk(drive_service, operation, items):
+    """Apply one operation to a chunk of at most BATCH_LIMIT items."""
+    if operation == "move":
+        # Moving needs each file's current parents, fetched in one batch first
+        found, failed = execute_with_retries(drive_service, "parents", items)
+        items = [dict(item, parents=response.get("parents", [])) for item, response in found]
+        if not items:
+            return failed
+        succeeded, move_failed = execute_with_retries(drive_service, "move", items)
+        failed += move_failed
+    else:
+        succeeded, failed = execute_with_retries(drive_service, operation, items)
+    return [{"id": item["id"], "status": "ok", "result": response or {}} for item, response in succeeded] + failed
+
+
+async def stream_bulk_results(drive_service, operation, items):
+    """Fan chunks out over a thread pool and yield NDJSON results as each chunk finishes.
+
+    An async generator, so the ASGI server sends each chunk's results as soon
+    as they are ready and no server thread waits on the batch.
+    """
+    chunks = [items[i:i + BATCH_LIMIT] for i in range(0, len(items), BATCH_LIMIT)]
+    pool = ThreadPoolExecutor(max_workers=min(settings.DRIVE_BULK_CONCURRENCY, len(chunks)))
+    loop = asyncio.get_running_loop()
+    ok = failed = 0
+
+    async def run(chunk):
+        try:
+            return await loop.run_in_executor(
+                pool, contextvars.copy_context().run, run_chunk, drive_service, operation, chunk
+            )
+        except Exception as e:
+            log(level=ERROR, function="stream_bulk_results", message=str(e))
+            return [{"id": item["id"], "status": "error", "error": str(e)} for item in chunk]
+
+    tasks = [asyncio.ensure_future(run(chunk)) for chunk in chunks]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            results = await next_done
+            for result in results:
+                if result["status"] == "ok":
+                    ok += 1
+                else:
+                    failed += 1
+            yield "".join(json.dumps(result) + "\n" for result in results)
+    finally:
+        # Stop queued chunks if the client went away mid-stream
+        for task in tasks:
+            task.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+    log(level=INFO, function="stream_bulk_results", message=f"Bulk {operation}: {ok} succeeded, {failed} failed.")
@@ -0,0 +1,210 @@
+import asyncio
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from core import google_http
+from core.credentials import aget_credentials
+from core.drive_index import fold_changes
+from core.drive_scheduler import backoff_delay, rate_limit_retry_after
+from core.google_http import GoogleAPIError
+from core.metrics import CallbackMetric, Counter
+from Backend.logger import log
+from logging import INFO, ERROR
+
+CHANGE_FIELDS = "nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, createdTime))"
+CHANGES_PAGE_SIZE = 1000
+# Allowance for Drive's clock and second-granular createdTime against ours
+CLOCK_SKEW = timedelta(seconds=2)
+
+change_polls = Counter(
+    "drive_changes_polls_total", "Drive changes feed polls made for WebSocket subscribers, by outcome.", ("result",)
+)
+
+
+def auth_failure(exception):
+    """Whether an error means the user's Google account can no longer be used, rather than a passing fault."""
+    from google.auth.exceptions import RefreshError
+
+    if isinstance(exception, (PermissionError, RefreshError)):
+        return True
+    return (
+        isinstance(exception, GoogleAPIError) and exception.status_code in (401, 403)
+        and rate_limit_retry_after(exception) is None
+    )
+
+
+class ChangeWatcher:
+    """One user's Drive changes feed, polled once for all of their connections in this process.
+
+    Polls start every DRIVE_CHANGES_POLL_INTERVAL seconds; each poll that
+    finds nothing doubles the wait, up to DRIVE_CHANGES_MAX_POLL_INTERVAL,
+    so an idle user costs one small changes.list call per maximum interval.
+    Uploads through this process wake the watcher at once (poll_soon). Deltas
+    are encoded once and sent to each subscribed channel.
+    """
+
+    def __init__(self, user_email):
+        self.user_email = user_email
+        self.channels = set()
+        self.page_token = None
+        self.polled_at = None
+        self.added_ids = {}  # file id -> createdTime, for files reported as added
+        self.failed = False
+        self.ready = asyncio.Event()
+        self.wake = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.task = None
+
+    async def start(self):
+        """Take the feed's current position; deltas are reported from here on.
+
+        Failures other than a disconnected account (rate limits, 5xx and
+        network errors that outlasted the scheduler's retries) are retried
+        with its backoff for as long as anyone is subscribed.
+        """
+        attempt = 0
+        try:
+            while self.channels:
+                try:
+                    cached = await aget_credentials(self.user_email)
+                    if cached is None:
+                        raise PermissionError("Google account is not connected")
+                    self.polled_at = now()
+                    self.page_token = await google_http.get_start_page_token(cached.credentials.token)
+                    return
+                except Exception as e:
+                    log(level=ERROR, function="ChangeWatcher.start", message=f"{self.user_email}: {str(e)}")
+                    if auth_failure(e):
+                        self.failed = True
+                        return
+                    delay = backoff_delay(min(attempt, 10), rate_limit_retry_after(e))
+                    attempt += 1
+                # Woken early when the last subscriber leaves
+                try:
+                    await asyncio.wait_for(self.wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.wake.clear()
+        finally:
+            self.ready.set()
+
+    async def run(self):
+        await self.start()
+        delay = settings.DRIVE_CHANGES_POLL_INTERVAL
+        while self.channels and not self.failed:
+            try:
+                await asyncio.wait_for(self.wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            # Cleared before polling, so a wake during the poll triggers another
+            self.wake.clear()
+            if not self.channels:
+                break
+            try:
+                found = await self.poll()
+            except Exception as e:
+                log(level=ERROR, function="ChangeWatcher.poll", message=f"{self.user_email}: {str(e)}")
+                if auth_failure(e):
+                    self.failed = True
+                    await self.broadcast({"type": "drive_changes_closed"})
+                    break
+                change_polls.inc(result="error")
+                delay = max(rate_limit_retry_after(e) or 0, min(delay * 2, settings.DRIVE_CHANGES_MAX_POLL_INTERVAL))
+                continue
+            change_polls.inc(result="changed" if found else "idle")
+            if found:
+                delay = settings.DRIVE_CHANGES_POLL_INTERVAL
+            else:
+                delay = min(delay * 2, settings.DRIVE_CHANGES_MAX_POLL_INTERVAL)
+
+    async def poll(self):
+        """Read the feed up to its end and push any delta; returns whether anything changed."""
+        cached = await aget_credentials(self.user_email)
+        if cached is None:
+            raise PermissionError("Google account is no longer connected")
+        since, self.polled_at = self.polled_at, now()
+        # A file created before this window can no longer be reported as added
+        self.added_ids = {
+            file_id: created_time for file_id, created_time in self.added_ids.items()
+            if created_time >= since - CLOCK_SKEW
+        }
+        changed, removed = {}, set()
+        page_token = self.page_token
+        while True:
+            response = await google_http.list_changes(
+                cached.credentials.token, page_token, pageSize=CHANGES_PAGE_SIZE, spaces="drive", fields=CHANGE_FIELDS
+            )
+            fold_changes(response.get("changes", []), changed, removed)
+            if "newStartPageToken" in response:
+                page_token = response["newStartPageToken"]
+                break
+            page_token = response["nextPageToken"]
+        self.page_token = page_token
+        if not changed and not removed:
+            return False
+
+        # The feed does not say whether a file is new; call it added the first
+        # time it is seen if it was created since the previous poll
+        added, modified = [], []
+        for file_id, file in changed.items():
+            created_time = parse_datetime(file["createdTime"]) if file.get("createdTime") else None
+            if created_time and created_time >= since - CLOCK_SKEW and file_id not in self.added_ids:
+                self.added_ids[file_id] = created_time
+                added.append(file)
+            else:
+                modified.append(file)
+        for file_id in removed:
+            self.added_ids.pop(file_id, None)
+        text = json.dumps({"type": "drive_changes", "added": added, "modified": modified, "removed": sorted(removed)})
+        await self.broadcast({"type": "drive_changes", "text": text})
+        log(level=INFO, function="ChangeWatcher.poll",
+            message=f"Pushed {len(changed)} updates and {len(removed)} removals for {self.user_email}.")
+        return True
+
+    async def broadcast(self, message):
+        from channels.layers import get_channel_layer
+
+        channel_layer = get_channel_layer()
+        await asyncio.gather(*(channel_layer.send(channel, message) for channel in list(self.channels)))
+
+
+# user email -> ChangeWatcher for connections served by this process
+watchers = {}
+
+
+async def subscribe(user_email, channel_name):
+    """Attach a channel to the user's watcher, starting it if needed; returns False if it cannot run."""
+    watcher = watchers.get(user_email)
+    if watcher is None or watcher.task.done():
+        watcher = watchers[user_email] = ChangeWatcher(user_email)
+        watcher.task = asyncio.create_task(watcher.run())
+    watcher.channels.add(channel_name)
+    await watcher.ready.wait()
+    if watcher.failed:
+        unsubscribe(user_email, channel_name)
+        return False
+    return True
+
+
+def unsubscribe(user_email, channel_name):
+    watcher = watchers.get(user_email)
+    if watcher is None:
+        return
+    watcher.channels.discard(channel_name)
+    if not watcher.channels:
+        # The loop sees no channels when it wakes and ends
+        del watchers[user_email]
+        watcher.wake.set()
+
+
+def poll_soon(user_email):
+    """Wake the user's watcher, if this process has one; safe to call from any thread."""
+    watcher = watchers.get(user_email)
+    if watcher is not None and not watcher.loop.is_closed():
+        watcher.loop.call_soon_threadsafe(watcher.wake.set)
+
+
+CallbackMetric("drive_changes_watchers", "Users with a live Drive changes subscription in this process.", "gauge",
+               lambda: len(watchers))
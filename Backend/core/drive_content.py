@@ -0,0 +1,207 @@
+import asyncio
+import os
+import re
+import tempfile
+import time
+from django.conf import settings
+from core.google_http import get_session, DRIVE_FILES_URI, GoogleAPIError
+from Backend.logger import log
+from logging import ERROR
+
+CONTENT_FIELDS = "id, name, mimeType, size, md5Checksum, version"
+STREAM_CHUNK_SIZE = 1024 * 1024
+TEMP_PREFIX = ".tmp-"
+
+
+def content_tag(metadata):
+    """Identify a file's current contents: its md5, or its version for files without one."""
+    return metadata.get("md5Checksum") or f"v{metadata['version']}"
+
+
+def parse_range(header, size):
+    """Return (start, end) for a single "bytes=" range, or None to send the whole file.
+
+    Malformed and multi-range headers are ignored, as RFC 9110 allows.
+    Raises ValueError when the range cannot be satisfied.
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+class ContentCache:
+    """Size-bounded on-disk cache of file contents, evicted least recently used first.
+
+    Entries are named <file id>-<content tag>, so a changed file never matches
+    a stale entry. An entry's mtime is its recency and every hit refreshes it,
+    so all worker processes share one directory and one LRU order. Entries are
+    written to a temporary file and renamed into place once complete; temp
+    files older than temp_max_age were abandoned by a crashed worker.
+    """
+
+    def __init__(self, directory, max_bytes, max_file_bytes, temp_max_age):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.temp_max_age = temp_max_age
+
+    def path(self, file_id, tag):
+        return os.path.join(self.directory, f"{file_id}-{tag}".replace(os.sep, "_"))
+
+    def accepts(self, size):
+        return 0 < size <= min(self.max_file_bytes, self.max_bytes)
+
+    def open(self, file_id, tag):
+        """Open a cached entry for reading, or return None on a miss."""
+        path = self.path(file_id, tag)
+        try:
+            cached_file = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted after opening; the open handle still reads it
+        return cached_file
+
+    def create_temp(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.directory, prefix=TEMP_PREFIX, delete=False)
+
+    def commit(self, temp_path, file_id, tag):
+        os.replace(temp_path, self.path(file_id, tag))
+        self.evict(keep=self.path(file_id, tag), superseded_prefix=f"{file_id}-")
+
+    def evict(self, keep=None, superseded_prefix=None):
+        """Drop abandoned temp files and superseded versions, then the least recently used entries."""
+        entries = []
+        stale = time.time() - self.temp_max_age
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith(TEMP_PREFIX):
+                    if stat.st_mtime < stale:
+                        self.remove(entry.path)
+                    continue
+                if entry.path != keep and superseded_prefix and entry.name.startswith(superseded_prefix):
+                    self.remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+
+    def clean(self):
+        """Run an eviction pass at startup, clearing what crashed workers left behind."""
+        try:
+            self.evict()
+        except FileNotFoundError:
+            pass  # nothing cached yet
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+content_cache = ContentCache(
+    settings.DRIVE_CONTENT_CACHE_DIR,
+    settings.DRIVE_CONTENT_CACHE_MAX_BYTES,
+    settings.DRIVE_CONTENT_CACHE_MAX_FILE_BYTES,
+    settings.DRIVE_CONTENT_CACHE_TEMP_MAX_AGE,
+)
+
+
+def open_media(access_token, file_id, byte_range=None):
+    """Start streaming a file's contents (or one byte range of them) from Drive."""
+    headers = {"Authorization": f"Bearer {access_token}"}
+    if byte_range:
+        headers["Range"] = "bytes=%d-%d" % byte_range
+    response = get_session().get(
+        f"{DRIVE_FILES_URI}/{file_id}", params={"alt": "media"}, headers=headers,
+        stream=True, timeout=settings.GOOGLE_HTTP_TIMEOUT,
+    )
+    if response.status_code >= 400:
+        reason = response.reason
+        try:
+            reason = response.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            pass
+        response.close()
+        raise GoogleAPIError(response.status_code, reason)
+    return response
+
+
+def _read_media(chunks, temp):
+    chunk = next(chunks, None)
+    if chunk is not None and temp:
+        temp.write(chunk)
+    return chunk
+
+
+def _finish_media(response, file_id, temp, tag, complete):
+    response.close()
+    if not temp:
+        return
+    temp.close()
+    if complete:
+        try:
+            content_cache.commit(temp.name, file_id, tag)
+        except OSError as e:
+            log(level=ERROR, function="stream_media", message=f"Could not cache {file_id}: {str(e)}")
+            content_cache.remove(temp.name)
+    else:
+        content_cache.remove(temp.name)
+
+
+async def stream_media(response, file_id, tag=None, size=None):
+    """Yield a Drive media response in chunks, never holding the whole file.
+
+    Each chunk is read on a worker thread, so a download never blocks the
+    event loop. When tag is given the body is also written to the content
+    cache and the entry kept only if all `size` bytes arrived.
+    """
+    temp = await asyncio.to_thread(content_cache.create_temp) if tag else None
+    chunks = response.iter_content(STREAM_CHUNK_SIZE)
+    written = 0
+    try:
+        while (chunk := await asyncio.to_thread(_read_media, chunks, temp)) is not None:
+            written += len(chunk)
+            yield chunk
+    finally:
+        await asyncio.to_thread(_finish_media, response, file_id, temp, tag, written == size)
+
+
+async def read_range(cached_file, start, end):
+    """Yield bytes start..end of an open cached file, reading each chunk on a worker thread."""
+    try:
+        await asyncio.to_thread(cached_file.seek, start)
+        remaining = end - start + 1
+        while remaining:
+            chunk = await asyncio.to_thread(cached_file.read, min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        cached_file.close()
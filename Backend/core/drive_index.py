@@ -0,0 +1,138 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+from core.models import DriveFile, DriveSyncState
+from Backend.logger import log
+from logging import INFO
+
+
+FILE_FIELDS = "id, name, mimeType, createdTime, md5Checksum, size"
+SYNC_PAGE_SIZE = 1000
+BULK_BATCH_SIZE = 1000
+
+
+def to_drive_file(user, file):
+    return DriveFile(
+        user=user,
+        file_id=file["id"],
+        name=file.get("name", ""),
+        mime_type=file.get("mimeType", ""),
+        created_time=parse_datetime(file["createdTime"]) if file.get("createdTime") else None,
+        md5_checksum=file.get("md5Checksum", ""),
+        size=int(file["size"]) if file.get("size") else None
+    )
+
+
+def as_drive_json(file):
+    """Render a DriveFile in the same shape files.list returns."""
+    created_time = file.created_time.isoformat().replace("+00:00", "Z") if file.created_time else None
+    return {"id": file.file_id, "name": file.name, "mimeType": file.mime_type, "createdTime": created_time}
+
+
+def bump_index_version(user):
+    """Advance the index version once the rows it covers are written; call after the write, in its transaction."""
+    DriveSyncState.objects.filter(user=user).update(version=F("version") + 1)
+    # Whatever changed the index also changed Drive; tell live subscribers once it is committed
+    from core.drive_changes import poll_soon
+
+    transaction.on_commit(lambda: poll_soon(user.username))
+
+
+def upsert_files(user, files):
+    # One transaction, so no reader sees the new version with the old rows
+    with transaction.atomic():
+        DriveFile.objects.bulk_create(
+            [to_drive_file(user, f) for f in files],
+            batch_size=BULK_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=["user", "file_id"],
+            update_fields=["name", "mime_type", "created_time", "md5_checksum", "size"]
+        )
+        bump_index_version(user)
+
+
+def full_sync(drive_service, user):
+    """Rebuild the user's index from files.list and record a changes cursor.
+
+    The start page token is taken before listing so that changes made while
+    the listing runs are replayed by the next incremental sync.
+    """
+    start_page_token = drive_service.changes().getStartPageToken().execute()["startPageToken"]
+
+    files, page_token = [], None
+    while True:
+        list_kwargs = {"pageSize": SYNC_PAGE_SIZE, "fields": f"nextPageToken, files({FILE_FIELDS})"}
+        if page_token:
+            list_kwargs["pageToken"] = page_token
+        response = drive_service.files().list(**list_kwargs).execute()
+        files.extend(response.get("files", []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+
+    with transaction.atomic():
+        DriveFile.objects.filter(user=user).delete()
+        upsert_files(user, files)
+        DriveSyncState.objects.update_or_create(
+            user=user,
+            defaults={"start_page_token": start_page_token, "last_synced_at": now()}
+        )
+
+    log(level=INFO, function="full_sync", message=f"Indexed {len(files)} files for {user.username}.")
+    return len(files)
+
+
+def fold_changes(changes, changed, removed):
+    """Fold a page of changes.list entries into the latest file per id and the set of removed ids."""
+    for change in changes:
+        file_id = change.get("fileId")
+        if change.get("removed") or not change.get("file"):
+            changed.pop(file_id, None)
+            removed.add(file_id)
+        else:
+            changed[file_id] = change["file"]
+            removed.discard(file_id)
+
+
+def incremental_sync(drive_service, sync_state):
+    """Apply changes since the stored start page token to the user's index."""
+    user = sync_state.user
+    page_token = sync_state.start_page_token
+    changed, removed = {}, set()
+    while True:
+        response = drive_service.changes().list(
+            pageToken=page_token,
+            pageSize=SYNC_PAGE_SIZE,
+            spaces="drive",
+            fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))"
+        ).execute()
+        fold_changes(response.get("changes", []), changed, removed)
+        if "newStartPageToken" in response:
+            page_token = response["newStartPageToken"]
+            break
+        page_token = response["nextPageToken"]
+
+    with transaction.atomic():
+        if removed:
+            DriveFile.objects.filter(user=user, file_id__in=removed).delete()
+            bump_index_version(user)
+        if changed:
+            upsert_files(user, changed.values())
+        sync_state.start_page_token = page_token
+        sync_state.last_synced_at = now()
+        sync_state.save(update_fields=["start_page_token", "last_synced_at"])
+
+    if changed or removed:
+        log(level=INFO, function="incremental_sync",
+            message=f"Applied {len(changed)} updates and {len(removed)} removals for {user.username}.")
+    return len(changed) + len(removed)
+
+
+def sync_user_files(drive_service, user):
+    """Bring the user's index up to date: a full sync the first time, deltas after."""
+    try:
+        sync_state = DriveSyncState.objects.select_related("user").get(user=user)
+    except DriveSyncState.DoesNotExist:
+        return full_sync(drive_service, user)
+    return incremental_sync(drive_service, sync_state)
@@ -0,0 +1,382 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.parse import parse_qs, urlsplit
+from django.conf import settings
+from core.metrics import Counter, Histogram, google_method
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Safe to resend after a 5xx or a dropped connection, as is any resumable
+# upload call: opening a session creates nothing until bytes arrive, and each
+# range sent to one names its offset. Anything else is only resent after a
+# rate limit response, which Google sends without acting on the call
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "DELETE"}
+SCHEDULED_PATHS = ("/drive/", "/upload/drive/", "/batch")
+# Hop-by-hop and encoding headers dropped when a coalesced body is handed out decoded
+UNSHARED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+throttle_wait = Histogram(
+    "google_api_throttle_wait_seconds", "Time Drive calls waited for a rate limit token."
+)
+throttled = Counter(
+    "google_api_throttled_total", "Drive calls refused because the rate limit wait exceeded the maximum."
+)
+retries = Counter(
+    "google_api_retries_total", "Drive calls resent after a retryable failure.", ("method", "status")
+)
+coalesced = Counter(
+    "google_api_coalesced_total", "Drive reads answered by an identical call already in flight.", ("method",)
+)
+
+
+class QuotaExceeded(Exception):
+    """A Drive call would have to wait longer than DRIVE_RATE_LIMIT_MAX_WAIT for a token."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Drive rate limit reached; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` banked.
+
+    Callers reserve a token and then sleep for the returned wait, so the
+    balance can go negative: a burst is queued in arrival order and let out
+    at `rate` instead of every call going upstream at once.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def refund(self):
+        self.tokens += 1
+
+    def pause(self, until):
+        self.paused_until = max(self.paused_until, until)
+
+
+def is_scheduled(uri):
+    return urlsplit(uri).path.startswith(SCHEDULED_PATHS)
+
+
+def upload_session_id(uri):
+    """The upload_id of a resumable upload session URI, else None."""
+    return parse_qs(urlsplit(uri).query).get("upload_id", [None])[0]
+
+
+def user_key(headers, uri=""):
+    """Calls are attributed to a user by their access token.
+
+    Calls to a resumable session URI carry no token (the URI authorises
+    them), so they are attributed to their session instead.
+    """
+    authorization = (headers or {}).get("authorization") or (headers or {}).get("Authorization")
+    if authorization:
+        return authorization
+    upload_id = upload_session_id(uri)
+    return f"upload:{upload_id}" if upload_id else ""
+
+
+def resendable(method, uri):
+    return method in IDEMPOTENT_METHODS or "resumable" in parse_qs(urlsplit(uri).query).get("uploadType", [])
+
+
+def rate_limit_scope(status, content):
+    """Which limit a response reports: "user", "global" (the project's quota), or None.
+
+    Drive answers 429 when a user sends too much, and 403 with
+    userRateLimitExceeded or rateLimitExceeded for the per-user and
+    per-project quotas.
+    """
+    if status == 429:
+        return "user"
+    if status != 403:
+        return None
+    try:
+        errors = json.loads(content or b"{}")["error"].get("errors", [])
+        reasons = {error.get("reason") for error in errors}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+    if "rateLimitExceeded" in reasons:
+        return "global"
+    return "user" if "userRateLimitExceeded" in reasons else None
+
+
+def retry_after_seconds(headers):
+    try:
+        return float((headers or {}).get("retry-after") or (headers or {}).get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_retry_after(exception):
+    """Seconds a client should wait when `exception` means Drive is rate limiting it, else None.
+
+    Covers QuotaExceeded and googleapiclient HttpError / google_http.GoogleAPIError
+    rate limit responses that outlasted the scheduler's retries.
+    """
+    if isinstance(exception, QuotaExceeded):
+        return exception.retry_after
+    status = getattr(exception, "status_code", None)
+    if rate_limit_scope(status, getattr(exception, "content", None)) is None:
+        return None
+    return retry_after_seconds(getattr(exception, "resp", None)) or settings.DRIVE_RETRY_BASE_DELAY * 2
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Exponential backoff with full jitter; a server-sent Retry-After wins."""
+    if retry_after is not None:
+        return min(retry_after, settings.DRIVE_RETRY_MAX_DELAY)
+    return random.uniform(0, min(settings.DRIVE_RETRY_MAX_DELAY, settings.DRIVE_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class DriveScheduler:
+    """Admission, retry and coalescing policy shared by every Drive call in the process.
+
+    Each call takes a token from the global bucket and from its user's
+    bucket, waiting up to DRIVE_RATE_LIMIT_MAX_WAIT. A rate limit response
+    pauses the bucket it names (the user's, or the global one when the
+    project's quota is exhausted) for the backoff delay, so calls queued behind it wait
+    instead of hitting the same limit. The transports in google_http drive
+    these hooks.
+    """
+
+    def __init__(self, global_rate, global_burst, user_rate, user_burst, max_wait, max_users=10000):
+        self.global_bucket = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_wait = max_wait
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def _user_bucket(self, key):
+        if self.user_rate <= 0:
+            return None
+        bucket = self._users.get(key)
+        if bucket is None:
+            bucket = self._users[key] = TokenBucket(self.user_rate, self.user_burst)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(key)
+        return bucket
+
+    def reserve(self, key):
+        """Take a global and a per-user token; return how long to wait before sending."""
+        now = time.monotonic()
+        with self._lock:
+            buckets = [bucket for bucket in (self.global_bucket, self._user_bucket(key)) if bucket]
+            wait = max([bucket.reserve(now) for bucket in buckets], default=0.0)
+            if wait > self.max_wait:
+                for bucket in buckets:
+                    bucket.refund()
+                throttled.inc()
+                raise QuotaExceeded(wait)
+        if wait > 0:
+            throttle_wait.observe(wait)
+        return wait
+
+    def admit(self, key):
+        wait = self.reserve(key)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aadmit(self, key):
+        wait = self.reserve(key)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def retry_delay(self, key, method, uri, status, content, headers, attempt, replayable=True):
+        """Seconds to wait before resending a response's call, or None to hand the response back."""
+        if not replayable or attempt >= settings.DRIVE_RETRY_MAX_ATTEMPTS:
+            return None
+        scope = rate_limit_scope(status, content)
+        if scope is None and not (status in RETRYABLE_STATUS_CODES and resendable(method, uri)):
+            return None
+        delay = backoff_delay(attempt, retry_after_seconds(headers))
+        if scope is not None:
+            with self._lock:
+                bucket = self.global_bucket if scope == "global" else self._user_bucket(key)
+                if bucket is not None:
+                    bucket.pause(time.monotonic() + delay)
+        retries.inc(method=google_method(method, uri), status=status)
+        return delay
+
+    def error_delay(self, method, uri, attempt):
+        """Seconds to wait before resending after a transport error, or None to raise it."""
+        if not resendable(method, uri) or attempt >= settings.DRIVE_RETRY_MAX_ATTEMPTS:
+            return None
+        retries.inc(method=google_method(method, uri), status="error")
+        return backoff_delay(attempt)
+
+    def coalesce(self, key, call):
+        """Run call(), or share the result of the identical call already in flight."""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            coalesced.inc(method=google_method("GET", key[1]))
+            return future.result()
+        try:
+            result = call()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+        future.set_result(result)
+        return result
+
+
+scheduler = DriveScheduler(
+    settings.DRIVE_RATE_LIMIT_GLOBAL,
+    settings.DRIVE_RATE_LIMIT_GLOBAL_BURST,
+    settings.DRIVE_RATE_LIMIT_PER_USER,
+    settings.DRIVE_RATE_LIMIT_PER_USER_BURST,
+    settings.DRIVE_RATE_LIMIT_MAX_WAIT,
+)
+
+
+class AsyncScheduledTransport:
+    """httpx transport wrapper that puts the AsyncClient's Drive calls through the scheduler.
+
+    Identical GETs in flight on the event loop share one upstream call.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self._inflight = {}
+
+    async def __aenter__(self):
+        await self.transport.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.transport.__aexit__(*args)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    async def handle_async_request(self, request):
+        uri = str(request.url)
+        if not is_scheduled(uri):
+            return await self.transport.handle_async_request(request)
+        key = user_key(request.headers, uri)
+        if request.method != "GET":
+            return await self.send(key, request)
+
+        inflight_key = (key, uri)
+        future = self._inflight.get(inflight_key)
+        if future is not None:
+            import httpx
+
+            coalesced.inc(method=google_method("GET", uri))
+            try:
+                status, headers, content = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # The leading request was cancelled, not this one; go upstream ourselves
+                    return await self.handle_async_request(request)
+                raise
+            return httpx.Response(status, headers=headers, content=content, request=request)
+
+        future = self._inflight[inflight_key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await self.send(key, request)
+            await response.aread()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # Waiters re-raise it; don't warn when there are none
+            raise
+        finally:
+            self._inflight.pop(inflight_key, None)
+        headers = [(name, value) for name, value in response.headers.items() if name.lower() not in UNSHARED_HEADERS]
+        future.set_result((response.status_code, headers, response.content))
+        return response
+
+    async def send(self, key, request):
+        import httpx
+
+        replayable = isinstance(request.stream, httpx.ByteStream)
+        uri = str(request.url)
+        attempt = 0
+        while True:
+            await scheduler.aadmit(key)
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError:
+                delay = scheduler.error_delay(request.method, uri, attempt) if replayable else None
+                if delay is None:
+                    raise
+            else:
+                content = await response.aread() if response.status_code in (403, 429) else None
+                delay = scheduler.retry_delay(
+                    key, request.method, uri, response.status_code, content, response.headers, attempt, replayable
+                )
+                if delay is None:
+                    return response
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+def scheduled_adapter(**kwargs):
+    """A requests HTTPAdapter that puts the session's Drive calls through the scheduler.
+
+    Streamed bodies (relayed upload ranges) cannot be resent, so those calls
+    are rate limited but never retried here.
+    """
+    import requests
+
+    class ScheduledAdapter(requests.adapters.HTTPAdapter):
+        def send(self, request, **send_kwargs):
+            if not is_scheduled(request.url):
+                return super().send(request, **send_kwargs)
+            key = user_key(request.headers, request.url)
+            replayable = request.body is None or isinstance(request.body, (bytes, str))
+            attempt = 0
+            while True:
+                scheduler.admit(key)
+                try:
+                    response = super().send(request, **send_kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    delay = scheduler.error_delay(request.method, request.url, attempt) if replayable else None
+                    if delay is None:
+                        raise
+                else:
+                    content = response.content if response.status_code in (403, 429) else None
+                    delay = scheduler.retry_delay(
+                        key, request.method, request.url, response.status_code, content, response.headers, attempt,
+                        replayable
+                    )
+                    if delay is None:
+                        return response
+                    response.close()
+                attempt += 1
+                time.sleep(delay)
+
+    return ScheduledAdapter(**kwargs)
@@ -0,0 +1,199 @@
+import base64
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timezone
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from core.models import DriveFile
+from core.drive_index import as_drive_json, sync_user_files
+from Backend.logger import log
+from logging import ERROR
+
+# sort parameter -> (DriveFile field, descending, Drive orderBy)
+SORTS = {
+    "name": ("name", False, "name"),
+    "-name": ("name", True, "name desc"),
+    "created_time": ("created_time", False, "createdTime"),
+    "-created_time": ("created_time", True, "createdTime desc"),
+}
+DEFAULT_SORT = "name"
+MAX_TERM_LENGTH = 256
+INDEX_TOKEN_PREFIX = "i."
+DRIVE_TOKEN_PREFIX = "d."
+
+
+def parse_timestamp(value, name):
+    """An ISO 8601 datetime or date (midnight UTC); naive datetimes are UTC."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+        parsed = datetime.combine(date, time.min)
+    return make_aware(parsed, timezone.utc) if is_naive(parsed) else parsed
+
+
+def parse_search_params(params):
+    """Normalise search query parameters into a search dict, or raise ValueError."""
+    search = {
+        "q": params.get("q", "").strip(),
+        "prefix": params.get("prefix", "").strip(),
+        "mime_types": [m.strip() for m in params.get("mime_type", "").split(",") if m.strip()],
+        "created_after": None,
+        "created_before": None,
+        "sort": params.get("sort") or DEFAULT_SORT,
+    }
+    if len(search["q"]) > MAX_TERM_LENGTH or len(search["prefix"]) > MAX_TERM_LENGTH:
+        raise ValueError(f"Search terms are limited to {MAX_TERM_LENGTH} characters")
+    if search["sort"] not in SORTS:
+        raise ValueError(f"sort must be one of {', '.join(SORTS)}")
+    for name in ("created_after", "created_before"):
+        if params.get(name):
+            search[name] = parse_timestamp(params[name], name)
+    return search
+
+
+def search_key(search):
+    """The search's parameters as a stable string, for ETags."""
+    return json.dumps(search, default=str, sort_keys=True)
+
+
+def encode_index_token(value, pk):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([value, pk], separators=(",", ":")).encode()
+    return INDEX_TOKEN_PREFIX + base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_index_token(token, field):
+    try:
+        payload = token.removeprefix(INDEX_TOKEN_PREFIX)
+        value, pk = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        if field == "created_time" and value is not None:
+            value = datetime.fromisoformat(value)
+        return value, int(pk)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid page_token")
+
+
+def after(field, value, pk, descending):
+    """Keyset condition for rows after (value, pk) in (field, pk) order, nulls last."""
+    op = "lt" if descending else "gt"
+    if value is None:
+        return Q(**{f"{field}__isnull": True, f"pk__{op}": pk})
+    return (
+        Q(**{f"{field}__{op}": value})
+        | Q(**{field: value, f"pk__{op}": pk})
+        | Q(**{f"{field}__isnull": True})
+    )
+
+
+def search_index(user, search, page_size, page_token=None):
+    """Run a search against the user's DriveFile index; returns (files, next_page_token).
+
+    Name terms become case-insensitive LIKE filters, which PostgreSQL answers
+    from DriveFile's trigram index. Pages are walked
+    by keyset on (sort field, pk), so deep pages cost the same as the first.
+    """
+    field, descending, _ = SORTS[search["sort"]]
+    files = DriveFile.objects.filter(user=user)
+    if search["q"]:
+        files = files.filter(name__icontains=search["q"])
+    if search["prefix"]:
+        files = files.filter(name__istartswith=search["prefix"])
+    if search["mime_types"]:
+        mime_filter = Q()
+        for mime_type in search["mime_types"]:
+            if mime_type.endswith("/*"):
+                mime_filter |= Q(mime_type__startswith=mime_type[:-1])
+            else:
+                mime_filter |= Q(mime_type=mime_type)
+        files = files.filter(mime_filter)
+    if search["created_after"]:
+        files = files.filter(created_time__gte=search["created_after"])
+    if search["created_before"]:
+        files = files.filter(created_time__lt=search["created_before"])
+    if page_token:
+        files = files.filter(after(field, *decode_index_token(page_token, field), descending))
+
+    order = F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+    files = files.order_by(order, "-pk" if descending else "pk")
+    page = list(files[:page_size + 1])
+    next_page_token = None
+    if len(page) > page_size:
+        last = page[page_size - 1]
+        next_page_token = encode_index_token(getattr(last, field), last.pk)
+    return [as_drive_json(f) for f in page[:page_size]], next_page_token
+
+
+def quote(value):
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def drive_query(search):
+    """Translate a search into a Drive files.list `q` and `orderBy`.
+
+    Drive's `name contains` matches from the start of words in a name, so
+    a `q` substring can match fewer files here than in the index.
+    """
+    clauses = []
+    for term in (search["q"], search["prefix"]):
+        if term:
+            clauses.append(f"name contains {quote(term)}")
+    mime_clauses = [
+        f"mimeType contains {quote(m[:-1])}" if m.endswith("/*") else f"mimeType = {quote(m)}"
+        for m in search["mime_types"]
+    ]
+    if mime_clauses:
+        clauses.append("(" + " or ".join(mime_clauses) + ")")
+    if search["created_after"]:
+        clauses.append(f"createdTime >= {quote(search['created_after'].isoformat())}")
+    if search["created_before"]:
+        clauses.append(f"createdTime < {quote(search['created_before'].isoformat())}")
+    return " and ".join(clauses), SORTS[search["sort"]][2]
+
+
+def search_drive(drive_service, search, page_size, page_token=None):
+    """Run a search as a Drive files.list query; returns (files, next_page_token)."""
+    q, order_by = drive_query(search)
+    list_kwargs = {
+        "pageSize": page_size, "orderBy": order_by, "fields": "nextPageToken, files(id, name, mimeType, createdTime)"
+    }
+    if q:
+        list_kwargs["q"] = q
+    if page_token:
+        list_kwargs["pageToken"] = page_token.removeprefix(DRIVE_TOKEN_PREFIX)
+    listing = drive_service.files().list(**list_kwargs).execute()
+    next_page_token = listing.get("nextPageToken")
+    return listing.get("files", []), DRIVE_TOKEN_PREFIX + next_page_token if next_page_token else None
+
+
+# Cold indexes are built in the background while searches fall back to Drive
+_warm_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="drive-index-warm")
+_warming = set()
+_warming_lock = threading.Lock()
+
+
+def warm_index(drive_service, user):
+    """Start a full sync of the user's index unless one is already running in this process."""
+    with _warming_lock:
+        if user.pk in _warming:
+            return
+        _warming.add(user.pk)
+    _warm_pool.submit(_warm, drive_service, user)
+
+
+def _warm(drive_service, user):
+    close_old_connections()
+    try:
+        sync_user_files(drive_service, user)
+    except Exception as e:
+        log(level=ERROR, function="warm_index", message=f"Index sync for {user.username} failed: {str(e)}")
+    finally:
+        close_old_connections()
+        with _warming_lock:
+            _warming.discard(user.pk)
+
@@ -0,0 +1,72 @@
+import json
+from functools import lru_cache
+from django.conf import settings
+from core.credentials import authorized_http
+from core.google_http import get_http_pool
+from core.metrics import record_upload, timed
+
+
+@lru_cache(maxsize=None)
+def get_drive_template():
+    """Drive v3 resource built once per process; build() parses the whole discovery document."""
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+
+    document = json.loads(get_static_doc("drive", "v3"))
+    root_url = f"{settings.GOOGLE_API_BASE_URL}/"
+    if document["rootUrl"] != root_url:
+        # Serve API, upload and batch calls from GOOGLE_API_BASE_URL instead
+        document["rootUrl"] = root_url
+        document["baseUrl"] = root_url + document["servicePath"]
+        document.pop("mtlsRootUrl", None)
+    return build_from_document(document, http=get_http_pool())
+
+
+@timed("build")
+def get_drive_service(credentials):
+    """Drive resource bound to credentials, sharing the template's parsed discovery
+    document and the process-wide transport pool."""
+    from googleapiclient.discovery import Resource
+
+    template = get_drive_template()
+    return Resource(
+        http=authorized_http(credentials),
+        baseUrl=template._baseUrl,
+        model=template._model,
+        requestBuilder=template._requestBuilder,
+        developerKey=template._developerKey,
+        resourceDesc=template._resourceDesc,
+        rootDesc=template._rootDesc,
+        schema=template._schema,
+        universe_domain=template._universe_domain,
+    )
+
+
+def upload_file_to_drive(drive_service, file_obj, fields="id", progress=None, metrics_path="sync"):
+    """Stream an UploadedFile to Drive as a chunked resumable upload.
+
+    The (disk-spooled) file is read one chunk at a time, and each chunk
+    continues from the last byte Google acknowledged. Transient errors are
+    retried by the scheduler under the transport, not by next_chunk. `progress`,
+    if given, is called with the bytes committed after each chunk.
+    """
+    from googleapiclient.http import MediaIoBaseUpload
+
+    media = MediaIoBaseUpload(
+        file_obj,
+        mimetype=file_obj.content_type or "application/octet-stream",
+        chunksize=settings.DRIVE_UPLOAD_CHUNK_SIZE,
+        resumable=True
+    )
+    upload_request = drive_service.files().create(
+        body={"name": file_obj.name},
+        media_body=media,
+        fields=fields
+    )
+    uploaded_file = None
+    while uploaded_file is None:
+        status, uploaded_file = upload_request.next_chunk()
+        if status is not None and progress is not None:
+            progress(status.resumable_progress)
+    record_upload(metrics_path, media.size(), media.size())
+    return uploaded_file
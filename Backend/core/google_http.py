@@ -0,0 +1,404 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+import weakref
+from datetime import timedelta
+from functools import lru_cache
+from logging import ERROR
+from django.conf import settings
+from django.utils.timezone import now
+from Backend.logger import log
+from core.metrics import record_google_call, record_upload
+from core.drive_scheduler import (
+    AsyncScheduledTransport, scheduled_adapter, scheduler, is_scheduled, user_key
+)
+
+
+TOKEN_URI = f"{settings.GOOGLE_OAUTH2_BASE_URL}/token"
+USERINFO_URI = f"{settings.GOOGLE_API_BASE_URL}/oauth2/v1/userinfo"
+DRIVE_FILES_URI = f"{settings.GOOGLE_API_BASE_URL}/drive/v3/files"
+DRIVE_UPLOAD_URI = f"{settings.GOOGLE_API_BASE_URL}/upload/drive/v3/files"
+DRIVE_START_PAGE_TOKEN_URI = f"{settings.GOOGLE_API_BASE_URL}/drive/v3/changes/startPageToken"
+DRIVE_CHANGES_URI = f"{settings.GOOGLE_API_BASE_URL}/drive/v3/changes"
+
+
+class GoogleAPIError(Exception):
+    """Error response from a Google endpoint, shaped like googleapiclient's HttpError."""
+
+    def __init__(self, status_code, reason, content=None):
+        super().__init__(f"<GoogleAPIError {status_code} \"{reason}\">")
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+
+
+# One keep-alive pool per event loop, shared by every request handled on it.
+# A client's connections belong to its loop, so it is never reused on
+# another one, and it is dropped together with its loop.
+_clients = weakref.WeakKeyDictionary()
+
+# Keep-alive pool for synchronous calls (relayed uploads, media downloads,
+# token refreshes, userinfo), shared by every thread in the process
+_session = None
+_session_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def get_client_config():
+    """OAuth client config, parsed once per process and kept in memory.
+
+    Read from the base64 GOOGLE_CLIENT_SECRET_JSON variable, else a local
+    client_secret.json, else GOOGLE_CLIENT_ID/GOOGLE_CLIENT_SECRET.
+    """
+    base64_secret = os.getenv("GOOGLE_CLIENT_SECRET_JSON")
+    if base64_secret:
+        try:
+            return json.loads(base64.b64decode(base64_secret))
+        except ValueError as e:
+            log(level=ERROR, function="get_client_config", message=f"Failed to decode GOOGLE_CLIENT_SECRET_JSON: {str(e)}")
+    secrets_file = os.path.join(settings.BASE_DIR, "client_secret.json")
+    if os.path.exists(secrets_file):
+        with open(secrets_file) as f:
+            return json.load(f)
+    return {"web": {
+        "client_id": settings.GOOGLE_CLIENT_ID,
+        "client_secret": settings.GOOGLE_CLIENT_SECRET,
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": TOKEN_URI,
+    }}
+
+
+def client_credentials():
+    """(client_id, client_secret) of the configured OAuth client."""
+    client = get_client_config()["web"]
+    return client["client_id"], client["client_secret"]
+
+
+# Keep-alive httplib2 transports behind every googleapiclient call
+_http_pool = None
+
+
+def get_async_client():
+    """Return the running loop's AsyncClient, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        import httpx
+
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+            max_connections=settings.GOOGLE_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GOOGLE_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.GOOGLE_HTTP_KEEPALIVE_EXPIRY,
+        ))
+        client = httpx.AsyncClient(
+            transport=AsyncScheduledTransport(transport),
+            timeout=settings.GOOGLE_HTTP_TIMEOUT,
+            event_hooks={"request": [_mark_request_start], "response": [_record_response]},
+        )
+        _clients[loop] = client
+    return client
+
+
+async def _mark_request_start(request):
+    request.extensions["started_at"] = time.perf_counter()
+
+
+async def _record_response(response):
+    request = response.request
+    record_google_call(request.method, str(request.url), response.status_code,
+                       time.perf_counter() - request.extensions["started_at"])
+
+
+def _record_session_response(response, *args, **kwargs):
+    # elapsed runs to the response headers, so streamed bodies are not included
+    record_google_call(response.request.method, response.url, response.status_code,
+                       response.elapsed.total_seconds())
+
+
+def get_session():
+    """Return the process-wide requests.Session, importing requests on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+
+                session = requests.Session()
+                adapter = scheduled_adapter(
+                    pool_connections=settings.GOOGLE_HTTP_MAX_KEEPALIVE,
+                    pool_maxsize=settings.GOOGLE_HTTP_MAX_KEEPALIVE,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.hooks["response"].append(_record_session_response)
+                _session = session
+    return _session
+
+
+class PooledHttp:
+    """Thread-safe stand-in for httplib2.Http backed by a pool of transports.
+
+    httplib2.Http is not thread-safe, so each call checks a transport out for
+    its duration only (httplib2 reads the whole response before returning)
+    and hands it back with its keep-alive connections open for the next
+    caller. At most GOOGLE_HTTP_MAX_CONNECTIONS calls run at once and
+    GOOGLE_HTTP_MAX_KEEPALIVE idle transports are kept.
+    """
+
+    def __init__(self, max_connections, max_idle, timeout):
+        import httplib2
+
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.connections = {}
+        # As googleapiclient's build_http: Drive answers unfinished resumable
+        # upload chunks with 308, which must not be followed as a redirect
+        self.redirect_codes = httplib2.REDIRECT_CODES - {308}
+        self.follow_redirects = True
+
+    def _checkout(self):
+        import httplib2
+
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop()
+        transport = httplib2.Http(timeout=self.timeout)
+        transport.redirect_codes = self.redirect_codes
+        transport.follow_redirects = self.follow_redirects
+        return transport
+
+    def _checkin(self, transport):
+        with self._idle_lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(transport)
+                return
+        transport.close()
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        """httplib2.Http.request; Drive calls go through the scheduler, and identical GETs share one call."""
+        if not is_scheduled(uri):
+            return self._send(uri, method, body, headers, **kwargs)
+        key = user_key(headers, uri)
+        if method == "GET":
+            return scheduler.coalesce((key, uri), lambda: self._scheduled(key, uri, method, body, headers, kwargs))
+        return self._scheduled(key, uri, method, body, headers, kwargs)
+
+    def _scheduled(self, key, uri, method, body, headers, kwargs):
+        import httplib2
+
+        if hasattr(body, "read"):
+            # googleapiclient hands each upload chunk over as a stream slice;
+            # read it (one chunk) so the call can be resent
+            body = body.read()
+        attempt = 0
+        while True:
+            scheduler.admit(key)
+            try:
+                response, content = self._send(uri, method, body, headers, **kwargs)
+            except (httplib2.HttpLib2Error, OSError):
+                delay = scheduler.error_delay(method, uri, attempt)
+                if delay is None:
+                    raise
+            else:
+                delay = scheduler.retry_delay(key, method, uri, response.status, content, response, attempt)
+                if delay is None:
+                    return response, content
+            attempt += 1
+            time.sleep(delay)
+
+    def _send(self, uri, method, body, headers, **kwargs):
+        with self._slots:
+            transport = self._checkout()
+            start, status = time.perf_counter(), "error"
+            try:
+                response = transport.request(uri, method, body=body, headers=headers, **kwargs)
+                status = response[0].status
+                return response
+            finally:
+                record_google_call(method, uri, status, time.perf_counter() - start)
+                self._checkin(transport)
+
+    def close(self):
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for transport in idle:
+            transport.close()
+
+
+def get_http_pool():
+    """Return the process-wide PooledHttp, creating it on first use."""
+    global _http_pool
+    if _http_pool is None:
+        with _session_lock:
+            if _http_pool is None:
+                _http_pool = PooledHttp(
+                    settings.GOOGLE_HTTP_MAX_CONNECTIONS,
+                    settings.GOOGLE_HTTP_MAX_KEEPALIVE,
+                    settings.GOOGLE_HTTP_TIMEOUT,
+                )
+    return _http_pool
+
+
+async def close_async_client():
+    """Close the running loop's AsyncClient."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _raise_for_status(response):
+    """Raise GoogleAPIError for an error httpx or requests response."""
+    if response.status_code < 400:
+        return
+    reason = getattr(response, "reason_phrase", None) or getattr(response, "reason", "")
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {}
+    error = payload.get("error") if isinstance(payload, dict) else None
+    if isinstance(error, dict):
+        reason = error.get("message", reason)
+    elif error:
+        reason = payload.get("error_description", error)
+    raise GoogleAPIError(response.status_code, reason, response.content)
+
+
+async def exchange_code(code, redirect_uri):
+    """Exchange an OAuth authorization code for tokens."""
+    client_id, client_secret = client_credentials()
+    response = await get_async_client().post(TOKEN_URI, data={
+        "code": code,
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "redirect_uri": redirect_uri,
+        "grant_type": "authorization_code",
+    })
+    _raise_for_status(response)
+    return response.json()
+
+
+async def fetch_user_info(access_token):
+    response = await get_async_client().get(
+        USERINFO_URI,
+        headers={"Authorization": f"Bearer {access_token}"}
+    )
+    _raise_for_status(response)
+    return response.json()
+
+
+def _refresh_grant(refresh_token):
+    client_id, client_secret = client_credentials()
+    return {
+        "refresh_token": refresh_token,
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "grant_type": "refresh_token",
+    }
+
+
+def _refreshed_token(payload):
+    return payload["access_token"], now() + timedelta(seconds=payload.get("expires_in", 3600))
+
+
+def refresh_access_token(refresh_token):
+    """Run a refresh_token grant on the shared session; returns (access_token, expires_at)."""
+    response = get_session().post(TOKEN_URI, data=_refresh_grant(refresh_token), timeout=settings.GOOGLE_HTTP_TIMEOUT)
+    _raise_for_status(response)
+    return _refreshed_token(response.json())
+
+
+async def list_files(access_token, **params):
+    response = await get_async_client().get(
+        DRIVE_FILES_URI,
+        params=params,
+        headers={"Authorization": f"Bearer {access_token}"}
+    )
+    _raise_for_status(response)
+    return response.json()
+
+
+async def get_start_page_token(access_token):
+    response = await get_async_client().get(
+        DRIVE_START_PAGE_TOKEN_URI,
+        headers={"Authorization": f"Bearer {access_token}"}
+    )
+    _raise_for_status(response)
+    return response.json()["startPageToken"]
+
+
+async def list_changes(access_token, page_token, **params):
+    response = await get_async_client().get(
+        DRIVE_CHANGES_URI,
+        params={"pageToken": page_token, **params},
+        headers={"Authorization": f"Bearer {access_token}"}
+    )
+    _raise_for_status(response)
+    return response.json()
+
+
+def _committed_offset(response):
+    """Parse the next byte to send from a 308 response's Range header."""
+    committed = response.headers.get("Range")
+    return int(committed.rsplit("-", 1)[1]) + 1 if committed else 0
+
+
+async def start_resumable_upload(access_token, metadata, mimetype, size, fields="id"):
+    """Open a Drive resumable upload session and return its session URI."""
+    response = await get_async_client().post(
+        DRIVE_UPLOAD_URI,
+        params={"uploadType": "resumable", "fields": fields},
+        json=metadata,
+        headers={
+            "Authorization": f"Bearer {access_token}",
+            "X-Upload-Content-Type": mimetype,
+            "X-Upload-Content-Length": str(size),
+        }
+    )
+    _raise_for_status(response)
+    return response.headers["Location"]
+
+
+def _read_chunk(file_obj, offset, size):
+    file_obj.seek(offset)
+    return file_obj.read(size)
+
+
+async def upload_file(access_token, file_obj, fields="id"):
+    """Upload an UploadedFile through a resumable session in fixed-size chunks.
+
+    Only one chunk is held in memory at a time, read from the (disk-spooled)
+    file on a worker thread. The scheduler resends a chunk after a transient
+    failure; each one continues from the last byte Drive acknowledged.
+    """
+    size = file_obj.size
+    chunk_size = settings.DRIVE_UPLOAD_CHUNK_SIZE
+    session_uri = await start_resumable_upload(
+        access_token,
+        {"name": file_obj.name},
+        file_obj.content_type or "application/octet-stream",
+        size,
+        fields=fields
+    )
+
+    offset = 0
+    while True:
+        chunk = await asyncio.to_thread(_read_chunk, file_obj, offset, chunk_size)
+        end = offset + len(chunk) - 1
+        content_range = f"bytes {offset}-{end}/{size}" if chunk else f"bytes */{size}"
+        response = await get_async_client().put(
+            session_uri,
+            content=chunk,
+            headers={"Content-Range": content_range}
+        )
+        record_upload("async", len(chunk))
+        if response.status_code == 308:
+            offset = _committed_offset(response)
+            continue
+        _raise_for_status(response)
+        record_upload("async", 0, size)
+        return response.json()
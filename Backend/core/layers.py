@@ -0,0 +1,78 @@
+import asyncio
+from channels_redis.pubsub import RedisPubSubChannelLayer, RedisPubSubLoopLayer, RedisSingleShardConnection
+from channels_redis.utils import _wrap_close
+
+
+class BatchingShardConnection(RedisSingleShardConnection):
+    """Shard connection that pipelines queued publishes into one round trip.
+
+    Publishes made while a batch is in flight wait in an outbox and go out
+    together in the next pipeline, so an idle layer adds no latency and a
+    busy one sends up to max_batch PUBLISH commands per round trip.
+    """
+
+    def __init__(self, host, channel_layer, max_batch=100):
+        super().__init__(host, channel_layer)
+        self.max_batch = max_batch
+        self._outbox = []
+        self._drain_task = None
+
+    async def publish(self, channel, message):
+        future = asyncio.get_running_loop().create_future()
+        self._outbox.append((channel, message, future))
+        if self._drain_task is None or self._drain_task.done():
+            self._drain_task = asyncio.ensure_future(self._drain())
+        await future
+
+    async def _drain(self):
+        while self._outbox:
+            batch = self._outbox[:self.max_batch]
+            del self._outbox[:self.max_batch]
+            try:
+                async with self._lock:
+                    self._ensure_redis()
+                    async with self._redis.pipeline(transaction=False) as pipe:
+                        for channel, message, _ in batch:
+                            pipe.publish(channel, message)
+                        await pipe.execute()
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+    async def flush(self):
+        if self._drain_task is not None:
+            await asyncio.gather(self._drain_task, return_exceptions=True)
+            self._drain_task = None
+        await super().flush()
+
+
+class BatchingRedisPubSubLoopLayer(RedisPubSubLoopLayer):
+    def __init__(self, *args, publish_batch_size=100, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._shards = [
+            BatchingShardConnection(shard.host, self, max_batch=publish_batch_size) for shard in self._shards
+        ]
+
+
+class BatchingRedisPubSubChannelLayer(RedisPubSubChannelLayer):
+    """Redis pub/sub channel layer shared by every worker process and host.
+
+    A group_send is one PUBLISH to the group's Redis channel; each worker
+    subscribed to it fans the message out to its local members. Publishes
+    are batched per shard by BatchingShardConnection.
+    """
+
+    def _get_layer(self):
+        loop = asyncio.get_running_loop()
+        try:
+            layer = self._layers[loop]
+        except KeyError:
+            layer = BatchingRedisPubSubLoopLayer(*self._args, **self._kwargs, channel_layer=self)
+            self._layers[loop] = layer
+            _wrap_close(self, loop)
+        return layer
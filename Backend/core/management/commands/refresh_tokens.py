@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from core.token_refresh import sweep
+
+
+class Command(BaseCommand):
+    help = "Refresh Google access tokens that expire within the refresh horizon."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="keep sweeping every --interval seconds")
+        parser.add_argument("--interval", type=float, default=60)
+        parser.add_argument("--horizon", type=float, help="seconds ahead to refresh (default TOKEN_REFRESH_HORIZON)")
+        parser.add_argument("--concurrency", type=int, help="default TOKEN_REFRESH_CONCURRENCY")
+        parser.add_argument("--batch-size", type=int, help="default TOKEN_REFRESH_BATCH_SIZE")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            stats = sweep(options["horizon"], options["concurrency"], options["batch_size"])
+            self.stdout.write(
+                f"{stats['due']} due, {stats['ok']} refreshed, {stats['error']} failed, "
+                f"{stats['skipped']} skipped in {time.perf_counter() - started:.2f}s"
+            )
+            if not options["loop"]:
+                return
+            close_old_connections()
+            time.sleep(options["interval"])
@@ -0,0 +1,303 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from Backend.logger import log
+from logging import INFO
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (2 ** 16, 2 ** 20, 2 ** 23, 2 ** 26, 2 ** 29, 2 ** 32)
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """A named family of samples, one per combination of label values."""
+
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._samples = {}
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            samples = list(self._samples.items())
+        for key, value in samples:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._samples[key] = self._samples.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class CallbackMetric(Metric):
+    """Reads its value when scraped, for totals kept elsewhere."""
+
+    def __init__(self, name, documentation, type, callback):
+        super().__init__(name, documentation)
+        self.type = type
+        self.callback = callback
+
+    def render(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}",
+                f"{self.name} {self.callback()}"]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._samples.get(key)
+            if sample is None:
+                # Per-bucket counts (last one is +Inf), sum, count
+                sample = self._samples[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            sample[0][index] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def _render_sample(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            le = f'le="{bound}"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+registry = []
+
+
+def render_metrics():
+    """Every metric in Prometheus text exposition format."""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests handled.", ("endpoint", "method", "status")
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time from request to response headers.", ("endpoint", "method")
+)
+http_request_phase = Histogram(
+    "http_request_phase_seconds", "Time spent per request in each phase.", ("endpoint", "phase")
+)
+google_requests = Counter(
+    "google_api_requests_total", "Calls to Google APIs.", ("method", "status")
+)
+google_request_duration = Histogram(
+    "google_api_request_duration_seconds", "Latency of calls to Google APIs.", ("method",)
+)
+token_refreshes = Counter(
+    "google_token_refreshes_total", "Access token refreshes.", ("result",)
+)
+upload_bytes = Counter(
+    "drive_upload_bytes_total", "Bytes sent to Drive in uploads.", ("path",)
+)
+upload_size = Histogram(
+    "drive_upload_size_bytes", "Size of files uploaded to Drive.", ("path",), buckets=SIZE_BUCKETS
+)
+websocket_connections = Counter(
+    "websocket_connections_total", "WebSocket connections accepted.", ("consumer",)
+)
+websocket_active = Gauge(
+    "websocket_connections_active", "WebSocket connections currently open.", ("consumer",)
+)
+websocket_messages = Counter(
+    "websocket_messages_total", "WebSocket messages received and sent.", ("consumer", "direction")
+)
+websocket_overflows = Counter(
+    "websocket_overflow_disconnects_total", "Connections closed for falling behind.", ("consumer",)
+)
+
+
+# Per-request phase timings: phase -> [seconds, calls]. Work a request hands
+# to a thread pool is submitted with contextvars.copy_context().run, so its
+# threads add to the same dict.
+_timings = ContextVar("request_timings", default=None)
+_timings_lock = threading.Lock()
+
+
+def record_phase(phase, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        with _timings_lock:
+            entry = timings.setdefault(phase, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to the current request's `phase`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - start)
+
+
+def time_queries(execute, sql, params, many, context):
+    """Connection execute wrapper adding every query to the "db" phase."""
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record_phase("db", time.perf_counter() - start)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver; times queries on every connection in every thread."""
+    if time_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_queries)
+
+
+DRIVE_METHODS = (
+    (re.compile(r"^/token$"), {"POST": "oauth.token"}),
+    (re.compile(r"^/oauth2/v\d/userinfo$"), {"GET": "oauth.userinfo"}),
+    (re.compile(r"^/upload/drive/v3/files$"), {"POST": "files.create", "PUT": "files.create.chunk"}),
+    (re.compile(r"^/upload/drive/v3/files/[^/]+$"), {"PATCH": "files.update", "PUT": "files.update.chunk"}),
+    (re.compile(r"^/drive/v3/files$"), {"GET": "files.list", "POST": "files.create"}),
+    (re.compile(r"^/drive/v3/files/[^/]+/copy$"), {"POST": "files.copy"}),
+    (re.compile(r"^/drive/v3/files/[^/]+$"), {"GET": "files.get", "PATCH": "files.update", "DELETE": "files.delete"}),
+    (re.compile(r"^/drive/v3/changes/startPageToken$"), {"GET": "changes.getStartPageToken"}),
+    (re.compile(r"^/drive/v3/changes$"), {"GET": "changes.list"}),
+    (re.compile(r"^/batch(/drive/v3)?$"), {"POST": "batch"}),
+)
+
+
+def google_method(http_method, uri):
+    """Name a Google call by its API method, keeping metric labels low-cardinality."""
+    parts = urlsplit(uri)
+    for pattern, methods in DRIVE_METHODS:
+        if pattern.search(parts.path):
+            name = methods.get(http_method.upper(), "other")
+            return name + ".media" if name == "files.get" and "alt=media" in parts.query else name
+    return "other"
+
+
+def record_google_call(http_method, uri, status, seconds):
+    method = google_method(http_method, uri)
+    google_requests.inc(method=method, status=status)
+    google_request_duration.observe(seconds, method=method)
+    record_phase("google", seconds)
+
+
+def record_upload(path, sent, size=None):
+    """Count bytes sent to Drive; pass the file `size` once an upload completes."""
+    upload_bytes.inc(sent, path=path)
+    if size is not None:
+        upload_size.observe(size, path=path)
+
+
+class TimingMiddleware:
+    """Time each request and the phases inside it.
+
+    Phases (db, auth, refresh, build, google, ...) are filled in by timed()
+    blocks and the hooks above. They are returned in a Server-Timing header
+    (unless SERVER_TIMING_HEADER is off), logged as one structured record
+    per request and aggregated into the histograms served by metrics_view.
+    Streaming responses are timed to their first byte.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start, token = time.perf_counter(), _timings.set({})
+        try:
+            response = self.get_response(request)
+            return self.finish(request, response, start, _timings.get())
+        finally:
+            _timings.reset(token)
+
+    async def __acall__(self, request):
+        start, token = time.perf_counter(), _timings.set({})
+        try:
+            response = await self.get_response(request)
+            return self.finish(request, response, start, _timings.get())
+        finally:
+            _timings.reset(token)
+
+    def finish(self, request, response, start, timings):
+        total = time.perf_counter() - start
+        match = request.resolver_match
+        endpoint = "/" + match.route if match else "unmatched"
+
+        http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        http_request_duration.observe(total, endpoint=endpoint, method=request.method)
+        for phase, (seconds, _) in timings.items():
+            http_request_phase.observe(seconds, endpoint=endpoint, phase=phase)
+
+        if settings.SERVER_TIMING_HEADER:
+            entries = [
+                f'{phase};dur={seconds * 1000:.1f};desc="x{calls}"' for phase, (seconds, calls) in timings.items()
+            ]
+            entries.append(f"total;dur={total * 1000:.1f}")
+            response.headers["Server-Timing"] = ", ".join(entries)
+
+        log(level=INFO, function="request_timing", status_code=response.status_code,
+            endpoint=endpoint, method=request.method, duration_ms=round(total * 1000, 2),
+            phases={phase: round(seconds * 1000, 2) for phase, (seconds, _) in timings.items()})
+        return response
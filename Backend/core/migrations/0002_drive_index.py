@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-17 05:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriveSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_page_token', models.CharField(max_length=255)),
+                ('last_synced_at', models.DateTimeField()),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DriveFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_id', models.CharField(max_length=128)),
+                ('name', models.CharField(max_length=1024)),
+                ('mime_type', models.CharField(max_length=255)),
+                ('created_time', models.DateTimeField(null=True)),
+                ('md5_checksum', models.CharField(blank=True, default='', max_length=32)),
+                ('size', models.BigIntegerField(null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drive_files', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'md5_checksum'], name='core_drivef_user_id_bba7d2_idx'), models.Index(fields=['user', 'name'], name='core_drivef_user_id_698615_idx'), models.Index(fields=['user', 'mime_type'], name='core_drivef_user_id_878065_idx'), models.Index(fields=['user', 'created_time'], name='core_drivef_user_id_fa8657_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'file_id'), name='unique_user_drive_file')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.6 on 2026-10-17 05:18
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_uploadsession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=1024)),
+                ('mime_type', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('md5_checksum', models.CharField(blank=True, default='', max_length=32)),
+                ('dedup', models.BooleanField(default=True)),
+                ('spool_path', models.TextField()),
+                ('host', models.CharField(blank=True, default='', max_length=255)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('uploading', 'Uploading'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('bytes_sent', models.BigIntegerField(default=0)),
+                ('file_id', models.CharField(blank=True, default='', max_length=128)),
+                ('deduplicated', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='core_upload_status_5ca9b8_idx'), models.Index(fields=['host', 'status'], name='core_upload_host_787dae_idx'), models.Index(fields=['user', 'status'], name='core_upload_user_id_cb94e4_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+from django.db.models.functions import Upper
+
+
+# On the UPPER(name) that icontains and istartswith filter on, so LIKE '%term%'
+# name searches use it. PostgreSQL only, and kept out of the model state so
+# DriveFile.Meta, and the migrations made from it, are the same on every backend
+NAME_TRGM_INDEX = GinIndex(OpClass(Upper("name"), name="gin_trgm_ops"), name="core_drivefile_name_trgm")
+
+
+def add_name_trgm_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.add_index(apps.get_model("core", "DriveFile"), NAME_TRGM_INDEX)
+
+
+def remove_name_trgm_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.remove_index(apps.get_model("core", "DriveFile"), NAME_TRGM_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_uploadjob'),
+    ]
+
+    operations = [
+        # Only acts on PostgreSQL
+        TrigramExtension(),
+        migrations.RunPython(add_name_trgm_index, remove_name_trgm_index),
+    ]
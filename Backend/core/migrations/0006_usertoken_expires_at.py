@@ -0,0 +1,19 @@
+# Generated by Django 5.1.6 on 2026-10-17 05:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_drivefile_name_trgm'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usertoken',
+            index=models.Index(fields=['expires_at'], name='core_usertoken_expires_at'),
+        ),
+    ]
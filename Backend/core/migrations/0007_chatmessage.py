@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-17 05:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_usertoken_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room', models.CharField(max_length=255)),
+                ('body', models.TextField()),
+                ('timestamp', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'timestamp'], name='core_chatme_room_bd9ae6_idx')],
+            },
+        ),
+    ]
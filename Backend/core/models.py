@@ -1,6 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils.timezone import now
+import uuid
 
 class UserToken(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -8,8 +9,129 @@ class UserToken(models.Model):
     refresh_token = models.TextField()
     expires_at = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            # Due tokens for the proactive refresh sweep (core.token_refresh)
+            models.Index(fields=["expires_at"], name="core_usertoken_expires_at"),
+        ]
+
     def is_expired(self):
         return now() >= self.expires_at
 
     def __str__(self):
-        return f"Tokens for {self.user.username}"
\ No newline at end of file
+        return f"Tokens for {self.user.username}"
+
+
+class DriveFile(models.Model):
+    """Local copy of a user's Drive file metadata, kept current by core.drive_index."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="drive_files")
+    file_id = models.CharField(max_length=128)
+    name = models.CharField(max_length=1024)
+    mime_type = models.CharField(max_length=255)
+    created_time = models.DateTimeField(null=True)
+    md5_checksum = models.CharField(max_length=32, blank=True, default="")
+    size = models.BigIntegerField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "file_id"], name="unique_user_drive_file"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "md5_checksum"]),
+            models.Index(fields=["user", "name"]),
+            models.Index(fields=["user", "mime_type"]),
+            models.Index(fields=["user", "created_time"]),
+        ]
+        # PostgreSQL also gets core_drivefile_name_trgm, from migration 0005
+
+    def __str__(self):
+        return f"{self.name} ({self.file_id})"
+
+
+class DriveSyncState(models.Model):
+    """Drive changes feed cursor for a user's DriveFile index."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    start_page_token = models.CharField(max_length=255)
+    last_synced_at = models.DateTimeField()
+    # Bumped on every write to the index; part of the index listing's ETag
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Drive sync state for {self.user.username}"
+
+
+class UploadSession(models.Model):
+    """Client-resumable upload relayed into a Drive resumable upload session."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_sessions")
+    name = models.CharField(max_length=1024)
+    mime_type = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    drive_session_uri = models.TextField()
+    committed = models.BigIntegerField(default=0)
+    file_id = models.CharField(max_length=128, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def complete(self):
+        return bool(self.file_id)
+
+    def __str__(self):
+        return f"Upload of {self.name} ({self.committed}/{self.size})"
+
+
+class UploadJob(models.Model):
+    """Upload spooled to local disk and sent to Drive in the background by core.upload_queue."""
+    QUEUED = "queued"
+    UPLOADING = "uploading"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (UPLOADING, "Uploading"), (DONE, "Done"), (FAILED, "Failed")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="upload_jobs")
+    name = models.CharField(max_length=1024)
+    mime_type = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    md5_checksum = models.CharField(max_length=32, blank=True, default="")
+    dedup = models.BooleanField(default=True)
+    spool_path = models.TextField()
+    # Host whose disk holds the spooled file; only it can send or recover the job
+    host = models.CharField(max_length=255, blank=True, default="")
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    bytes_sent = models.BigIntegerField(default=0)
+    file_id = models.CharField(max_length=128, blank=True, default="")
+    deduplicated = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["host", "status"]),
+            models.Index(fields=["user", "status"]),
+        ]
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def __str__(self):
+        return f"Upload job for {self.name} ({self.status})"
+
+
+class ChatMessage(models.Model):
+    """Message sent to a chat room, stored as the JSON frame room members received."""
+    room = models.CharField(max_length=255)
+    body = models.TextField()
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["room", "timestamp"]),
+        ]
+
+    def __str__(self):
+        return f"Message in {self.room} at {self.timestamp}"
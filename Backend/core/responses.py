@@ -0,0 +1,142 @@
+import hashlib
+import zlib
+import brotli
+import orjson
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+def json_response(data, status=200):
+    """JsonResponse equivalent encoded with orjson, several times faster on large listings."""
+    return HttpResponse(orjson.dumps(data), content_type="application/json", status=status)
+
+
+def dumps(data):
+    return orjson.dumps(data).decode()
+
+
+def listing_etag(*parts):
+    """Weak ETag for a listing, derived from its version and the request's paging."""
+    digest = hashlib.blake2b("\x1f".join(str(part) for part in parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return opaque in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def not_modified(request, etag):
+    """Return a 304 when the client already has this ETag, else None."""
+    if not etag_matches(request.headers.get("If-None-Match"), etag):
+        return None
+    response = HttpResponseNotModified()
+    response["ETag"] = etag
+    return response
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick br or gzip from an Accept-Encoding header, honouring q=0."""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip().lower()] = q
+    for coding in ("br", "gzip"):
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+class StreamCompressor:
+    """Incremental br/gzip compressor, flushed per chunk so streams stay live."""
+
+    def __init__(self, coding):
+        self.coding = coding
+        if coding == "br":
+            self.compressor = brotli.Compressor(quality=settings.RESPONSE_BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(settings.RESPONSE_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        if self.coding == "br":
+            return self.compressor.process(data) + (self.compressor.flush() if flush else b"")
+        return self.compressor.compress(data) + (self.compressor.flush(zlib.Z_SYNC_FLUSH) if flush else b"")
+
+    def finish(self):
+        if self.coding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush(zlib.Z_FINISH)
+
+    def compress_sequence(self, chunks):
+        for chunk in chunks:
+            if chunk:
+                yield self.compress(chunk, flush=True)
+        yield self.finish()
+
+    async def acompress_sequence(self, chunks):
+        async for chunk in chunks:
+            if chunk:
+                yield self.compress(chunk, flush=True)
+        yield self.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress JSON and NDJSON API responses with brotli or gzip.
+
+    Like GZipMiddleware, but prefers brotli when the client accepts it and
+    flushes streamed responses chunk by chunk so clients still see listings
+    and bulk results as they are produced. File downloads (whatever their
+    type), ranged responses and bodies under RESPONSE_COMPRESSION_MIN_BYTES
+    are left as is, so downloads keep their length, ranges and strong ETag.
+    """
+
+    def process_response(self, request, response):
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        if response.has_header("Content-Encoding") or response.has_header("Content-Range"):
+            return response
+        if response.has_header("Content-Disposition") or request.path.endswith("/content/"):
+            return response
+        if not response.get("Content-Type", "").startswith(COMPRESSIBLE_TYPES):
+            return response
+        coding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+        if not coding:
+            return response
+
+        compressor = StreamCompressor(coding)
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = compressor.acompress_sequence(response.streaming_content)
+            else:
+                response.streaming_content = compressor.compress_sequence(response.streaming_content)
+            del response["Content-Length"]
+        else:
+            if len(response.content) < settings.RESPONSE_COMPRESSION_MIN_BYTES:
+                return response
+            compressed = compressor.compress(response.content) + compressor.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        response["Content-Encoding"] = coding
+        etag = response.get("ETag")
+        if etag and not etag.startswith("W/"):
+            response["ETag"] = "W/" + etag
+        return response
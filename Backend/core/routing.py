@@ -1,6 +1,8 @@
 from django.urls import re_path
-from .consumers import ChatConsumer
+from .consumers import ChatConsumer, DriveChangesConsumer, UploadJobConsumer
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<room_name>\w+)/$', ChatConsumer.as_asgi()),
+    re_path(r'ws/drive/uploads/$', UploadJobConsumer.as_asgi()),
+    re_path(r'ws/drive/changes/$', DriveChangesConsumer.as_asgi()),
 ]
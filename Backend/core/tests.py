@@ -0,0 +1,908 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils.timezone import now
+from googleapiclient.errors import HttpError
+from core.models import ChatMessage, DriveFile, UploadJob, UploadSession, UserToken
+from core.chat_history import ChatHistoryWriter, history_page, room_group
+from core.credentials import aget_credentials, credential_cache, get_credentials
+from core.drive_bulk import execute_with_retries, run_chunk
+from core.drive_content import ContentCache, parse_range
+from core.drive_changes import ChangeWatcher
+from core.drive_scheduler import DriveScheduler, QuotaExceeded, user_key
+from core.drive_search import SORTS, parse_search_params, search_index
+from core.google_http import GoogleAPIError, close_async_client, exchange_code, get_async_client
+from core.responses import CompressionMiddleware
+from core.routing import websocket_urlpatterns
+from core.token_refresh import due_tokens
+from core.upload_queue import QueueFull, UploadQueue, enqueue_upload
+from core.views import ASYNC_REDIRECT_URI, REDIRECT_URI
+
+
+class CredentialRefreshTests(TransactionTestCase):
+    """Concurrent lookups of an expired token share a single refresh."""
+
+    email = "refresh@example.com"
+
+    def setUp(self):
+        user = User.objects.create(username=self.email)
+        UserToken.objects.create(
+            user=user, access_token="old", refresh_token="refresh", expires_at=now() - timedelta(minutes=1)
+        )
+        credential_cache.clear()
+        self.refreshes = []
+
+        def refresh(credentials, request):
+            self.refreshes.append(credentials.token)
+            time.sleep(0.05)
+            credentials.token = "new"
+            credentials.expiry = (now() + timedelta(hours=1)).replace(tzinfo=None)
+
+        patcher = mock.patch("google.oauth2.credentials.Credentials.refresh", refresh)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_concurrent_lookups_refresh_once(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            entries = list(pool.map(lambda _: get_credentials(self.email), range(8)))
+
+        self.assertEqual(len(self.refreshes), 1)
+        self.assertEqual({entry.credentials.token for entry in entries}, {"new"})
+        self.assertEqual(UserToken.objects.get().access_token, "new")
+
+    def test_sync_and_async_lookups_share_the_refresh(self):
+        async def async_lookups():
+            return await asyncio.gather(*(aget_credentials(self.email) for _ in range(4)))
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            sync_entries = [pool.submit(get_credentials, self.email) for _ in range(4)]
+            async_entries = asyncio.run(async_lookups())
+            entries = [future.result() for future in sync_entries] + list(async_entries)
+
+        self.assertEqual(len(self.refreshes), 1)
+        self.assertEqual({entry.credentials.token for entry in entries}, {"new"})
+
+    def test_row_written_elsewhere_replaces_cached_entry(self):
+        self.assertEqual(get_credentials(self.email).credentials.token, "new")
+        # Re-authentication in another process, which a per-process cache never hears about
+        UserToken.objects.update(access_token="reauthorized", expires_at=now() + timedelta(hours=2))
+
+        self.assertEqual(get_credentials(self.email).credentials.token, "reauthorized")
+        UserToken.objects.all().delete()
+        self.assertIsNone(get_credentials(self.email))
+
+    def test_row_refreshed_meanwhile_wins(self):
+        def refresh_elsewhere(credentials, request):
+            # Another process refreshes the same row while our call to Google is in flight
+            UserToken.objects.update(access_token="other", expires_at=now() + timedelta(hours=2))
+            credentials.token = "new"
+            credentials.expiry = (now() + timedelta(hours=1)).replace(tzinfo=None)
+
+        with mock.patch("google.oauth2.credentials.Credentials.refresh", refresh_elsewhere):
+            entry = get_credentials(self.email)
+
+        self.assertEqual(entry.credentials.token, "other")
+        self.assertEqual(UserToken.objects.get().access_token, "other")
+
+    def test_unknown_user(self):
+        self.assertIsNone(get_credentials("nobody@example.com"))
+        self.assertIsNone(asyncio.run(aget_credentials("nobody@example.com")))
+
+
+class OAuthFlowTests(SimpleTestCase):
+    config = {"web": {
+        "client_id": "config-id", "client_secret": "config-secret",
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth", "token_uri": "https://oauth2.googleapis.com/token",
+    }}
+
+    def auth_url(self, query=""):
+        with mock.patch("core.views.get_client_config", return_value=self.config):
+            response = self.client.get("/api/auth/google/" + query)
+        return parse_qs(urlsplit(response.json()["auth_url"]).query)
+
+    def test_async_callback_is_chosen_by_query(self):
+        self.assertEqual(self.auth_url()["redirect_uri"], [REDIRECT_URI])
+        self.assertEqual(self.auth_url("?callback=async")["redirect_uri"], [ASYNC_REDIRECT_URI])
+
+    def test_code_exchange_uses_client_config(self):
+        response = mock.Mock(status_code=200, json=lambda: {"access_token": "a"})
+        client = mock.Mock(post=mock.AsyncMock(return_value=response))
+        with mock.patch("core.google_http.get_client_config", return_value=self.config), \
+                mock.patch("core.google_http.get_async_client", return_value=client):
+            asyncio.run(exchange_code("code", ASYNC_REDIRECT_URI))
+        data = client.post.call_args.kwargs["data"]
+        self.assertEqual((data["client_id"], data["client_secret"]), ("config-id", "config-secret"))
+        self.assertEqual(data["redirect_uri"], ASYNC_REDIRECT_URI)
+
+
+class AsyncClientTests(SimpleTestCase):
+    async def clients(self):
+        client = get_async_client()
+        self.assertIs(get_async_client(), client)
+        await close_async_client()
+        self.assertTrue(client.is_closed)
+        return client
+
+    def test_one_client_per_loop(self):
+        self.assertIsNot(asyncio.run(self.clients()), asyncio.run(self.clients()))
+
+
+class SchedulerTests(SimpleTestCase):
+    """A full bucket refuses calls rather than queueing them past the maximum wait."""
+
+    def test_overflow_raises_quota_exceeded(self):
+        scheduler = DriveScheduler(0, 0, user_rate=1, user_burst=1, max_wait=0.5)
+        self.assertAlmostEqual(scheduler.reserve("a"), 0, places=2)
+        with self.assertRaises(QuotaExceeded) as raised:
+            scheduler.reserve("a")
+        self.assertAlmostEqual(raised.exception.retry_after, 1, delta=0.1)
+        # The refused call gave its token back, and other users are unaffected
+        self.assertAlmostEqual(scheduler.reserve("b"), 0, places=2)
+        self.assertRaises(QuotaExceeded, scheduler.reserve, "a")
+
+    def test_session_calls_are_keyed_by_session(self):
+        uri = "https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&upload_id=xyz"
+        self.assertEqual(user_key({}, uri), "upload:xyz")
+        self.assertEqual(user_key({"Authorization": "Bearer t"}, uri), "Bearer t")
+        self.assertEqual(user_key({}, "https://www.googleapis.com/drive/v3/files"), "")
+
+
+class ChangeWatcherTests(SimpleTestCase):
+    """Only a disconnected account fails the watcher; passing faults are retried.
+
+    New files are reported as added once, and only remembered while that can matter.
+    """
+
+    def start(self, *outcomes):
+        async def run():
+            watcher = ChangeWatcher("changes@example.com")
+            watcher.channels.add("channel")
+            await watcher.start()
+            return watcher
+
+        cached = mock.Mock()
+        with mock.patch("core.drive_changes.aget_credentials", mock.AsyncMock(return_value=cached)), \
+                mock.patch("core.drive_changes.google_http.get_start_page_token", side_effect=outcomes), \
+                mock.patch("core.drive_changes.backoff_delay", return_value=0):
+            return asyncio.run(run())
+
+    def test_transient_errors_are_retried(self):
+        watcher = self.start(GoogleAPIError(503, "backendError"), GoogleAPIError(429, "rateLimitExceeded"), "42")
+        self.assertFalse(watcher.failed)
+        self.assertEqual(watcher.page_token, "42")
+        self.assertTrue(watcher.ready.is_set())
+
+    def test_auth_errors_fail(self):
+        watcher = self.start(GoogleAPIError(401, "authError"), "42")
+        self.assertTrue(watcher.failed)
+        self.assertIsNone(watcher.page_token)
+
+    def test_added_ids_only_cover_the_poll_window(self):
+        started = now()
+        changes = [
+            {"changes": [{"fileId": "new", "file": {"id": "new", "createdTime": started.isoformat()}}],
+             "newStartPageToken": "2"},
+            {"changes": [{"fileId": "new", "file": {"id": "new", "createdTime": started.isoformat()}}],
+             "newStartPageToken": "3"},
+            {"changes": [], "newStartPageToken": "3"},
+        ]
+
+        async def run():
+            watcher = ChangeWatcher("changes@example.com")
+            watcher.page_token, watcher.polled_at = "1", started - timedelta(minutes=1)
+            watcher.broadcast = mock.AsyncMock()
+            await watcher.poll()
+            added = set(watcher.added_ids)
+            # Seen again: reported as modified, not added twice
+            await watcher.poll()
+            second = json.loads(watcher.broadcast.call_args.args[0]["text"])
+            # Once the window has moved past the file's creation, it is forgotten
+            watcher.polled_at = started + timedelta(minutes=1)
+            await watcher.poll()
+            return added, second, watcher.added_ids
+
+        with mock.patch("core.drive_changes.aget_credentials", mock.AsyncMock(return_value=mock.Mock())), \
+                mock.patch("core.drive_changes.google_http.list_changes", mock.AsyncMock(side_effect=changes)):
+            added, second, remaining = asyncio.run(run())
+
+        self.assertEqual(added, {"new"})
+        self.assertEqual(([f["id"] for f in second["added"]], [f["id"] for f in second["modified"]]), ([], ["new"]))
+        self.assertEqual(remaining, {})
+
+
+class RateLimitedViewTests(TestCase):
+    email = "limited@example.com"
+
+    def setUp(self):
+        user = User.objects.create(username=self.email)
+        UserToken.objects.create(
+            user=user, access_token="token", refresh_token="refresh", expires_at=now() + timedelta(hours=1)
+        )
+        credential_cache.clear()
+
+    def test_session_start_over_quota_is_429(self):
+        with mock.patch("core.views.start_drive_session", side_effect=QuotaExceeded(2.5)):
+            response = self.client.post(
+                "/api/drive/upload/sessions/", {"name": "a.bin", "size": 10},
+                content_type="application/json", headers={"User-Email": self.email}
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "3")
+
+
+class UploadQueueRecoveryTests(TestCase):
+    """Starting a queue takes over what a stopped process left on this host."""
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+        override = override_settings(DRIVE_UPLOAD_SPOOL_DIR=self.spool_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create(username="queue@example.com")
+        self.queue = UploadQueue(workers=1, max_pending=1, stale_after=60, host="here")
+        self.queue._executor = mock.Mock()
+
+    def job(self, status, spooled=True, minutes_ago=0, host="here"):
+        job = UploadJob(
+            user=self.user, name="a.bin", mime_type="application/octet-stream", size=1, status=status, host=host
+        )
+        job.spool_path = os.path.join(self.spool_dir, str(job.id))
+        if spooled:
+            with open(job.spool_path, "wb") as f:
+                f.write(b"x")
+        job.save()
+        UploadJob.objects.filter(id=job.id).update(updated_at=now() - timedelta(minutes=minutes_ago))
+        return job
+
+    def status(self, job):
+        return UploadJob.objects.get(id=job.id).status
+
+    def test_recover(self):
+        queued = self.job(UploadJob.QUEUED)
+        interrupted = self.job(UploadJob.UPLOADING, minutes_ago=5)
+        lost = self.job(UploadJob.UPLOADING, spooled=False, minutes_ago=5)
+        running = self.job(UploadJob.UPLOADING)
+        queued_lost = self.job(UploadJob.QUEUED, spooled=False)
+        # Spooled on another host's disk: not ours to resume or fail
+        elsewhere = self.job(UploadJob.UPLOADING, spooled=False, minutes_ago=5, host="there")
+        elsewhere_queued = self.job(UploadJob.QUEUED, spooled=False, host="there")
+        orphan = os.path.join(self.spool_dir, "orphan")
+        open(orphan, "wb").close()
+        os.utime(orphan, (0, 0))
+
+        self.queue.recover()
+
+        self.assertEqual(self.status(interrupted), UploadJob.QUEUED)
+        self.assertEqual(self.status(lost), UploadJob.FAILED)
+        self.assertEqual(self.status(running), UploadJob.UPLOADING)
+        self.assertEqual(self.status(queued_lost), UploadJob.FAILED)
+        self.assertEqual(self.status(elsewhere), UploadJob.UPLOADING)
+        self.assertEqual(self.status(elsewhere_queued), UploadJob.QUEUED)
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(running.spool_path))
+        # Only max_pending jobs go to the pool; the rest wait for room
+        self.assertEqual(self.queue.pending, 1)
+        self.queue._executor.submit.assert_called_once()
+        self.assertEqual(len(self.queue._backlog), 1)
+        self.assertEqual({queued.id, interrupted.id}, {self.queue._executor.submit.call_args[0][1], *self.queue._backlog})
+
+
+class UploadQueueCapacityTests(TestCase):
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+        override = override_settings(DRIVE_UPLOAD_SPOOL_DIR=self.spool_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create(username="full@example.com")
+        self.queue = UploadQueue(workers=1, max_pending=1, stale_after=60, host="here")
+        self.queue._executor = mock.Mock()
+        patchers = [mock.patch("core.upload_queue.upload_queue", self.queue), mock.patch.object(self.queue, "start")]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def enqueue(self):
+        return enqueue_upload(self.user, SimpleUploadedFile("a.bin", b"x"), "md5", 1)
+
+    def test_full_queue_spools_and_saves_nothing(self):
+        job = self.enqueue()
+
+        with self.assertRaises(QueueFull):
+            self.enqueue()
+        self.assertEqual(list(UploadJob.objects.values_list("id", flat=True)), [job.id])
+        self.assertEqual(os.listdir(self.spool_dir), [str(job.id)])
+        self.assertEqual(self.queue.pending, 1)
+
+    def test_failed_save_gives_its_place_back(self):
+        with mock.patch("core.upload_queue.UploadJob.save", side_effect=RuntimeError("database is locked")):
+            with self.assertRaises(RuntimeError):
+                self.enqueue()
+        self.assertEqual(self.queue.pending, 0)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+
+class DedupUploadTests(TestCase):
+    """Uploads matching a file already on the user's Drive are answered from it."""
+
+    email = "dedup@example.com"
+    content = b"same bytes"
+    md5 = hashlib.md5(content).hexdigest()
+
+    def setUp(self):
+        self.user = User.objects.create(username=self.email)
+        UserToken.objects.create(
+            user=self.user, access_token="token", refresh_token="refresh", expires_at=now() + timedelta(hours=1)
+        )
+        DriveFile.objects.create(
+            user=self.user, file_id="existing", name="a.txt", mime_type="text/plain", md5_checksum=self.md5,
+            size=len(self.content)
+        )
+        credential_cache.clear()
+        self.service = mock.Mock()
+        patcher = mock.patch("core.views.get_drive_service", return_value=self.service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def drive_file(self, file_id, name, **extra):
+        return dict(id=file_id, name=name, mimeType="text/plain", md5Checksum=self.md5,
+                    size=str(len(self.content)), **extra)
+
+    def upload(self, name, query=""):
+        uploaded = self.drive_file("uploaded", name)
+        with mock.patch("core.views.upload_file_to_drive", return_value=uploaded) as upload:
+            response = self.client.post(
+                "/api/drive/upload/" + query, {"file": SimpleUploadedFile(name, self.content)},
+                headers={"User-Email": self.email}
+            )
+        return response.json(), upload.called
+
+    def test_same_name_returns_existing_file(self):
+        self.service.files().get().execute.return_value = self.drive_file("existing", "a.txt")
+        body, uploaded = self.upload("a.txt")
+
+        self.assertEqual(body, {"file_id": "existing", "deduplicated": True, "bytes_saved": len(self.content)})
+        self.assertFalse(uploaded)
+        self.service.files().copy.assert_not_called()
+
+    def test_other_name_copies_existing_file(self):
+        self.service.files().copy().execute.return_value = self.drive_file("copy", "b.txt")
+        body, uploaded = self.upload("b.txt")
+
+        self.assertEqual((body["file_id"], body["deduplicated"]), ("copy", True))
+        self.assertFalse(uploaded)
+        self.assertEqual(self.service.files().copy.call_args.kwargs["body"], {"name": "b.txt"})
+        self.assertTrue(DriveFile.objects.filter(user=self.user, file_id="copy").exists())
+
+    def test_missing_duplicate_is_dropped_and_uploaded(self):
+        import httplib2
+
+        self.service.files().get().execute.side_effect = HttpError(httplib2.Response({"status": 404}), b"")
+        body, uploaded = self.upload("a.txt")
+
+        self.assertEqual((body["file_id"], body["deduplicated"]), ("uploaded", False))
+        self.assertTrue(uploaded)
+        self.assertFalse(DriveFile.objects.filter(file_id="existing").exists())
+
+    def test_trashed_duplicate_is_dropped_and_uploaded(self):
+        self.service.files().get().execute.return_value = self.drive_file("existing", "a.txt", trashed=True)
+        body, uploaded = self.upload("a.txt")
+
+        self.assertEqual((body["file_id"], body["deduplicated"]), ("uploaded", False))
+        self.assertTrue(uploaded)
+        self.assertFalse(DriveFile.objects.filter(file_id="existing").exists())
+
+    def test_dedup_false_always_uploads(self):
+        body, uploaded = self.upload("a.txt", "?dedup=false")
+
+        self.assertEqual(body, {"file_id": "uploaded", "deduplicated": False, "bytes_saved": 0})
+        self.assertTrue(uploaded)
+        self.service.files.assert_not_called()
+
+
+class UploadSessionTests(TestCase):
+    email = "sessions@example.com"
+    content = b"0123456789"
+
+    def setUp(self):
+        user = User.objects.create(username=self.email)
+        self.session = UploadSession.objects.create(
+            user=user, name="a.bin", mime_type="application/octet-stream", size=len(self.content),
+            drive_session_uri="https://upload.example/session", committed=4
+        )
+        self.url = f"/api/drive/upload/sessions/{self.session.id}/"
+        self.sent = []
+        self.drive_responses = []
+        patcher = mock.patch("core.upload_sessions.get_session", return_value=mock.Mock(put=self.drive_put))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def drive_put(self, uri, data=None, headers=None, timeout=None):
+        self.sent.append((headers["Content-Range"], data.read() if data is not None else None))
+        return self.drive_responses.pop(0)
+
+    def committed(self, offset):
+        return mock.Mock(status_code=308, headers={"Range": f"bytes=0-{offset - 1}"})
+
+    def put(self, start, end, **extra):
+        return self.client.put(
+            self.url, self.content[start:end + 1], content_type="application/octet-stream",
+            headers={"User-Email": self.email, "Content-Range": f"bytes {start}-{end}/{len(self.content)}"}, **extra
+        )
+
+    def test_resent_range_skips_committed_bytes(self):
+        self.drive_responses.append(mock.Mock(status_code=200, json=lambda: {"id": "file"}))
+        response = self.put(0, 9)
+
+        self.assertEqual(self.sent, [("bytes 4-9/10", self.content[4:])])
+        self.assertEqual((response.json()["committed"], response.json()["file_id"]), (10, "file"))
+
+    def test_range_past_committed_offset_is_416(self):
+        self.drive_responses.append(self.committed(4))
+        response = self.put(6, 9)
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.json()["committed"], 4)
+        # Only Drive's offset was queried; nothing was relayed
+        self.assertEqual(self.sent, [("bytes */10", None)])
+
+    def test_malformed_content_length_is_400(self):
+        response = self.put(4, 9, CONTENT_LENGTH="six")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.sent, [])
+
+    def test_finalizing_incomplete_upload_is_409(self):
+        self.drive_responses.append(self.committed(8))
+        response = self.client.post(self.url + "finalize/", headers={"User-Email": self.email})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()["committed"], 8)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.committed, 8)
+
+
+class ListingResponseTests(TransactionTestCase):
+    """Drive listings are conditional on the feed position and compressed per Accept-Encoding."""
+
+    email = "listing@example.com"
+    files = [{"id": f"file-{i}", "name": f"report {i}.pdf", "mimeType": "application/pdf"} for i in range(200)]
+
+    def setUp(self):
+        user = User.objects.create(username=self.email)
+        UserToken.objects.create(
+            user=user, access_token="token", refresh_token="refresh", expires_at=now() + timedelta(hours=1)
+        )
+        credential_cache.clear()
+        cache.clear()
+        self.positions = ["1"]
+        patchers = [
+            mock.patch("core.google_http.get_start_page_token", mock.AsyncMock(side_effect=lambda _: self.positions[0])),
+            mock.patch("core.google_http.list_files", mock.AsyncMock(return_value={"files": self.files})),
+        ]
+        self.list_files = patchers[1].start()
+        patchers[0].start()
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def get(self, **headers):
+        return self.client.get("/api/drive/files/", headers={"User-Email": self.email, **headers})
+
+    def test_matching_weak_etag_is_304(self):
+        etag = self.get()["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(self.list_files.await_count, 1)
+
+    def test_changed_feed_position_is_200(self):
+        etag = self.get()["ETag"]
+        self.positions[0] = "2"
+
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_encoding_follows_accept_encoding(self):
+        for accept, coding in (("gzip, br", "br"), ("gzip", "gzip"), ("br;q=0, gzip", "gzip"), ("identity", None)):
+            with self.subTest(accept=accept):
+                response = self.get(accept_encoding=accept)
+                self.assertEqual(response.get("Content-Encoding"), coding)
+                self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_downloads_are_not_compressed(self):
+        factory = RequestFactory(headers={"Accept-Encoding": "br, gzip"})
+        body = b'{"files": []}' * 1000
+
+        def respond(headers=None):
+            return lambda request: HttpResponse(body, content_type="application/json", headers=headers)
+
+        attachment = CompressionMiddleware(respond({"Content-Disposition": 'attachment; filename="a.json"'}))
+        self.assertFalse(attachment(factory.get("/api/drive/index/")).has_header("Content-Encoding"))
+        content = CompressionMiddleware(respond())
+        self.assertFalse(content(factory.get("/api/drive/files/abc/content/")).has_header("Content-Encoding"))
+        self.assertEqual(content(factory.get("/api/drive/index/"))["Content-Encoding"], "br")
+
+
+class TokenSweepTests(TestCase):
+    """refresh_tokens refreshes what is due, in bulk, and backs off tokens that fail."""
+
+    def setUp(self):
+        cache.clear()
+        credential_cache.clear()
+        current = now()
+        self.tokens = {
+            name: UserToken.objects.create(
+                user=User.objects.create(username=f"{name}@example.com"), access_token="old",
+                refresh_token=refresh_token, expires_at=current + expires_in
+            )
+            for name, refresh_token, expires_in in (
+                ("soon", "soon", timedelta(minutes=5)),
+                ("sooner", "sooner", timedelta(minutes=1)),
+                ("revoked", "revoked", timedelta(minutes=2)),
+                ("later", "later", timedelta(hours=2)),
+                ("idle", "idle", -timedelta(hours=2)),
+                ("no_grant", "", timedelta(minutes=1)),
+            )
+        }
+        self.refreshed = []
+
+        def refresh(refresh_token):
+            self.refreshed.append(refresh_token)
+            if refresh_token == "revoked":
+                raise GoogleAPIError(400, "invalid_grant")
+            return f"new-{refresh_token}", now() + timedelta(hours=1)
+
+        patcher = mock.patch("core.token_refresh.refresh_access_token", side_effect=refresh)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def refresh_tokens(self):
+        out = io.StringIO()
+        with mock.patch.object(UserToken.objects, "bulk_update", wraps=UserToken.objects.bulk_update) as bulk_update:
+            call_command("refresh_tokens", horizon=600, batch_size=2, stdout=out)
+        return out.getvalue(), bulk_update
+
+    def test_due_tokens_window(self):
+        self.assertEqual([t.refresh_token for t in due_tokens(600)], ["sooner", "revoked", "soon"])
+
+    def test_sweep_refreshes_due_tokens_and_backs_off_failures(self):
+        out, bulk_update = self.refresh_tokens()
+
+        self.assertTrue(out.startswith("3 due, 2 refreshed, 1 failed, 0 skipped"))
+        self.assertEqual(sorted(self.refreshed), ["revoked", "soon", "sooner"])
+        # One bulk update per batch of two, each carrying only what refreshed
+        self.assertEqual([[t.refresh_token for t in call.args[0]] for call in bulk_update.call_args_list],
+                         [["sooner"], ["soon"]])
+        tokens = {t.refresh_token: t.access_token for t in UserToken.objects.all()}
+        self.assertEqual(tokens, {"soon": "new-soon", "sooner": "new-sooner", "revoked": "old",
+                                  "later": "old", "idle": "old", "": "old"})
+        self.assertIsNotNone(cache.get(f"token-refresh:failed:{self.tokens['revoked'].pk}"))
+
+        self.refreshed.clear()
+        with mock.patch("core.token_refresh.due_tokens", return_value=[self.tokens["revoked"]]):
+            out, _ = self.refresh_tokens()
+        self.assertTrue(out.startswith("1 due, 0 refreshed, 0 failed, 1 skipped"))
+        self.assertEqual(self.refreshed, [])
+
+
+class KeysetPagingTests(TestCase):
+    """Paging through the index visits every match once, in order, whatever the sort."""
+
+    def setUp(self):
+        self.user = User.objects.create(username="paging@example.com")
+        other = User.objects.create(username="other@example.com")
+        created = now().replace(microsecond=0)
+        # Few distinct names and timestamps, and some missing ones, so many rows tie on the sort field
+        for i in range(23):
+            DriveFile.objects.create(
+                user=self.user, file_id=f"f{i}", name=f"file {i % 3}", mime_type="text/plain",
+                created_time=None if i % 5 == 0 else created - timedelta(days=i % 4)
+            )
+        DriveFile.objects.create(user=other, file_id="theirs", name="file 0", mime_type="text/plain")
+
+    def pages(self, sort, page_size):
+        search = parse_search_params({"sort": sort})
+        seen, page_token = [], None
+        while True:
+            files, page_token = search_index(self.user, search, page_size, page_token)
+            seen.extend(f["id"] for f in files)
+            if page_token is None:
+                return seen
+
+    def test_no_duplicates_or_gaps(self):
+        for sort in SORTS:
+            everything = self.pages(sort, 100)
+            self.assertEqual(sorted(everything), sorted(f"f{i}" for i in range(23)))
+            for page_size in (1, 4, 7):
+                with self.subTest(sort=sort, page_size=page_size):
+                    self.assertEqual(self.pages(sort, page_size), everything)
+
+
+class ChatHistoryPagingTests(TestCase):
+    """Paging back through a room visits every message once, newest first."""
+
+    def setUp(self):
+        sent = now().replace(microsecond=0)
+        # Four distinct timestamps, so many messages tie on the sort field
+        for i in range(23):
+            ChatMessage.objects.create(
+                room="lobby", body=f'{{"message": "m{i}"}}', timestamp=sent - timedelta(seconds=i % 4)
+            )
+        ChatMessage.objects.create(room="elsewhere", body='{"message": "theirs"}', timestamp=sent)
+
+    def pages(self, page_size):
+        seen, page_token = [], None
+        while True:
+            messages, page_token = history_page("lobby", page_size, page_token)
+            seen.extend(m["id"] for m in messages)
+            if page_token is None:
+                return seen
+
+    def test_no_duplicates_or_gaps(self):
+        newest_first = list(
+            ChatMessage.objects.filter(room="lobby").order_by("-timestamp", "-pk").values_list("pk", flat=True)
+        )
+        self.assertEqual(self.pages(100), newest_first)
+        for page_size in (1, 4, 7, 23):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.pages(page_size), newest_first)
+
+
+@override_settings(CHAT_SEND_BUFFER_BYTES=100, CHAT_HISTORY_REPLAY=0)
+class ChatSendBudgetTests(SimpleTestCase):
+    text = json.dumps({"message": "x" * 30})
+
+    async def exchange(self, ack):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/chat/budget/")
+        await communicator.connect()
+        layer = get_channel_layer()
+        frames = []
+        for _ in range(3):
+            await layer.group_send(room_group("budget"), {"type": "chat_message", "texts": [self.text]})
+            output = await communicator.receive_output()
+            frames.append(output.get("code", output["type"]))
+            if ack:
+                await communicator.send_json_to({"ack": True})
+                await communicator.receive_nothing(timeout=0.01)
+        await communicator.disconnect()
+        return frames
+
+    def test_client_over_budget_is_closed(self):
+        self.assertEqual(asyncio.run(self.exchange(ack=False)), ["websocket.send", "websocket.send", 1013])
+
+    def test_acks_reset_the_budget(self):
+        self.assertEqual(asyncio.run(self.exchange(ack=True)), ["websocket.send"] * 3)
+
+
+class ChatHistoryWriterTests(SimpleTestCase):
+    """Buffered messages are written once enough are waiting or the oldest has waited long enough."""
+
+    def writer(self, flush_size, flush_interval):
+        writer = ChatHistoryWriter(flush_size, flush_interval, max_pending=100)
+        self.batches = []
+        self.written = threading.Event()
+
+        def write(batch):
+            self.batches.append([message.body for message in batch])
+            self.written.set()
+
+        writer.write = write
+        return writer
+
+    def test_flush_on_size(self):
+        writer = self.writer(flush_size=3, flush_interval=60)
+        for body in ("a", "b", "c"):
+            writer.record("lobby", body, now())
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(self.batches, [["a", "b", "c"]])
+        self.assertEqual(writer.pending, [])
+
+    def test_flush_on_interval(self):
+        writer = self.writer(flush_size=100, flush_interval=0.2)
+        started = time.monotonic()
+        writer.record("lobby", "a", now())
+        writer.record("lobby", "b", now())
+        self.assertTrue(self.written.wait(5))
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+        self.assertEqual(self.batches, [["a", "b"]])
+
+
+class RangeTests(SimpleTestCase):
+    """Range headers are parsed as RFC 9110 asks for a single byte range."""
+
+    def test_ranges(self):
+        cases = {
+            "bytes=0-99": (0, 99),
+            "bytes=10-": (10, 999),
+            "bytes=990-5000": (990, 999),
+            "bytes=-100": (900, 999),
+            "bytes=-5000": (0, 999),
+        }
+        for header, expected in cases.items():
+            with self.subTest(header=header):
+                self.assertEqual(parse_range(header, 1000), expected)
+
+    def test_ignored(self):
+        for header in (None, "", "bytes=-", "bytes=0-1,5-9", "items=0-1", "bytes=a-b"):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+    def test_unsatisfiable(self):
+        for header, size in (("bytes=1000-", 1000), ("bytes=5-2", 1000), ("bytes=-0", 1000), ("bytes=0-", 0),
+                             ("bytes=-10", 0)):
+            with self.subTest(header=header, size=size):
+                self.assertRaises(ValueError, parse_range, header, size)
+
+
+class ContentCacheTests(SimpleTestCase):
+    """The cache stays under its size bound by dropping the least recently used entries."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.cache = ContentCache(self.directory, max_bytes=25, max_file_bytes=20, temp_max_age=60)
+
+    def put(self, file_id, tag, size, used):
+        with self.cache.create_temp() as temp:
+            temp.write(b"x" * size)
+        self.cache.commit(temp.name, file_id, tag)
+        os.utime(self.cache.path(file_id, tag), (used, used))
+
+    def cached(self, file_id, tag):
+        cached_file = self.cache.open(file_id, tag)
+        if cached_file is None:
+            return False
+        cached_file.close()
+        return True
+
+    def test_evicts_least_recently_used(self):
+        self.put("a", "1", 10, used=100)
+        self.put("b", "1", 10, used=200)
+        # A hit refreshes an entry's recency
+        self.assertTrue(self.cached("a", "1"))
+        self.put("c", "1", 10, used=time.time())
+
+        self.assertTrue(self.cached("a", "1"))
+        self.assertFalse(self.cached("b", "1"))
+        self.assertTrue(self.cached("c", "1"))
+
+    def test_new_version_replaces_old(self):
+        self.put("a", "1", 5, used=100)
+        self.put("a", "2", 5, used=200)
+        self.assertFalse(self.cached("a", "1"))
+        self.assertTrue(self.cached("a", "2"))
+
+    def test_abandoned_temp_files_are_removed(self):
+        with self.cache.create_temp() as temp:
+            temp.write(b"x")
+        os.utime(temp.name, (0, 0))
+        self.cache.clean()
+        self.assertFalse(os.path.exists(temp.name))
+
+    def test_accepts(self):
+        self.assertTrue(self.cache.accepts(20))
+        self.assertFalse(self.cache.accepts(21))
+        self.assertFalse(self.cache.accepts(0))
+
+
+class BulkRetryTests(SimpleTestCase):
+    """Failed calls in a batch are resent on the scheduler's terms, and only those."""
+
+    def service(self, script, round_trips=()):
+        """A Drive service whose batches answer each file id from `script` in turn.
+
+        Each exception in `round_trips` fails a whole batch, in turn, before
+        any is answered. Built requests are recorded in `service.calls`.
+        """
+        import httplib2
+
+        round_trips = list(round_trips)
+        calls = []
+
+        def outcome(file_id):
+            status = script[file_id].pop(0)
+            if status == 200:
+                return {"id": file_id, "parents": [f"parent-{file_id}"]}, None
+            resp = httplib2.Response({"status": status})
+            return None, HttpError(resp, b'{"error": {"errors": []}}', uri=f"https://x/drive/v3/files/{file_id}")
+
+        class Batch:
+            def __init__(self, callback):
+                self.callback, self.requests = callback, []
+
+            def add(self, request, request_id):
+                self.requests.append((request_id, request))
+
+            def execute(self):
+                if round_trips:
+                    raise round_trips.pop(0)
+                for request_id, request in self.requests:
+                    self.callback(request_id, *outcome(request.file_id))
+
+        def request(method):
+            def build(fileId, **kwargs):
+                calls.append((method, fileId, kwargs))
+                uri = f"https://www.googleapis.com/drive/v3/files/{fileId}"
+                return mock.Mock(method=method, uri=uri, file_id=fileId)
+            return build
+
+        service = mock.Mock()
+        service.calls = calls
+        service._http.credentials.apply = lambda headers: headers.update(authorization="Bearer t")
+        service.files.return_value = mock.Mock(get=request("GET"), update=request("PATCH"), delete=request("DELETE"))
+        service.new_batch_http_request = lambda callback: Batch(callback)
+        return service
+
+    @override_settings(DRIVE_RETRY_MAX_ATTEMPTS=3)
+    def test_retries(self):
+        service = self.service({"a": [200], "b": [503, 429, 200], "c": [404], "d": [503] * 10})
+        with mock.patch("core.drive_bulk.time.sleep") as sleep:
+            succeeded, failed = execute_with_retries(service, "get", [{"id": i} for i in "abcd"])
+
+        self.assertEqual(sorted(item["id"] for item, _ in succeeded), ["a", "b"])
+        self.assertEqual({result["id"]: result["code"] for result in failed}, {"c": 404, "d": 503})
+        # One wait per resent batch; d is resent DRIVE_RETRY_MAX_ATTEMPTS times, b along with it
+        self.assertEqual(sleep.call_count, 3)
+
+    def test_unsafe_calls_are_not_resent_after_5xx(self):
+        service = self.service({"a": [503, 200], "b": [429, 200]})
+        items = [{"id": "a", "name": "x"}, {"id": "b", "name": "y"}]
+        with mock.patch("core.drive_bulk.time.sleep"):
+            succeeded, failed = execute_with_retries(service, "rename", items)
+
+        self.assertEqual([item["id"] for item, _ in succeeded], ["b"])
+        self.assertEqual([result["id"] for result in failed], ["a"])
+
+    def test_failed_round_trip_resends_every_call(self):
+        service = self.service({"a": [200], "b": [404]}, round_trips=[OSError("connection reset")])
+        with mock.patch("core.drive_bulk.time.sleep") as sleep:
+            succeeded, failed = execute_with_retries(service, "get", [{"id": "a"}, {"id": "b"}])
+
+        self.assertEqual([item["id"] for item, _ in succeeded], ["a"])
+        self.assertEqual([(result["id"], result["code"]) for result in failed], [("b", 404)])
+        self.assertEqual([file_id for _, file_id, _ in service.calls], ["a", "b", "a", "b"])
+        sleep.assert_called_once()
+
+    def test_only_failed_calls_are_rebatched(self):
+        service = self.service({"a": [200], "b": [429, 200], "c": [403]})
+        with mock.patch("core.drive_bulk.time.sleep"):
+            results = run_chunk(service, "delete", [{"id": i} for i in "abc"])
+
+        self.assertEqual({result["id"]: result["status"] for result in results}, {"a": "ok", "b": "ok", "c": "error"})
+        self.assertEqual([result.get("code") for result in results if result["id"] == "c"], [403])
+        # The second batch carried only b
+        self.assertEqual([file_id for _, file_id, _ in service.calls], ["a", "b", "c", "b"])
+
+    def test_move_replaces_each_files_current_parents(self):
+        service = self.service({"a": [200, 200], "b": [404]})
+        with mock.patch("core.drive_bulk.time.sleep"):
+            results = run_chunk(service, "move", [{"id": "a", "folder_id": "f"}, {"id": "b", "folder_id": "f"}])
+
+        self.assertEqual({result["id"]: result["status"] for result in results}, {"a": "ok", "b": "error"})
+        moves = [(file_id, kwargs) for method, file_id, kwargs in service.calls if method == "PATCH"]
+        self.assertEqual(len(moves), 1)
+        self.assertEqual(moves[0][0], "a")
+        self.assertEqual((moves[0][1]["addParents"], moves[0][1]["removeParents"]), ("f", "parent-a"))
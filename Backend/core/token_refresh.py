@@ -0,0 +1,159 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils.timezone import now
+from core.models import UserToken
+from core.credentials import PROCESS_LOCAL_CACHES, credential_cache
+from core.google_http import refresh_access_token
+from core.metrics import Counter, Histogram
+from Backend.logger import log
+from logging import INFO, WARNING, ERROR
+
+sweep_duration = Histogram(
+    "google_token_sweep_duration_seconds", "Time taken by proactive token refresh sweeps.",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+sweep_refreshes = Counter(
+    "google_token_sweep_refreshes_total", "Access tokens handled by refresh sweeps, by outcome.", ("result",)
+)
+
+SWEEP_LOCK_KEY = "token-refresh:sweep"
+
+
+def _failure_key(token_id):
+    return f"token-refresh:failed:{token_id}"
+
+
+def due_tokens(horizon):
+    """Refreshable tokens expiring within `horizon` seconds, soonest first.
+
+    Tokens that expired more than `horizon` ago belong to users who have gone
+    idle; they are left to refresh on the user's next request. The window is
+    a range scan on the expires_at index.
+    """
+    current = now()
+    window = timedelta(seconds=horizon)
+    return (
+        UserToken.objects.filter(expires_at__gt=current - window, expires_at__lte=current + window)
+        .exclude(refresh_token="")
+        .select_related("user")
+        .order_by("expires_at")
+    )
+
+
+def refresh_token(token):
+    """Refresh one token in memory; returns the error, or None on success."""
+    try:
+        token.access_token, token.expires_at = refresh_access_token(token.refresh_token)
+    except Exception as e:
+        return e
+    return None
+
+
+def save_batch(tokens):
+    """Write refreshed tokens back in one transaction and hand them to this process's credential cache."""
+    with transaction.atomic():
+        UserToken.objects.bulk_update(tokens, ["access_token", "expires_at"])
+    for token in tokens:
+        credential_cache.adopt(token.user.username, token)
+
+
+def sweep(horizon=None, concurrency=None, batch_size=None):
+    """Refresh every token due within the horizon; returns counts by outcome.
+
+    Tokens are refreshed `concurrency` at a time on a bounded pool, and each
+    batch of `batch_size` is written back with a single bulk update. Tokens
+    whose refresh failed are skipped for TOKEN_REFRESH_FAILURE_BACKOFF seconds
+    so a revoked grant is not retried every sweep.
+    """
+    horizon = settings.TOKEN_REFRESH_HORIZON if horizon is None else horizon
+    concurrency = concurrency or settings.TOKEN_REFRESH_CONCURRENCY
+    batch_size = batch_size or settings.TOKEN_REFRESH_BATCH_SIZE
+    started = time.perf_counter()
+    stats = {"due": 0, "ok": 0, "error": 0, "skipped": 0}
+
+    tokens = list(due_tokens(horizon))
+    stats["due"] = len(tokens)
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="token-refresh") as pool:
+        for i in range(0, len(tokens), batch_size):
+            batch = tokens[i:i + batch_size]
+            failed_recently = cache.get_many([_failure_key(t.pk) for t in batch])
+            batch = [t for t in batch if _failure_key(t.pk) not in failed_recently]
+            stats["skipped"] += len(failed_recently)
+
+            refreshed, failed = [], []
+            for token, error in zip(batch, pool.map(refresh_token, batch)):
+                if error is None:
+                    refreshed.append(token)
+                    continue
+                failed.append(token)
+                log(level=ERROR, function="sweep", message=f"Refresh for {token.user.username} failed: {str(error)}")
+            if refreshed:
+                save_batch(refreshed)
+            if failed:
+                cache.set_many({_failure_key(t.pk): 1 for t in failed}, settings.TOKEN_REFRESH_FAILURE_BACKOFF)
+            stats["ok"] += len(refreshed)
+            stats["error"] += len(failed)
+
+    elapsed = time.perf_counter() - started
+    sweep_duration.observe(elapsed)
+    for result in ("ok", "error", "skipped"):
+        if stats[result]:
+            sweep_refreshes.inc(stats[result], result=result)
+    log(
+        level=ERROR if stats["error"] else INFO, function="sweep",
+        message=f"Token sweep: {stats['due']} due, {stats['ok']} refreshed, {stats['error']} failed, "
+                f"{stats['skipped']} skipped in {elapsed:.2f}s"
+    )
+    return stats
+
+
+def run_sweeper(interval):
+    """Sweep every `interval` seconds, forever.
+
+    Processes sharing a cache backend take turns through a lock that lasts
+    just under one interval, so only one of them sweeps each time.
+    """
+    while True:
+        if cache.add(SWEEP_LOCK_KEY, 1, max(interval - 1, 1)):
+            close_old_connections()
+            try:
+                sweep()
+            except Exception as e:
+                log(level=ERROR, function="run_sweeper", message=f"Token sweep failed: {str(e)}")
+            finally:
+                close_old_connections()
+        time.sleep(interval)
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+
+def start_token_sweeper():
+    """Start the in-process sweeper thread once, if TOKEN_REFRESH_INTERVAL enables it.
+
+    The sweep lock needs a cache shared by every process; with a per-process
+    cache each of them would sweep every interval, so the sweeper is not
+    started and `manage.py refresh_tokens` should be run instead.
+    """
+    global _sweeper
+    if settings.TOKEN_REFRESH_INTERVAL <= 0:
+        return
+    if settings.CACHES["default"]["BACKEND"] in PROCESS_LOCAL_CACHES:
+        log(level=WARNING, function="start_token_sweeper",
+            message="TOKEN_REFRESH_INTERVAL needs a shared cache (REDIS_URL); token sweeper not started.")
+        return
+    with _sweeper_lock:
+        if _sweeper is not None:
+            return
+        _sweeper = threading.Thread(
+            target=run_sweeper, args=(settings.TOKEN_REFRESH_INTERVAL,), name="token-refresh-sweeper", daemon=True
+        )
+        _sweeper.start()
+
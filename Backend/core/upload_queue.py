@@ -0,0 +1,322 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import close_old_connections
+from django.utils.timezone import now
+from core.models import UploadJob
+from core.credentials import get_credentials
+from core.dedup import deduplicate_upload
+from core.drive_index import FILE_FIELDS, upsert_files
+from core.drive_service import get_drive_service, upload_file_to_drive
+from core.metrics import CallbackMetric, Counter
+from Backend.logger import log
+from logging import INFO, ERROR
+
+upload_jobs = Counter(
+    "drive_upload_jobs_total", "Queued uploads finished, by outcome.", ("status",)
+)
+
+
+class QueueFull(Exception):
+    """The process already has DRIVE_UPLOAD_QUEUE_MAX_PENDING uploads queued or running."""
+
+
+def job_group(user_id):
+    """Channel layer group receiving a user's upload job updates."""
+    return f"upload_jobs_{user_id}"
+
+
+def upload_job_json(job):
+    return {
+        "job_id": str(job.id),
+        "name": job.name,
+        "size": job.size,
+        "status": job.status,
+        "bytes_sent": job.bytes_sent,
+        "progress": 1.0 if job.status == UploadJob.DONE or not job.size else round(job.bytes_sent / job.size, 4),
+        "file_id": job.file_id or None,
+        "deduplicated": job.deduplicated,
+        "error": job.error or None,
+    }
+
+
+async def _running_loop():
+    return asyncio.get_running_loop()
+
+
+def server_loop():
+    """The ASGI server's event loop when called from a sync view, else None.
+
+    async_to_sync runs on the loop serving the request, so updates published
+    there reach that loop's WebSocket consumers with any channel layer.
+    """
+    loop = async_to_sync(_running_loop)()
+    return loop if loop.is_running() else None
+
+
+def spool_upload(job_id, file_obj):
+    """Move (or copy) an UploadedFile into DRIVE_UPLOAD_SPOOL_DIR and return its path."""
+    os.makedirs(settings.DRIVE_UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(settings.DRIVE_UPLOAD_SPOOL_DIR, str(job_id))
+    if hasattr(file_obj, "temporary_file_path"):
+        try:
+            # Django deletes the temporary file after the request; take it instead
+            os.replace(file_obj.temporary_file_path(), path)
+            return path
+        except OSError:
+            pass
+    with open(path, "wb") as f:
+        for chunk in file_obj.chunks():
+            f.write(chunk)
+    return path
+
+
+def discard_spool(job):
+    try:
+        os.remove(job.spool_path)
+    except FileNotFoundError:
+        pass
+
+
+def upload_job(job, progress):
+    """Send a claimed job's spooled file to Drive, deduplicating against the index first."""
+    cached = get_credentials(job.user.username)
+    if not cached:
+        raise PermissionError("Google account is no longer connected")
+    drive_service = get_drive_service(cached.credentials)
+
+    if job.dedup and job.md5_checksum:
+        existing_file = deduplicate_upload(drive_service, job.user, job.name, job.md5_checksum, job.size)
+        if existing_file:
+            job.file_id, job.deduplicated = existing_file["id"], True
+            return
+
+    with open(job.spool_path, "rb") as f:
+        file_obj = UploadedFile(f, name=job.name, content_type=job.mime_type, size=job.size)
+        uploaded_file = upload_file_to_drive(
+            drive_service, file_obj, fields=FILE_FIELDS, progress=progress, metrics_path="queue"
+        )
+    upsert_files(job.user, [uploaded_file])
+    job.file_id, job.bytes_sent = uploaded_file["id"], job.size
+
+
+class UploadQueue:
+    """Bounded pool of threads sending spooled uploads to Drive.
+
+    Job state lives in the database, so any worker can report it; the
+    spooled bytes live on the disk of the host that received them, which
+    each job records. Jobs a stopped process left queued or uploading are
+    picked up again the next time a process on that host starts its queue.
+    Status changes and progress are published to the user's job_group over
+    the channel layer.
+    """
+
+    def __init__(self, workers, max_pending, stale_after, host):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.stale_after = stale_after
+        self.host = host
+        self.pending = 0
+        self.loop = None
+        self._executor = None
+        self._backlog = deque()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the pool and take over leftover jobs, once per process.
+
+        Called at startup, then again by each queued upload so the server's
+        loop, which only a request can see, is known for publishing.
+        """
+        if self.loop is None:
+            self.loop = server_loop()
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="drive-upload")
+        self.recover()
+
+    def recover(self):
+        """Take over the jobs stopped processes left behind on this host.
+
+        Only jobs recorded against this host are touched, as their spooled
+        files are on this disk. Uploads interrupted mid-way start again from
+        their spooled file; jobs whose file is gone fail. Leftover jobs wait
+        in a backlog and are sent as room frees up under max_pending.
+        """
+        cutoff = now() - timedelta(seconds=self.stale_after)
+        local = UploadJob.objects.filter(host=self.host)
+        stale = local.filter(status=UploadJob.UPLOADING, updated_at__lt=cutoff)
+        for job_id, spool_path in stale.values_list("id", "spool_path"):
+            # Conditional, as another process may be recovering the same job
+            claim = local.filter(id=job_id, status=UploadJob.UPLOADING, updated_at__lt=cutoff)
+            if os.path.exists(spool_path):
+                claim.update(status=UploadJob.QUEUED, bytes_sent=0, updated_at=now())
+            else:
+                self.fail_lost(job_id, status=UploadJob.UPLOADING, updated_at__lt=cutoff)
+
+        leftover = local.filter(status=UploadJob.QUEUED).order_by("created_at")
+        job_ids = []
+        for job_id, spool_path in leftover.values_list("id", "spool_path"):
+            if os.path.exists(spool_path):
+                job_ids.append(job_id)
+            else:
+                self.fail_lost(job_id, status=UploadJob.QUEUED)
+        with self._lock:
+            self._backlog.extend(job_ids)
+        self._drain()
+        self.remove_orphaned_spools(cutoff)
+
+    def fail_lost(self, job_id, **claim):
+        error = "Upload interrupted and its spooled file is gone"
+        # The claim is passed as conditions, not a queryset, so the ERROR log's args stay small
+        claimed = UploadJob.objects.filter(id=job_id, host=self.host, **claim)
+        if claimed.update(status=UploadJob.FAILED, error=error, updated_at=now()):
+            upload_jobs.inc(status=UploadJob.FAILED)
+            log(level=ERROR, function="UploadQueue.recover", message=f"Upload job {job_id} lost its spooled file.")
+
+    def remove_orphaned_spools(self, cutoff):
+        """Delete spooled files whose job finished without removing them (or was never saved)."""
+        try:
+            names = os.listdir(settings.DRIVE_UPLOAD_SPOOL_DIR)
+        except FileNotFoundError:
+            return
+        active = UploadJob.objects.filter(status__in=(UploadJob.QUEUED, UploadJob.UPLOADING))
+        active_ids = {str(job_id) for job_id in active.values_list("id", flat=True)}
+        for name in names:
+            path = os.path.join(settings.DRIVE_UPLOAD_SPOOL_DIR, name)
+            try:
+                # Recent files may belong to a job another process is still saving
+                if name not in active_ids and os.path.getmtime(path) < cutoff.timestamp():
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def reserve(self):
+        """Take a place under max_pending for a new upload, or raise QueueFull."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise QueueFull(f"{self.pending} uploads already queued")
+            self.pending += 1
+
+    def release(self):
+        """Give back a place reserve() took for a job that was never submitted."""
+        with self._lock:
+            self.pending -= 1
+        self._drain()
+
+    def submit(self, job):
+        """Queue a saved job into the place reserve() took, and announce it."""
+        self.publish(job)
+        self._executor.submit(self._run, job.id)
+
+    def _drain(self):
+        """Submit backlogged jobs while there is room under max_pending."""
+        job_ids = []
+        with self._lock:
+            while self._backlog and self.pending < self.max_pending:
+                job_ids.append(self._backlog.popleft())
+                self.pending += 1
+        for job_id in job_ids:
+            self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        close_old_connections()
+        try:
+            self.run_job(job_id)
+        except Exception as e:
+            log(level=ERROR, function="UploadQueue.run_job", message=f"Upload job {job_id}: {str(e)}")
+        finally:
+            close_old_connections()
+            with self._lock:
+                self.pending -= 1
+            self._drain()
+
+    def run_job(self, job_id):
+        # Claiming with a conditional update keeps a job from running twice
+        if not UploadJob.objects.filter(id=job_id, status=UploadJob.QUEUED).update(status=UploadJob.UPLOADING):
+            return
+        job = UploadJob.objects.select_related("user").get(id=job_id)
+        self.publish(job)
+
+        def progress(bytes_sent):
+            job.bytes_sent = bytes_sent
+            job.save(update_fields=["bytes_sent", "updated_at"])
+            self.publish(job)
+
+        try:
+            upload_job(job, progress)
+            job.status = UploadJob.DONE
+            log(level=INFO, function="UploadQueue.run_job", message=f"Upload job {job.id} done: {job.file_id}")
+        except Exception as e:
+            job.status, job.error = UploadJob.FAILED, str(e)
+            log(level=ERROR, function="UploadQueue.run_job", message=f"Upload job {job.id} failed: {str(e)}")
+        job.save(update_fields=["status", "bytes_sent", "file_id", "deduplicated", "error", "updated_at"])
+        discard_spool(job)
+        upload_jobs.inc(status=job.status)
+        self.publish(job)
+
+    def publish(self, job):
+        if self.loop is None or self.loop.is_closed():
+            return
+        from channels.layers import get_channel_layer
+
+        message = {"type": "upload_job", "job": upload_job_json(job)}
+        future = asyncio.run_coroutine_threadsafe(
+            get_channel_layer().group_send(job_group(job.user_id), message), self.loop
+        )
+        future.add_done_callback(_log_publish_error)
+
+
+def _log_publish_error(future):
+    if not future.cancelled() and future.exception() is not None:
+        log(level=ERROR, function="UploadQueue.publish", message=str(future.exception()))
+
+
+upload_queue = UploadQueue(
+    settings.DRIVE_UPLOAD_QUEUE_WORKERS, settings.DRIVE_UPLOAD_QUEUE_MAX_PENDING,
+    settings.DRIVE_UPLOAD_QUEUE_STALE_AFTER, settings.DRIVE_UPLOAD_QUEUE_HOST,
+)
+CallbackMetric("drive_upload_queue_pending", "Queued uploads waiting or running in this process.", "gauge",
+               lambda: upload_queue.pending)
+
+
+def start_upload_queue():
+    """Start the queue at process startup, so leftover jobs are sent without waiting for a new upload."""
+    def start():
+        try:
+            upload_queue.start()
+        except Exception as e:
+            log(level=ERROR, function="start_upload_queue", message=str(e))
+        finally:
+            close_old_connections()
+
+    # A thread, as the recovery queries must not run on the server's event loop
+    threading.Thread(target=start, name="drive-upload-recover", daemon=True).start()
+
+
+def enqueue_upload(user, file_obj, md5, size, dedup=True):
+    """Spool an UploadedFile, record its UploadJob and queue it; returns the job."""
+    # Started first, so picking up leftover jobs cannot also pick up this one
+    upload_queue.start()
+    # Before anything is written, so a full queue costs no spooled copy or row
+    upload_queue.reserve()
+    job = UploadJob(
+        user=user, name=file_obj.name, mime_type=file_obj.content_type or "application/octet-stream",
+        size=size, md5_checksum=md5, dedup=dedup, host=upload_queue.host
+    )
+    try:
+        job.spool_path = spool_upload(job.id, file_obj)
+        job.save()
+    except Exception:
+        upload_queue.release()
+        discard_spool(job)
+        raise
+    upload_queue.submit(job)
+    return job
@@ -0,0 +1,122 @@
+import re
+from django.conf import settings
+from core.google_http import get_session, DRIVE_UPLOAD_URI
+from core.metrics import record_upload
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class UploadSessionError(Exception):
+    """Drive rejected or lost an upload session."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_content_range(header):
+    """Parse "bytes start-end/total" into (start, end, total), or None."""
+    match = CONTENT_RANGE_RE.match(header or "")
+    if not match:
+        return None
+    start, end, total = (int(group) for group in match.groups())
+    if end < start or end >= total:
+        return None
+    return start, end, total
+
+
+def start_drive_session(access_token, name, mime_type, size):
+    """Open a Drive resumable upload session and return its session URI."""
+    response = get_session().post(
+        DRIVE_UPLOAD_URI,
+        params={"uploadType": "resumable", "fields": "id"},
+        json={"name": name},
+        headers={
+            "Authorization": f"Bearer {access_token}",
+            "X-Upload-Content-Type": mime_type,
+            "X-Upload-Content-Length": str(size),
+        },
+        timeout=settings.GOOGLE_HTTP_TIMEOUT,
+    )
+    if response.status_code >= 400 or "Location" not in response.headers:
+        raise UploadSessionError(502, f"Could not start Drive upload session: {response.status_code} {response.text}")
+    return response.headers["Location"]
+
+
+def _apply_drive_response(session, response):
+    """Record what Drive committed, from a 200/201 (done) or 308 (incomplete) response."""
+    if response.status_code in (200, 201):
+        session.committed = session.size
+        session.file_id = response.json()["id"]
+    elif response.status_code == 308:
+        # Range: bytes=0-N lists the committed prefix; absent means nothing yet
+        committed_range = response.headers.get("Range")
+        session.committed = int(committed_range.rsplit("-", 1)[1]) + 1 if committed_range else 0
+    elif response.status_code in (404, 410):
+        raise UploadSessionError(410, "Drive upload session expired")
+    else:
+        raise UploadSessionError(502, f"Drive upload failed: {response.status_code} {response.text}")
+    session.save(update_fields=["committed", "file_id", "updated_at"])
+    return session
+
+
+def query_drive_offset(session):
+    """Ask Drive how many bytes of the session it has committed."""
+    response = get_session().put(
+        session.drive_session_uri,
+        headers={"Content-Range": f"bytes */{session.size}", "Content-Length": "0"},
+        timeout=settings.GOOGLE_HTTP_TIMEOUT,
+    )
+    return _apply_drive_response(session, response)
+
+
+class RangeBody:
+    """File-like view of the next `length` bytes of a request body.
+
+    Giving requests a length lets it send a plain Content-Length body that is
+    read straight from the client connection instead of buffering the range.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def __len__(self):
+        return self.remaining
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+
+def relay_range(session, stream, start, end):
+    """Relay bytes start..end of the session from `stream` into Drive.
+
+    Bytes the session has already committed are skipped, so a client retrying
+    a range after a dropped connection only sends new bytes upstream. Drive
+    may commit less than it was sent (ranges that are not a multiple of
+    256 KiB); the returned session reflects what was actually committed.
+    """
+    if session.committed > start:
+        skip = min(session.committed, end + 1) - start
+        while skip:
+            skipped = len(stream.read(min(skip, 64 * 1024)))
+            if not skipped:
+                break
+            skip -= skipped
+        start = session.committed
+        if start > end:
+            return session
+
+    response = get_session().put(
+        session.drive_session_uri,
+        data=RangeBody(stream, end - start + 1),
+        headers={"Content-Range": f"bytes {start}-{end}/{session.size}"},
+        timeout=settings.GOOGLE_HTTP_TIMEOUT,
+    )
+    session = _apply_drive_response(session, response)
+    record_upload("session", end - start + 1, session.size if session.complete else None)
+    return session
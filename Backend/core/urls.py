@@ -1,5 +1,10 @@
-from django.urls import path
-from .views import google_auth, google_callback, upload_to_drive, list_drive_files, health_check
+from django.urls import path, re_path
+from .views import (
+    google_auth, google_callback, upload_to_drive, batch_upload_to_drive,
+    list_indexed_files, search_files, bulk_drive_operation, upload_job_status, create_upload_session,
+    upload_session, finalize_upload_session, download_drive_file, chat_history, health_check, prometheus_metrics
+)
+from .async_views import async_google_callback, async_upload_to_drive, async_list_drive_files
 
 urlpatterns = [
     # Google OAuth
@@ -8,7 +13,25 @@ urlpatterns = [
 
     # Google Drive Integration
     path('drive/upload/', upload_to_drive, name='drive-upload'),
-    path('drive/files/', list_drive_files, name='drive-files'),
+    path('drive/upload/batch/', batch_upload_to_drive, name='drive-upload-batch'),
+    path('drive/upload/jobs/<uuid:job_id>/', upload_job_status, name='drive-upload-job'),
+    path('drive/upload/sessions/', create_upload_session, name='drive-upload-sessions'),
+    path('drive/upload/sessions/<uuid:session_id>/', upload_session, name='drive-upload-session'),
+    path('drive/upload/sessions/<uuid:session_id>/finalize/', finalize_upload_session,
+         name='drive-upload-session-finalize'),
+    path('drive/files/', async_list_drive_files, name='drive-files'),
+    path('drive/files/<str:file_id>/content/', download_drive_file, name='drive-file-content'),
+    path('drive/index/', list_indexed_files, name='drive-index'),
+    path('drive/search/', search_files, name='drive-search'),
+    path('drive/bulk/', bulk_drive_operation, name='drive-bulk'),
+
+    # Chat (room names as in ws/chat/<room_name>/)
+    re_path(r'^chat/(?P<room_name>\w+)/messages/$', chat_history, name='chat-history'),
+
+    # Async variants (ASGI only)
+    path('async/auth/callback/', async_google_callback, name='async-google-callback'),
+    path('async/drive/upload/', async_upload_to_drive, name='async-drive-upload'),
 
     path('health/', health_check, name='heath-check'),
+    path('metrics/', prometheus_metrics, name='metrics'),
 ]
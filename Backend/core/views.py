@@ -1,80 +1,127 @@
 from django.contrib.auth.models import User
 from django.utils.timezone import make_aware
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.cache import cache
+from django.utils.http import content_disposition_header
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from datetime import datetime, timedelta
-import os
-import requests
-import base64
+import asyncio
+import contextvars
+import hmac
 import json
-from io import BytesIO
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request
+import math
+from concurrent.futures import ThreadPoolExecutor
 from googleapiclient.errors import HttpError
-from core.models import UserToken
+from core.models import UserToken, DriveFile, DriveSyncState, UploadSession, UploadJob
+from core.drive_index import FILE_FIELDS, sync_user_files, as_drive_json, upsert_files
+from core.dedup import hash_uploads, deduplicate_upload
+from core.credentials import SCOPES, get_credentials, aget_credentials, invalidate_credentials
+from core.drive_bulk import OPERATIONS, stream_bulk_results
+from core.drive_search import (
+    INDEX_TOKEN_PREFIX, DRIVE_TOKEN_PREFIX, parse_search_params, search_key, search_index, search_drive, warm_index
+)
+from core.drive_content import (
+    CONTENT_FIELDS, content_cache, content_tag, parse_range, open_media,
+    stream_media, read_range
+)
+from core.drive_scheduler import QuotaExceeded, rate_limit_retry_after
+from core.metrics import METRICS_CONTENT_TYPE, render_metrics
+from core.google_http import USERINFO_URI, GoogleAPIError, get_client_config, get_session
+from core.drive_service import get_drive_service, upload_file_to_drive
+from core.responses import json_response, dumps, listing_etag, etag_matches, not_modified
+from core.upload_sessions import (
+    UploadSessionError, parse_content_range, start_drive_session, query_drive_offset, relay_range
+)
+from core.upload_queue import QueueFull, enqueue_upload, upload_job_json
+from core.chat_history import history_page
 from Backend.logger import log
 from logging import INFO, ERROR
-import art
 
 
 # OAuth Configuration
-GOOGLE_CLIENT_ID = settings.GOOGLE_CLIENT_ID
-GOOGLE_CLIENT_SECRET = settings.GOOGLE_CLIENT_SECRET
 if settings.DEBUG:
     REDIRECT_URI = "http://127.0.0.1:8000/api/auth/callback/"
+    ASYNC_REDIRECT_URI = "http://127.0.0.1:8000/api/async/auth/callback/"
 else:
     REDIRECT_URI = "https://nine0-assignment.onrender.com/api/auth/callback/"
-SCOPES = [
-    "openid",
-    "https://www.googleapis.com/auth/userinfo.email",
-    "https://www.googleapis.com/auth/userinfo.profile",
-    "https://www.googleapis.com/auth/drive.file",
-    "https://www.googleapis.com/auth/drive.readonly"
-]
-
-# Decode client_secret.json from Base64 if using environment variable
-base64_secret = os.getenv("GOOGLE_CLIENT_SECRET_JSON")
-if base64_secret:
-    try:
-        decoded_secret = base64.b64decode(base64_secret).decode("utf-8")
-        with open(os.path.join(settings.BASE_DIR, "client_secret.json"), "w") as f:
-            f.write(decoded_secret)
-    except Exception as e:
-        log(level=ERROR, function="decode_client_secret", message=f"Failed to decode client_secret.json: {str(e)}")
+    ASYNC_REDIRECT_URI = "https://nine0-assignment.onrender.com/api/async/auth/callback/"
+# Drive listing
+LIST_FIELDS = "nextPageToken, files(id, name, mimeType, createdTime)"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
 
 # Helper Functions
-def get_user_tokens(user_email):
-    try:
-        user = User.objects.get(username=user_email)
-        return UserToken.objects.get(user=user)
-    except (User.DoesNotExist, UserToken.DoesNotExist):
+def build_flow(redirect_uri=REDIRECT_URI):
+    from google_auth_oauthlib.flow import Flow
+
+    return Flow.from_client_config(get_client_config(), scopes=SCOPES, redirect_uri=redirect_uri)
+
+def batch_upload_files(drive_service, files):
+    """Upload files concurrently, returning one result per file in input order
+    and the Drive metadata (FILE_FIELDS) of those that were uploaded.
+
+    The Drive service is shared by the whole batch; its transport pool hands
+    each concurrent call its own keep-alive connection.
+    """
+    uploaded = []
+
+    def upload(file_obj):
+        try:
+            uploaded_file = upload_file_to_drive(drive_service, file_obj, fields=FILE_FIELDS)
+            uploaded.append(uploaded_file)
+            return {"name": file_obj.name, "file_id": uploaded_file["id"]}
+        except HttpError as e:
+            log(level=ERROR, function="batch_upload_files", message=f"{file_obj.name}: {str(e)}")
+            return {"name": file_obj.name, "error": f"Google API Error: {e._get_reason()}"}
+        except Exception as e:
+            log(level=ERROR, function="batch_upload_files", message=f"{file_obj.name}: {str(e)}")
+            return {"name": file_obj.name, "error": str(e)}
+
+    max_workers = min(settings.DRIVE_BATCH_UPLOAD_CONCURRENCY, len(files))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # Each upload runs in a copy of this request's context, so its timings count
+        futures = [pool.submit(contextvars.copy_context().run, upload, file_obj) for file_obj in files]
+        return [future.result() for future in futures], uploaded
+
+def rate_limited_response(e):
+    """429 with Retry-After when Drive is rate limiting the caller, else None."""
+    retry_after = rate_limit_retry_after(e)
+    if retry_after is None:
         return None
+    response = JsonResponse({"error": "Google Drive rate limit reached, retry later"}, status=429)
+    response["Retry-After"] = str(math.ceil(retry_after))
+    return response
 
-def build_credentials(token_data):
-    return Credentials(
-        token=token_data.access_token,
-        refresh_token=token_data.refresh_token,
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=GOOGLE_CLIENT_ID,
-        client_secret=GOOGLE_CLIENT_SECRET,
-        scopes=SCOPES
+def get_page_size(request):
+    try:
+        page_size = int(request.GET.get("page_size", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    return min(max(page_size, 1), MAX_PAGE_SIZE)
+
+def drive_listing_etag(request, user_email, start_page_token):
+    """ETag for a Drive listing: the changes feed position advances on any change."""
+    return listing_etag(
+        "drive", user_email, start_page_token, get_page_size(request), request.GET.get("page_token", "")
     )
 
+def encode_files_page(files, first_page):
+    """Encode one page of files as a fragment of the streamed JSON array."""
+    fragment = ",".join(dumps(f) for f in files)
+    if fragment and not first_page:
+        fragment = "," + fragment
+    return fragment
+
 # Views
 @csrf_exempt
 def google_auth(request):
     """Initiate Google OAuth flow"""
     try:
         log(level=INFO, function="google_auth", message="OAuth flow initiated.")
-        flow = Flow.from_client_secrets_file(
-            os.path.join(settings.BASE_DIR, "client_secret.json"),
-            scopes=SCOPES,
-            redirect_uri=REDIRECT_URI
-        )
+        # ?callback=async sends Google back to the ASGI-only callback
+        async_callback = request.GET.get("callback") == "async"
+        flow = build_flow(ASYNC_REDIRECT_URI if async_callback else REDIRECT_URI)
         auth_url, _ = flow.authorization_url(
             prompt="consent",
             access_type="offline",
@@ -93,16 +140,12 @@ def google_callback(request):
         if not code:
             return JsonResponse({"error": "Missing authorization code"}, status=400)
 
-        flow = Flow.from_client_secrets_file(
-            os.path.join(settings.BASE_DIR, "client_secret.json"),
-            scopes=SCOPES,
-            redirect_uri=REDIRECT_URI
-        )
+        flow = build_flow()
         flow.fetch_token(code=code)
 
         credentials = flow.credentials
-        user_info = requests.get(
-            "https://www.googleapis.com/oauth2/v1/userinfo",
+        user_info = get_session().get(
+            USERINFO_URI,
             headers={"Authorization": f"Bearer {credentials.token}"}
         ).json()
 
@@ -119,6 +162,7 @@ def google_callback(request):
                 "expires_at": make_aware(credentials.expiry)
             }
         )
+        invalidate_credentials(user.username)
 
         log(level=INFO, function="google_callback", message=f"User authenticated: {user.email}")
         return JsonResponse({
@@ -133,91 +177,522 @@ def google_callback(request):
 
 @csrf_exempt
 def upload_to_drive(request):
-    """Upload file to Google Drive"""
+    """Upload file to Google Drive; with ?mode=async, queue it and return 202 with a job"""
     if request.method != "POST":
         return JsonResponse({"error": "Method not allowed"}, status=405)
 
     try:
         user_email = request.headers.get("User-Email")
-        token_data = get_user_tokens(user_email)
-        if not token_data:
+        cached = get_credentials(user_email)
+        if not cached:
             return JsonResponse({"error": "Unauthorized"}, status=401)
 
-        credentials = build_credentials(token_data)
-        
-        # Auto-refresh token
-        if credentials.expired:
-            credentials.refresh(Request())
-            token_data.access_token = credentials.token
-            token_data.expires_at = make_aware(credentials.expiry)
-            token_data.save()
-            log(level=INFO, function="upload_to_drive", message="Access token refreshed.")
-
-        drive_service = build("drive", "v3", credentials=credentials)
-        
+        user = cached.token_data.user
+
+        # Hash the file as it is received, before anything is sent to Drive
+        hashing = hash_uploads(request)
         file_obj = request.FILES["file"]
-        media = MediaIoBaseUpload(
-            BytesIO(file_obj.read()),
-            mimetype=file_obj.content_type
-        )
-        
-        file_metadata = {"name": file_obj.name}
-        uploaded_file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields="id"
-        ).execute()
+        md5, size = hashing.checksums["file"][0]
+
+        if request.GET.get("mode") == "async":
+            job = enqueue_upload(user, file_obj, md5, size, dedup=request.GET.get("dedup") != "false")
+            log(level=INFO, function="upload_to_drive", message=f"Upload job {job.id} queued for {job.name}.")
+            response = JsonResponse(upload_job_json(job), status=202)
+            response["Location"] = f"/api/drive/upload/jobs/{job.id}/"
+            return response
+
+        drive_service = get_drive_service(cached.credentials)
+        if request.GET.get("dedup") != "false":
+            existing_file = deduplicate_upload(drive_service, user, file_obj.name, md5, size)
+            if existing_file:
+                return JsonResponse({"file_id": existing_file["id"], "deduplicated": True, "bytes_saved": size})
+
+        uploaded_file = upload_file_to_drive(drive_service, file_obj, fields=FILE_FIELDS)
+        upsert_files(user, [uploaded_file])
 
         log(level=INFO, function="upload_to_drive", message=f"File uploaded successfully: {uploaded_file['id']}")
-        return JsonResponse({"file_id": uploaded_file["id"]})
+        return JsonResponse({"file_id": uploaded_file["id"], "deduplicated": False, "bytes_saved": 0})
 
-    except HttpError as e:
+    except QueueFull as e:
+        log(level=ERROR, function="upload_to_drive", message=str(e))
+        response = JsonResponse({"error": "Upload queue is full, retry later"}, status=503)
+        response["Retry-After"] = "30"
+        return response
+    except (HttpError, QuotaExceeded) as e:
         log(level=ERROR, function="upload_to_drive", message=str(e))
-        return JsonResponse({"error": f"Google API Error: {str(e)}"}, status=500)
+        return rate_limited_response(e) or JsonResponse({"error": f"Google API Error: {str(e)}"}, status=500)
     except Exception as e:
         log(level=ERROR, function="upload_to_drive", message=str(e))
         return JsonResponse({"error": str(e)}, status=500)
 
 @csrf_exempt
-def list_drive_files(request):
-    """List files in Google Drive"""
+def batch_upload_to_drive(request):
+    """Upload many files to Google Drive in one request"""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        user_email = request.headers.get("User-Email")
+        cached = get_credentials(user_email)
+        if not cached:
+            return JsonResponse({"error": "Unauthorized"}, status=401)
+
+        files = request.FILES.getlist("files")
+        if not files:
+            return JsonResponse({"error": "No files provided"}, status=400)
+        if len(files) > settings.DRIVE_BATCH_UPLOAD_MAX_FILES:
+            return JsonResponse(
+                {"error": f"At most {settings.DRIVE_BATCH_UPLOAD_MAX_FILES} files per batch"}, status=400
+            )
+
+        drive_service = get_drive_service(cached.credentials)
+        results, uploaded = batch_upload_files(drive_service, files)
+        if uploaded:
+            upsert_files(cached.token_data.user, uploaded)
+
+        failed = sum(1 for result in results if "error" in result)
+        log(level=INFO, function="batch_upload_to_drive",
+            message=f"Batch upload finished: {len(results) - failed} uploaded, {failed} failed.")
+        return JsonResponse({"uploaded": len(results) - failed, "failed": failed, "results": results})
+
+    except Exception as e:
+        log(level=ERROR, function="batch_upload_to_drive", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+def parse_bulk_items(body):
+    """Normalise a bulk request body into per-file items, or raise ValueError."""
+    operation = body.get("operation")
+    if operation not in OPERATIONS:
+        raise ValueError(f"operation must be one of: {', '.join(OPERATIONS)}")
+    items = []
+    for raw in body.get("items") or []:
+        item = {"id": raw} if isinstance(raw, str) else dict(raw)
+        if operation == "move":
+            item.setdefault("folder_id", body.get("folder_id"))
+        required = {"rename": "name", "move": "folder_id"}.get(operation)
+        if not item.get("id") or (required and not item.get(required)):
+            raise ValueError(f"Each {operation} item needs an id" + (f" and {required}" if required else ""))
+        items.append(item)
+    if not items:
+        raise ValueError("No items provided")
+    if len(items) > settings.DRIVE_BULK_MAX_ITEMS:
+        raise ValueError(f"At most {settings.DRIVE_BULK_MAX_ITEMS} items per request")
+    return operation, items
+
+@csrf_exempt
+async def bulk_drive_operation(request):
+    """Get, rename, move or delete many Drive files via batch requests, streaming results as they finish"""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        user_email = request.headers.get("User-Email")
+        cached = await aget_credentials(user_email)
+        if not cached:
+            return JsonResponse({"error": "Unauthorized"}, status=401)
+
+        try:
+            operation, items = parse_bulk_items(json.loads(request.body))
+        except (ValueError, TypeError, AttributeError) as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Building the service is sync (and parses the discovery document on first use)
+        drive_service = await asyncio.to_thread(get_drive_service, cached.credentials)
+        return StreamingHttpResponse(
+            stream_bulk_results(drive_service, operation, items),
+            content_type="application/x-ndjson"
+        )
+
+    except Exception as e:
+        log(level=ERROR, function="bulk_drive_operation", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+def upload_job_status(request, job_id):
+    """Status and progress of a queued upload"""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    user_email = request.headers.get("User-Email")
+    job = UploadJob.objects.filter(id=job_id, user__username=user_email).first()
+    if not job:
+        return JsonResponse({"error": "Upload job not found"}, status=404)
+    return JsonResponse(upload_job_json(job))
+
+def upload_session_json(session):
+    return {
+        "session_id": str(session.id),
+        "name": session.name,
+        "size": session.size,
+        "committed": session.committed,
+        "complete": session.complete,
+        "file_id": session.file_id or None,
+    }
+
+def get_upload_session(request, session_id):
+    """Return (session, None) for the caller's session, or (None, error response)."""
+    user_email = request.headers.get("User-Email")
+    session = UploadSession.objects.filter(id=session_id, user__username=user_email).first()
+    if not session:
+        return None, JsonResponse({"error": "Upload session not found"}, status=404)
+    return session, None
+
+@csrf_exempt
+def create_upload_session(request):
+    """Open a client-resumable upload session backed by a Drive resumable upload"""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        user_email = request.headers.get("User-Email")
+        cached = get_credentials(user_email)
+        if not cached:
+            return JsonResponse({"error": "Unauthorized"}, status=401)
+
+        try:
+            body = json.loads(request.body)
+            name = body["name"]
+            size = int(body["size"])
+            mime_type = body.get("mime_type") or "application/octet-stream"
+        except (ValueError, TypeError, KeyError):
+            return JsonResponse({"error": "name and size are required"}, status=400)
+        if not name or size <= 0:
+            return JsonResponse({"error": "name and a positive size are required"}, status=400)
+
+        session_uri = start_drive_session(cached.credentials.token, name, mime_type, size)
+        session = UploadSession.objects.create(
+            user=cached.token_data.user, name=name, mime_type=mime_type, size=size,
+            drive_session_uri=session_uri
+        )
+
+        log(level=INFO, function="create_upload_session", message=f"Upload session {session.id} opened for {name}.")
+        return JsonResponse(upload_session_json(session), status=201)
+
+    except QuotaExceeded as e:
+        log(level=ERROR, function="create_upload_session", message=str(e))
+        return rate_limited_response(e)
+    except UploadSessionError as e:
+        log(level=ERROR, function="create_upload_session", message=str(e))
+        return JsonResponse({"error": str(e)}, status=e.status_code)
+    except Exception as e:
+        log(level=ERROR, function="create_upload_session", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+def upload_session(request, session_id):
+    """GET the committed offset of an upload session, or PUT the next byte range"""
+    if request.method not in ("GET", "PUT"):
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        session, error = get_upload_session(request, session_id)
+        if error:
+            return error
+
+        if request.method == "GET":
+            if not session.complete:
+                session = query_drive_offset(session)
+            return JsonResponse(upload_session_json(session))
+
+        if session.complete:
+            return JsonResponse(upload_session_json(session))
+
+        content_range = parse_content_range(request.headers.get("Content-Range"))
+        if not content_range or content_range[2] != session.size:
+            return JsonResponse(
+                {"error": f"Content-Range must be 'bytes start-end/{session.size}'"}, status=400
+            )
+        start, end, _ = content_range
+        try:
+            content_length = int(request.headers.get("Content-Length") or 0)
+        except ValueError:
+            content_length = None
+        if content_length != end - start + 1:
+            return JsonResponse({"error": "Content-Length does not match Content-Range"}, status=400)
+
+        if start > session.committed:
+            # Another worker may have relayed bytes it did not get to record
+            session = query_drive_offset(session)
+            if start > session.committed:
+                return JsonResponse(
+                    {"error": "Range starts past the committed offset", **upload_session_json(session)},
+                    status=416
+                )
+
+        session = relay_range(session, request, start, end)
+        if session.complete:
+            log(level=INFO, function="upload_session", message=f"Upload session {session.id} complete: {session.file_id}")
+        return JsonResponse(upload_session_json(session))
+
+    except QuotaExceeded as e:
+        log(level=ERROR, function="upload_session", message=str(e))
+        return rate_limited_response(e)
+    except UploadSessionError as e:
+        log(level=ERROR, function="upload_session", message=str(e))
+        return JsonResponse({"error": str(e)}, status=e.status_code)
+    except Exception as e:
+        log(level=ERROR, function="upload_session", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+def finalize_upload_session(request, session_id):
+    """Confirm an upload session has every byte on Drive and return the file ID"""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        session, error = get_upload_session(request, session_id)
+        if error:
+            return error
+
+        if not session.complete:
+            session = query_drive_offset(session)
+        if not session.complete:
+            return JsonResponse({"error": "Upload incomplete", **upload_session_json(session)}, status=409)
+
+        log(level=INFO, function="finalize_upload_session", message=f"Upload session {session.id} finalized.")
+        return JsonResponse({"file_id": session.file_id})
+
+    except QuotaExceeded as e:
+        log(level=ERROR, function="finalize_upload_session", message=str(e))
+        return rate_limited_response(e)
+    except UploadSessionError as e:
+        log(level=ERROR, function="finalize_upload_session", message=str(e))
+        return JsonResponse({"error": str(e)}, status=e.status_code)
+    except Exception as e:
+        log(level=ERROR, function="finalize_upload_session", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+def get_content_metadata(cached, user_email, file_id):
+    """Fetch the metadata a download needs, reusing it for DRIVE_CONTENT_METADATA_TTL seconds."""
+    key = f"drive-content-meta:{user_email}:{file_id}"
+    metadata = cache.get(key)
+    if metadata is None:
+        drive_service = get_drive_service(cached.credentials)
+        metadata = drive_service.files().get(fileId=file_id, fields=CONTENT_FIELDS).execute()
+        cache.set(key, metadata, settings.DRIVE_CONTENT_METADATA_TTL)
+    return metadata
+
+@csrf_exempt
+async def download_drive_file(request, file_id):
+    """Stream a file's contents from Drive, or from the local content cache"""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        user_email = request.headers.get("User-Email")
+        cached = await aget_credentials(user_email)
+        if not cached:
+            return JsonResponse({"error": "Unauthorized"}, status=401)
+
+        metadata = await asyncio.to_thread(get_content_metadata, cached, user_email, file_id)
+        if "size" not in metadata:
+            return JsonResponse({"error": "Google Workspace files must be exported, not downloaded"}, status=400)
+        size = int(metadata["size"])
+        tag = content_tag(metadata)
+        etag = f'"{tag}"'
+
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            response = HttpResponse(status=304)
+            response["ETag"] = etag
+            return response
+
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+        content_type = metadata.get("mimeType") or "application/octet-stream"
+        # Async iterators throughout: a sync body would be buffered whole under ASGI
+        cached_file = await asyncio.to_thread(content_cache.open, file_id, tag)
+        if cached_file:
+            response = StreamingHttpResponse(
+                read_range(cached_file, *(byte_range or (0, size - 1))), content_type=content_type
+            )
+        else:
+            upstream = await asyncio.to_thread(open_media, cached.credentials.token, file_id, byte_range)
+            if byte_range is None and content_cache.accepts(size):
+                body = stream_media(upstream, file_id, tag, size)
+            else:
+                body = stream_media(upstream, file_id)
+            response = StreamingHttpResponse(body, content_type=content_type)
+
+        if byte_range:
+            response.status_code = 206
+            response["Content-Range"] = "bytes %d-%d/%d" % (*byte_range, size)
+            response["Content-Length"] = byte_range[1] - byte_range[0] + 1
+        else:
+            response["Content-Length"] = size
+        response["ETag"] = etag
+        response["Accept-Ranges"] = "bytes"
+        response["Content-Disposition"] = content_disposition_header(False, metadata.get("name") or file_id)
+        response["X-Content-Cache"] = "hit" if cached_file else "miss"
+        return response
+
+    except QuotaExceeded as e:
+        log(level=ERROR, function="download_drive_file", message=str(e))
+        return rate_limited_response(e)
+    except HttpError as e:
+        log(level=ERROR, function="download_drive_file", message=str(e))
+        return rate_limited_response(e) or JsonResponse(
+            {"error": f"Google API Error: {e._get_reason()}"}, status=e.status_code
+        )
+    except GoogleAPIError as e:
+        log(level=ERROR, function="download_drive_file", message=str(e))
+        return rate_limited_response(e) or JsonResponse(
+            {"error": f"Google API Error: {e.reason}"}, status=e.status_code
+        )
+    except Exception as e:
+        log(level=ERROR, function="download_drive_file", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+def list_indexed_files(request):
+    """List files from the local Drive metadata index"""
     try:
         user_email = request.headers.get("User-Email")
-        token_data = get_user_tokens(user_email)
-        if not token_data:
+        cached = get_credentials(user_email)
+        if not cached:
             return JsonResponse({"error": "Unauthorized"}, status=401)
 
-        credentials = build_credentials(token_data)
-        
-        # Refresh if expired
-        if credentials.expired:
-            credentials.refresh(Request())
-            token_data.access_token = credentials.token
-            token_data.expires_at = make_aware(credentials.expiry)
-            token_data.save()
-            log(level=INFO, function="list_drive_files", message="Access token refreshed.")
-
-        drive_service = build("drive", "v3", credentials=credentials)
-
-        response = drive_service.files().list(
-            pageSize=100,
-            fields="files(id, name, mimeType, createdTime)"
-        ).execute()
-            
-        log(level=INFO, function="list_drive_files", message=f"Retrieved {len(response.get('files', []))} files.")
-        return JsonResponse({"files": response.get("files", [])})
+        user = cached.token_data.user
+        if request.GET.get("sync") == "true" or not DriveSyncState.objects.filter(user=user).exists():
+            sync_user_files(get_drive_service(cached.credentials), user)
+
+        page_size = get_page_size(request)
+        page_token = request.GET.get("page_token")
+        if page_token and not page_token.isdigit():
+            return JsonResponse({"error": "Invalid page_token"}, status=400)
+
+        sync_state = DriveSyncState.objects.get(user=user)
+        etag = listing_etag(
+            "index", user.pk, sync_state.start_page_token, sync_state.version, page_size, page_token or ""
+        )
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+
+        files = DriveFile.objects.filter(user=user).order_by("pk")
+        if page_token:
+            files = files.filter(pk__gt=int(page_token))
+        page = list(files[:page_size + 1])
+
+        next_page_token = str(page[page_size - 1].pk) if len(page) > page_size else None
+        response = json_response({
+            "files": [as_drive_json(f) for f in page[:page_size]],
+            "next_page_token": next_page_token
+        })
+        response["ETag"] = etag
+        return response
 
+    except QuotaExceeded as e:
+        log(level=ERROR, function="list_indexed_files", message=str(e))
+        return rate_limited_response(e)
     except HttpError as e:
-        log(level=ERROR, function="list_drive_files", message=str(e))
-        return JsonResponse({"error": f"Google API Error: {e._get_reason()}"}, status=e.status_code)
+        log(level=ERROR, function="list_indexed_files", message=str(e))
+        return rate_limited_response(e) or JsonResponse(
+            {"error": f"Google API Error: {e._get_reason()}"}, status=e.status_code
+        )
     except Exception as e:
-        log(level=ERROR, function="list_drive_files", message=str(e))
+        log(level=ERROR, function="list_indexed_files", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+def chat_history(request, room_name):
+    """Page back through a chat room's stored messages, newest first"""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        try:
+            messages, next_page_token = history_page(
+                room_name, get_page_size(request), request.GET.get("page_token") or None
+            )
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        return json_response({"messages": messages, "next_page_token": next_page_token})
+
+    except Exception as e:
+        log(level=ERROR, function="chat_history", message=str(e))
+        return JsonResponse({"error": str(e)}, status=500)
+
+@csrf_exempt
+def search_files(request):
+    """Search the user's files by name, type and creation date from the local index, or Drive while it is cold"""
+    if request.method != "GET":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    try:
+        user_email = request.headers.get("User-Email")
+        cached = get_credentials(user_email)
+        if not cached:
+            return JsonResponse({"error": "Unauthorized"}, status=401)
+
+        try:
+            search = parse_search_params(request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        page_size = get_page_size(request)
+        page_token = request.GET.get("page_token") or None
+
+        user = cached.token_data.user
+        sync_state = DriveSyncState.objects.filter(user=user).first()
+        if sync_state is None or (page_token or "").startswith(DRIVE_TOKEN_PREFIX):
+            drive_service = get_drive_service(cached.credentials)
+            if sync_state is None:
+                warm_index(drive_service, user)
+            files, next_page_token = search_drive(drive_service, search, page_size, page_token)
+            return json_response({"files": files, "next_page_token": next_page_token, "source": "drive"})
+
+        if page_token and not page_token.startswith(INDEX_TOKEN_PREFIX):
+            return JsonResponse({"error": "Invalid page_token"}, status=400)
+        if request.GET.get("sync") == "true":
+            sync_user_files(get_drive_service(cached.credentials), user)
+            sync_state.refresh_from_db()
+
+        etag = listing_etag(
+            "search", user.pk, sync_state.start_page_token, sync_state.version, search_key(search), page_size,
+            page_token or ""
+        )
+        unchanged = not_modified(request, etag)
+        if unchanged:
+            return unchanged
+
+        try:
+            files, next_page_token = search_index(user, search, page_size, page_token)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        response = json_response({"files": files, "next_page_token": next_page_token, "source": "index"})
+        response["ETag"] = etag
+        return response
+
+    except QuotaExceeded as e:
+        log(level=ERROR, function="search_files", message=str(e))
+        return rate_limited_response(e)
+    except HttpError as e:
+        log(level=ERROR, function="search_files", message=str(e))
+        return rate_limited_response(e) or JsonResponse(
+            {"error": f"Google API Error: {e._get_reason()}"}, status=e.status_code
+        )
+    except Exception as e:
+        log(level=ERROR, function="search_files", message=str(e))
         return JsonResponse({"error": str(e)}, status=500)
 
 def health_check(request):
     return JsonResponse({"status": "ok"})
 
+def prometheus_metrics(request):
+    """Request, Google API, upload and WebSocket metrics for this process, in Prometheus text format"""
+    if settings.METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"
+    ):
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
 def cool_terminal(request):
+    import art
+
     ascii_banner = art.text2art("I left this for the frontend dev!", font="block")
     message = "My work here is done. Time for the frontend dev to take over!"
     